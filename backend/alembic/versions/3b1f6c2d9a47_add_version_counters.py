@@ -0,0 +1,32 @@
+"""Add version counters for conditional GET
+
+Revision ID: 3b1f6c2d9a47
+Revises: 62ec4cee5594
+Create Date: 2026-10-18 10:12:41.385102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f6c2d9a47'
+down_revision = '62ec4cee5594'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('targets', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), server_default='1', nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+    op.bulk_insert(table_versions, [{'name': 'targets'}, {'name': 'pictures'}])
+
+
+def downgrade():
+    op.drop_table('table_versions')
+    op.drop_column('targets', 'version')
@@ -0,0 +1,28 @@
+"""Index pictures.target_id
+
+Revision ID: a6e2c94f0b18
+Revises: 3b1f6c2d9a47
+Create Date: 2026-10-18 14:03:27.518260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database.migration_helpers import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6e2c94f0b18'
+down_revision = '3b1f6c2d9a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (target_id, id) serves the foreign key (pictures of a target, deleting a
+    # target) and the pictures listed in target_id order
+    create_index_concurrently('ix_pictures_target_id', 'pictures', ['target_id', 'id'])
+
+
+def downgrade():
+    drop_index_concurrently('ix_pictures_target_id', 'pictures')
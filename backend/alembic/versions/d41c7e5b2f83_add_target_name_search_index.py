@@ -0,0 +1,46 @@
+"""Add trigram index for the target name search
+
+Revision ID: d41c7e5b2f83
+Revises: a6e2c94f0b18
+Create Date: 2026-10-18 16:21:54.073918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database.migration_helpers import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7e5b2f83'
+down_revision = 'a6e2c94f0b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # other databases fall back to LIKE scans (app.database.search)
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    # GiST rather than GIN: it returns the rows in distance order (KNN), the id
+    # (as float8, distances being lossy) orders the ties
+    create_index_concurrently(
+        'ix_targets_name_trgm',
+        'targets',
+        [
+            sa.text(
+                "(lower(coalesce(first_name, '') || ' ' || coalesce(last_name, ''))) "
+                "gist_trgm_ops(siglen=128)"
+            ),
+            sa.text('(id::float8)'),
+        ],
+        postgresql_using='gist',
+    )
+
+
+def downgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    drop_index_concurrently('ix_targets_name_trgm', 'targets')
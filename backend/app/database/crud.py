@@ -1,33 +1,337 @@
 """CRUD operations on database."""
+from collections import defaultdict
+import io
+from types import SimpleNamespace
 import typing as tp
 
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from sqlalchemy import any_, bindparam, insert, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, joinedload, noload, selectinload
 
-from . import models, schemas
+from app.service.tracing import traced
 
+from . import models, schemas, versions
+from .filters import TargetFilters
+from .search import TargetSearch
+from .cache import target_cache
+from .pagination import DEFAULT_PAGE_SIZE, Keyset, Page
 
-def get_target(db: Session, target_id: int) -> schemas.Target:
-    target = db.query(models.Target).filter(models.Target.id == target_id).first()
+TARGET_SORT_KEYS = {"id", "first_name", "last_name", "dob", "picture_count"}
+PICTURE_SORT_KEYS = {"id", "target_id"}
+
+# rows per multi-row INSERT statement
+BULK_CHUNK_SIZE = 1000
+
+TARGET_RELATIONSHIPS = {"pictures": models.Target.pictures}
+# fields of a target with its pictures, the default of the batch get
+TARGET_FIELDS = frozenset(schemas.Target.__fields__)
+
+
+def parse_include(include: tp.Optional[str]) -> tp.FrozenSet[str]:
+    """Parse a comma-separated ``?include=`` parameter."""
+    names = frozenset(name.strip() for name in (include or "").split(",") if name.strip())
+    unknown = names - TARGET_RELATIONSHIPS.keys()
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot include {sorted(unknown)}, expected {sorted(TARGET_RELATIONSHIPS)}",
+        )
+    return names
+
+
+def target_load_options(
+    include: tp.Collection[str] = (), strategy: tp.Callable = selectinload
+) -> tp.List[tp.Any]:
+    """Eager load the ``include``d relationships with ``strategy``.
+
+    Relationships that are not included are never loaded, their attribute
+    stays empty instead of lazy loading one query per target.
+    """
+    return [
+        strategy(relationship) if name in include else noload(relationship)
+        for name, relationship in TARGET_RELATIONSHIPS.items()
+    ]
+
+
+def parse_fields(
+    fields: tp.Optional[str], schema: tp.Type[BaseModel]
+) -> tp.Optional[tp.FrozenSet[str]]:
+    """Parse a comma-separated ``?fields=`` parameter against the fields of ``schema``.
+
+    Returns None when the parameter is absent.
+    """
+    if fields is None:
+        return None
+    names = frozenset(name.strip() for name in fields.split(",") if name.strip())
+    unknown = names - schema.__fields__.keys()
+    if not names or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid fields {sorted(unknown)}, expected some of {sorted(schema.__fields__)}",
+        )
+    return names
+
+
+def projected_select(model: tp.Any, fields: tp.Collection[str], *keys: str) -> tp.Any:
+    """Select the ``fields`` columns of ``model`` and the ``keys`` ones, in table order.
+
+    Relationship fields aren't columns, they are loaded by ``with_pictures``.
+    """
+    names = set(fields).union(keys)
+    return select(*(column for column in model.__table__.columns if column.key in names))
+
+
+def id_in(column: tp.Any, ids: tp.Collection[int], dialect: str) -> tp.Any:
+    """Criterion ``column`` in ``ids``.
+
+    On Postgres ``column = ANY(:ids)``, one array parameter whatever the
+    number of ids, so the statement text (and its cached plan) stays the same.
+    """
+    if dialect == "postgresql":
+        return column == any_(bindparam(None, list(ids), type_=ARRAY(column.type)))
+    return column.in_(ids)
+
+
+def pictures_query(target_ids: tp.Collection[int], dialect: str) -> tp.Any:
+    """Select the pictures of the targets ``target_ids``."""
+    return (
+        select(*models.Picture.__table__.columns)
+        .where(id_in(models.Picture.target_id, target_ids, dialect))
+        .order_by(models.Picture.target_id, models.Picture.id)
+    )
+
+
+def with_pictures(rows: tp.Sequence[tp.Any], pictures: tp.Iterable[tp.Any]) -> tp.List[tp.Any]:
+    """Attach to each target row the ``pictures`` rows pointing to it."""
+    by_target = defaultdict(list)
+    for picture in pictures:
+        by_target[picture.target_id].append(picture)
+    return [SimpleNamespace(**row._mapping, pictures=by_target[row.id]) for row in rows]
+
+
+def in_order(
+    rows: tp.Iterable[tp.Any], ids: tp.Sequence[int]
+) -> tp.Tuple[tp.List[tp.Any], tp.List[int]]:
+    """Order ``rows`` like ``ids``, and return the ids with no row."""
+    by_id = {row.id: row for row in rows}
+    return [by_id[id_] for id_ in ids if id_ in by_id], [id_ for id_ in ids if id_ not in by_id]
+
+
+def pictures_of(rows: tp.Sequence[tp.Any], fields: tp.Collection[str], dialect: str) -> tp.Any:
+    """Return the query of the pictures of target ``rows``, None if ``fields`` lack them."""
+    if "pictures" not in fields or not rows:
+        return None
+    return pictures_query([row.id for row in rows], dialect)
+
+
+def target_query(
+    target_id: int,
+    include: tp.Collection[str] = TARGET_RELATIONSHIPS.keys(),
+    strategy: tp.Callable = joinedload,
+) -> tp.Any:
+    """Select a target with its ``include``d relationships."""
+    return (
+        select(models.Target)
+        .options(*target_load_options(include, strategy))
+        .where(models.Target.id == target_id)
+    )
+
+
+def target_row_query(target_id: int, fields: tp.Collection[str]) -> tp.Any:
+    """Select the ``fields`` columns of a target and its ``version``."""
+    return projected_select(models.Target, fields, "id", "version").where(
+        models.Target.id == target_id
+    )
+
+
+def targets_by_ids_query(
+    ids: tp.Collection[int], fields: tp.Collection[str], dialect: str
+) -> tp.Any:
+    """Select the ``fields`` columns of the targets ``ids``, in no particular order."""
+    query = projected_select(models.Target, fields, "id")
+    return query.where(id_in(models.Target.id, ids, dialect))
+
+
+class PageQuery:
+    """Select of a keyset page of ``model``, shared by ``crud`` and ``crud_async``.
+
+    With ``fields``, the rows are those columns (and the keyset keys) rather
+    than ORM instances, the pictures of target rows are read by
+    ``pictures_of`` afterwards.
+    """
+
+    def __init__(
+        self,
+        model: tp.Any,
+        sortable: tp.Iterable[str],
+        sort: str,
+        limit: int,
+        cursor: tp.Optional[str] = None,
+        fields: tp.Optional[tp.Collection[str]] = None,
+        options: tp.Sequence[tp.Any] = (),
+        criteria: tp.Sequence[tp.Any] = (),
+    ) -> None:
+        self.keyset = Keyset(model, sort, sortable)
+        self.limit = limit
+        self.fields = fields
+        if fields is None:
+            query = select(model).options(*options)
+        else:
+            query = projected_select(model, fields, *self.keyset.keys)
+        if criteria:
+            query = query.where(*criteria)
+        if cursor:
+            query = query.where(self.keyset.after(cursor))
+        self.query = query.order_by(*self.keyset.order_by()).limit(limit + 1)
+
+    def page(self, result: tp.Any) -> Page:
+        """Build the page out of the result of ``query``."""
+        rows = result.all() if self.fields is not None else result.unique().scalars().all()
+        return self.keyset.page(rows, self.limit)
+
+
+def target_page_query(
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: tp.Optional[str] = None,
+    sort: str = "id",
+    include: tp.Collection[str] = (),
+    filters: tp.Optional[TargetFilters] = None,
+    fields: tp.Optional[tp.Collection[str]] = None,
+    strategy: tp.Callable = selectinload,
+) -> PageQuery:
+    """Page of targets, with the ``include``d relationships or only the ``fields``."""
+    return PageQuery(
+        models.Target,
+        TARGET_SORT_KEYS,
+        sort,
+        limit,
+        cursor,
+        fields=fields,
+        options=target_load_options(include, strategy),
+        criteria=filters.criteria(sort) if filters is not None else (),
+    )
+
+
+def picture_page_query(
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: tp.Optional[str] = None,
+    sort: str = "id",
+    fields: tp.Optional[tp.Collection[str]] = None,
+) -> PageQuery:
+    """Page of pictures, or of only their ``fields``."""
+    return PageQuery(models.Picture, PICTURE_SORT_KEYS, sort, limit, cursor, fields=fields)
+
+
+@traced()
+def get_table_versions(db: Session, tables: tp.Collection[str]) -> tp.Dict[str, int]:
+    return versions.get_table_versions(db, tables)
+
+
+@traced()
+def get_target_version(db: Session, target_id: int) -> tp.Optional[int]:
+    return versions.get_target_version(db, target_id)
+
+
+@traced()
+def get_target(
+    db: Session,
+    target_id: int,
+    include: tp.Collection[str] = TARGET_RELATIONSHIPS.keys(),
+    strategy: tp.Callable = joinedload,
+) -> schemas.Target:
+    target = db.execute(target_query(target_id, include, strategy)).unique().scalars().first()
     if not target:
         raise HTTPException(status_code=404, detail="Target not found")
     return target
 
 
+@traced()
+def get_page(db: Session, paged: PageQuery) -> Page:
+    page = paged.page(db.execute(paged.query))
+    pictures = pictures_of(page.items, paged.fields or (), db.get_bind().dialect.name)
+    if pictures is not None:
+        page = page._replace(items=with_pictures(page.items, db.execute(pictures)))
+    return page
+
+
 def get_targets(
-    db: Session, skip: int = 0, limit: int = 100
-) -> tp.List[schemas.Target]:
-    return db.query(models.Target).offset(skip).limit(limit).all()
+    db: Session,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: tp.Optional[str] = None,
+    sort: str = "id",
+    include: tp.Collection[str] = (),
+    strategy: tp.Callable = selectinload,
+    filters: tp.Optional[TargetFilters] = None,
+) -> Page:
+    return get_page(db, target_page_query(limit, cursor, sort, include, filters, strategy=strategy))
+
+
+@traced()
+def get_target_row(db: Session, target_id: int, fields: tp.Collection[str]) -> tp.Any:
+    """Get the ``fields`` of a target, and its ``version``, as a row."""
+    row = db.execute(target_row_query(target_id, fields)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Target not found")
+    pictures = pictures_of([row], fields, db.get_bind().dialect.name)
+    if pictures is not None:
+        row = with_pictures([row], db.execute(pictures))[0]
+    return row
+
+
+@traced()
+def get_targets_by_ids(
+    db: Session, ids: tp.Sequence[int], fields: tp.Collection[str] = TARGET_FIELDS
+) -> tp.Tuple[tp.List[tp.Any], tp.List[int]]:
+    """Get the ``fields`` of the targets ``ids`` as rows, in the order of ``ids``.
+
+    Returns the rows found and the ids not found.
+    """
+    dialect = db.get_bind().dialect.name
+    rows = db.execute(targets_by_ids_query(ids, fields, dialect)).all()
+    pictures = pictures_of(rows, fields, dialect)
+    if pictures is not None:
+        rows = with_pictures(rows, db.execute(pictures))
+    return in_order(rows, ids)
+
 
+@traced()
+def search_targets(
+    db: Session, q: str, limit: int = DEFAULT_PAGE_SIZE, cursor: tp.Optional[str] = None
+) -> Page:
+    search = TargetSearch(q, db.get_bind().dialect.name)
+    rows = db.execute(search.query(limit, cursor).options(*target_load_options())).all()
+    return search.page(rows, limit)
 
+
+def stream_targets(
+    db: Session, include: tp.Collection[str] = (), batch_size: int = 1000
+) -> tp.Iterator[models.Target]:
+    """Iterate over every target with a server-side cursor, ``batch_size`` rows at a time."""
+    query = (
+        db.query(models.Target)
+        .options(*target_load_options(include, selectinload))
+        .order_by(models.Target.id)
+        .execution_options(stream_results=True)
+        .yield_per(batch_size)
+    )
+    yield from query
+
+
+@traced()
 def create_target(db: Session, target: schemas.TargetIn) -> schemas.Target:
     db_target = models.Target(**target.dict())
     db.add(db_target)
     db.commit()
+    versions.bump_tables(db, {versions.TARGETS})
+    target_cache.invalidate()
     db.refresh(db_target)
     return db_target
 
 
+@traced()
 def edit_target(
     db: Session, target_id: int, target: schemas.TargetIn
 ) -> schemas.Target:
@@ -40,31 +344,319 @@ def edit_target(
         setattr(db_target, key, value)
 
     db.add(db_target)
+    versions.bump_targets(db, {target_id})
     db.commit()
+    versions.bump_tables(db, {versions.TARGETS})
+    target_cache.invalidate([target_id])
     db.refresh(db_target)
     return db_target
 
 
+@traced()
 def delete_target(db: Session, target_id: int) -> schemas.Target:
     target = get_target(db, target_id)
     if not target:
         raise HTTPException(status_code=404, detail="Target not found")
     db.delete(target)
     db.commit()
+    versions.bump_tables(db, {versions.TARGETS, versions.PICTURES})
+    target_cache.invalidate([target_id])
     return target
 
 
-def get_pictures(
-    db: Session, skip: int = 0, limit: int = 100
-) -> tp.List[schemas.Picture]:
-    return db.query(models.Picture).offset(skip).limit(limit).all()
+def add_pictures_statement(target_id: int, count: int) -> tp.Any:
+    """Return the statement adding ``count`` to the ``picture_count`` of a target."""
+    return (
+        update(models.Target)
+        .where(models.Target.id == target_id)
+        .values(picture_count=models.Target.picture_count + count)
+        .execution_options(synchronize_session=False)
+    )
 
 
+@traced()
 def create_target_picture(
     db: Session, picture: schemas.PictureCreate, target_id: int
 ) -> schemas.Picture:
     db_picture = models.Picture(**picture.dict(), target_id=target_id)
     db.add(db_picture)
+    db.execute(add_pictures_statement(target_id, 1))
+    versions.bump_targets(db, {target_id})
     db.commit()
+    versions.bump_tables(db, {versions.PICTURES})
+    target_cache.invalidate([target_id])
     db.refresh(db_picture)
     return db_picture
+
+
+def _insert_many(db: Session, model: tp.Any, rows: tp.List[dict]) -> tp.List[dict]:
+    """Insert ``rows`` with multi-row INSERT ... RETURNING, in input order."""
+    if not rows:
+        return []
+    table = model.__table__
+    if not db.get_bind().dialect.full_returning:
+        # no RETURNING (e.g. SQLite): fall back to executemany-style ORM flush
+        objects = [model(**row) for row in rows]
+        db.add_all(objects)
+        db.flush()
+        return [{column.key: getattr(obj, column.key) for column in table.columns} for obj in objects]
+
+    created = []
+    for start in range(0, len(rows), BULK_CHUNK_SIZE):
+        result = db.execute(
+            insert(table).values(rows[start : start + BULK_CHUNK_SIZE]).returning(*table.columns)
+        )
+        created.extend(dict(row._mapping) for row in result)
+    return created
+
+
+@traced()
+def create_targets_bulk(
+    db: Session, targets: tp.List[schemas.TargetBulkIn]
+) -> tp.List[schemas.Target]:
+    """Create targets and their nested pictures in a single transaction."""
+    created = _insert_many(
+        db,
+        models.Target,
+        [
+            dict(target.dict(exclude={"pictures"}), picture_count=len(target.pictures))
+            for target in targets
+        ],
+    )
+    pictures = _insert_many(
+        db,
+        models.Picture,
+        [
+            dict(picture.dict(), target_id=db_target["id"])
+            for target, db_target in zip(targets, created)
+            for picture in target.pictures
+        ],
+    )
+    db.commit()
+    tables = {versions.TARGETS, versions.PICTURES} if pictures else {versions.TARGETS}
+    versions.bump_tables(db, tables)
+    target_cache.invalidate()
+
+    pictures_by_target: tp.Dict[int, tp.List[dict]] = {}
+    for picture in pictures:
+        pictures_by_target.setdefault(picture["target_id"], []).append(picture)
+    return [
+        schemas.Target(**db_target, pictures=pictures_by_target.get(db_target["id"], []))
+        for db_target in created
+    ]
+
+
+@traced()
+def create_target_pictures_bulk(
+    db: Session, pictures: tp.List[schemas.PictureCreate], target_id: int
+) -> tp.List[schemas.Picture]:
+    """Create pictures belonging to a target in a single transaction."""
+    if not db.query(models.Target.id).filter(models.Target.id == target_id).first():
+        raise HTTPException(status_code=404, detail="Target not found")
+    created = _insert_many(
+        db, models.Picture, [dict(picture.dict(), target_id=target_id) for picture in pictures]
+    )
+    db.execute(add_pictures_statement(target_id, len(created)))
+    versions.bump_targets(db, {target_id})
+    db.commit()
+    versions.bump_tables(db, {versions.PICTURES})
+    target_cache.invalidate([target_id])
+    return [schemas.Picture(**picture) for picture in created]
+
+
+COPY_NULL = "\\N"
+
+
+class ImportCounts(tp.NamedTuple):
+    created: int
+    updated: int
+    pictures: int
+    missing: tp.List[int]
+
+
+def _copy(
+    connection: tp.Any, table: str, columns: tp.Sequence[str], rows: tp.Iterable[tuple]
+) -> None:
+    buffer = io.StringIO()
+    # every value is quoted, only the bare marker reads as NULL (not an empty
+    # string, nor a value equal to the marker)
+    for row in rows:
+        buffer.write(
+            ",".join(
+                COPY_NULL if value is None else '"' + str(value).replace('"', '""') + '"'
+                for value in row
+            )
+            + "\n"
+        )
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+        buffer,
+    )
+
+
+class TargetImport:
+    """Import of targets and their pictures, staged chunk by chunk and merged at once.
+
+    Rows with an ``id`` update that target, the others create one, and
+    pictures are added to the target of their row. On Postgres, each chunk
+    is copied into temporary staging tables in a short transaction of its
+    own, over a connection held for the import, and ``merge`` applies them
+    in one final transaction, along with the table versions: the targets
+    are only locked, and the other writes only wait, for the merge. Other
+    databases apply the chunks through the ORM in the transaction ``merge``
+    commits. ``close`` drops the staging tables, merged or not.
+    """
+
+    def __init__(self, db: Session) -> None:
+        self.db = db
+        self.connection = None
+        self._counts = ImportCounts(0, 0, 0, [])
+        if db.get_bind().dialect.name != "postgresql":
+            return
+        self.connection = db.get_bind().connect()
+        with self.connection.begin():
+            self.connection.execute(
+                text(
+                    "CREATE TEMP TABLE target_import (row_no integer PRIMARY KEY, id integer, "
+                    "first_name varchar, last_name varchar, dob date, "
+                    "is_new boolean NOT NULL DEFAULT false)"
+                )
+            )
+            self.connection.execute(
+                text("CREATE TEMP TABLE picture_import (row_no integer, path varchar)")
+            )
+
+    @traced("crud.stage_import")
+    def stage(self, rows: tp.List[tp.Tuple[int, schemas.TargetImportIn]]) -> None:
+        """Add a chunk of import rows, keyed by row number."""
+        if self.connection is None:
+            counts = _import_targets_orm(self.db, rows)
+            self._counts = ImportCounts(
+                *(total + count for total, count in zip(self._counts[:3], counts[:3])),
+                self._counts.missing + counts.missing,
+            )
+            return
+        with self.connection.begin():
+            _copy(
+                self.connection,
+                "target_import",
+                ("row_no", "id", "first_name", "last_name", "dob"),
+                (
+                    (row, target.id, target.first_name, target.last_name, target.dob.isoformat())
+                    for row, target in rows
+                ),
+            )
+            _copy(
+                self.connection,
+                "picture_import",
+                ("row_no", "path"),
+                ((row, picture.path) for row, target in rows for picture in target.pictures),
+            )
+
+    @traced("crud.merge_import")
+    def merge(self) -> ImportCounts:
+        """Apply the staged rows and commit, return what was created and updated."""
+        tables = {versions.TARGETS, versions.PICTURES}
+        if self.connection is None:
+            versions.bump(self.db, tables)
+            self.db.commit()
+        else:
+            with self.connection.begin():
+                self._counts = self._merge_staged()
+                self.connection.execute(versions.table_bump_statement(tables))
+        return self._counts
+
+    def _merge_staged(self) -> ImportCounts:
+        connection = self.connection
+        missing = [
+            row
+            for row, in connection.execute(
+                text(
+                    "SELECT s.row_no FROM target_import s WHERE s.id IS NOT NULL "
+                    "AND NOT EXISTS (SELECT 1 FROM targets t WHERE t.id = s.id) ORDER BY s.row_no"
+                )
+            )
+        ]
+        updated = connection.execute(
+            text(
+                "UPDATE targets t SET first_name = s.first_name, last_name = s.last_name, "
+                "dob = s.dob, version = t.version + 1 FROM target_import s WHERE t.id = s.id"
+            )
+        ).rowcount
+        # allocate the ids of new targets upfront so that pictures can refer to them
+        connection.execute(
+            text(
+                "UPDATE target_import SET id = nextval(pg_get_serial_sequence('targets', 'id')), "
+                "is_new = true WHERE id IS NULL"
+            )
+        )
+        created = connection.execute(
+            text(
+                "INSERT INTO targets (id, first_name, last_name, dob) "
+                "SELECT id, first_name, last_name, dob FROM target_import WHERE is_new "
+                "ORDER BY row_no"
+            )
+        ).rowcount
+        pictures = connection.execute(
+            text(
+                "INSERT INTO pictures (path, target_id) "
+                "SELECT p.path, s.id FROM picture_import p JOIN target_import s USING (row_no) "
+                "WHERE s.is_new OR EXISTS (SELECT 1 FROM targets t WHERE t.id = s.id)"
+            )
+        ).rowcount
+        connection.execute(
+            text(
+                "UPDATE targets t SET picture_count = t.picture_count + c.n FROM ("
+                "SELECT s.id, count(*) AS n FROM picture_import p "
+                "JOIN target_import s USING (row_no) GROUP BY s.id) c WHERE t.id = c.id"
+            )
+        )
+        return ImportCounts(created, updated, pictures, missing)
+
+    def close(self) -> None:
+        if self.connection is None:
+            return
+        try:
+            # the connection goes back to the pool, without the staging tables
+            with self.connection.begin():
+                self.connection.execute(text("DROP TABLE IF EXISTS target_import, picture_import"))
+        except SQLAlchemyError:
+            # the tables go away with the session of a discarded connection
+            self.connection.invalidate()
+        finally:
+            self.connection.close()
+            self.connection = None
+
+
+def _import_targets_orm(
+    db: Session, rows: tp.List[tp.Tuple[int, schemas.TargetImportIn]]
+) -> ImportCounts:
+    created = updated = pictures = 0
+    missing = []
+    updated_ids = set()
+    for row, target in rows:
+        fields = target.dict(exclude={"id", "pictures"})
+        if target.id is None:
+            db_target = models.Target(**fields, picture_count=0)
+            db.add(db_target)
+            db.flush()
+            created += 1
+        else:
+            db_target = db.query(models.Target).get(target.id)
+            if db_target is None:
+                missing.append(row)
+                continue
+            for key, value in fields.items():
+                setattr(db_target, key, value)
+            updated_ids.add(db_target.id)
+            updated += 1
+        db_target.picture_count += len(target.pictures)
+        db.add_all(
+            models.Picture(**picture.dict(), target_id=db_target.id) for picture in target.pictures
+        )
+        pictures += len(target.pictures)
+    db.flush()
+    versions.bump_targets(db, updated_ids)
+    return ImportCounts(created, updated, pictures, missing)
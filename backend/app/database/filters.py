@@ -0,0 +1,123 @@
+"""Filters of the targets list, translated to indexed SQL predicates."""
+from datetime import date
+import typing as tp
+
+from fastapi import HTTPException, Query
+
+from . import models
+from .search import LIKE_ESCAPE, escape_like
+
+# Indexes of the targets table serving the filters and sort orders of the
+# list with one range scan: the filters are on leading columns, equality on
+# all of them but the last one, equality or range on the last one. The list
+# is then sorted by the column following the equalities, or by the range
+# column itself.
+FILTER_INDEXES = (
+    ("last_name", "dob", "id"),  # ix_targets_last_name_dob
+    ("last_name", "id"),  # ix_targets_last_name_id
+    ("last_name_prefix",),  # ix_targets_last_name_pattern
+    ("dob", "id"),  # ix_targets_dob_id
+    ("picture_count", "id"),  # ix_targets_picture_count_id
+)
+
+# sort key of the filtered columns named after their filter
+SORT_KEYS = {"last_name_prefix": "last_name"}
+
+
+class TargetFilters:
+    """Query parameters filtering the targets list."""
+
+    def __init__(
+        self,
+        last_name: tp.Optional[str] = Query(None, description="Exact last name"),
+        last_name_prefix: tp.Optional[str] = Query(
+            None, min_length=1, description="Last name prefix"
+        ),
+        dob_from: tp.Optional[date] = Query(None, description="Born on or after"),
+        dob_to: tp.Optional[date] = Query(None, description="Born on or before"),
+        has_pictures: tp.Optional[bool] = None,
+        min_pictures: tp.Optional[int] = Query(None, ge=0),
+        max_pictures: tp.Optional[int] = Query(None, ge=0),
+    ) -> None:
+        self.last_name = last_name
+        self.last_name_prefix = last_name_prefix
+        self.dob_from = dob_from
+        self.dob_to = dob_to
+        self.has_pictures = has_pictures
+        self.min_pictures = min_pictures
+        self.max_pictures = max_pictures
+
+    @property
+    def filters_pictures(self) -> bool:
+        return (self.has_pictures, self.min_pictures, self.max_pictures) != (None, None, None)
+
+    def _columns(self) -> tp.Dict[str, bool]:
+        """Return the filtered columns, mapped to whether the filter is an equality."""
+        columns = {}
+        if self.last_name is not None:
+            columns["last_name"] = True
+        if self.last_name_prefix is not None:
+            columns["last_name_prefix"] = False
+        if self.dob_from is not None or self.dob_to is not None:
+            columns["dob"] = self.dob_from is not None and self.dob_from == self.dob_to
+        if self.filters_pictures:
+            columns["picture_count"] = self.has_pictures is False or (
+                self.min_pictures is not None and self.min_pictures == self.max_pictures
+            )
+        return columns
+
+    def check_indexed(self, sort: str = "id") -> None:
+        """Reject the filters and ``sort`` order no index can serve together (HTTP 400).
+
+        The rows matching the filters must be the range of one index, read in
+        the sort order, so that a page never scans nor sorts the targets the
+        filters exclude.
+        """
+        columns = self._columns()
+        if not columns:
+            return
+        sort_key = sort.lstrip("-")
+        for index in FILTER_INDEXES:
+            prefix, rest = index[: len(columns)], index[len(columns) :]
+            if set(prefix) != columns.keys():
+                continue
+            if not all(columns[column] for column in prefix[:-1]):
+                continue
+            if columns[prefix[-1]]:
+                order = rest[:1]
+            else:
+                order = (SORT_KEYS.get(prefix[-1], prefix[-1]),)
+            if order == (sort_key,):
+                return
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"No index supports filtering on {sorted(columns)} sorted by {sort_key}, "
+                f"supported indexes are {[list(index) for index in FILTER_INDEXES]} "
+                "(equality on all the filtered columns but the last one, sorted by the "
+                "column after the equalities or by the range column)"
+            ),
+        )
+
+    def criteria(self, sort: str = "id") -> tp.List[tp.Any]:
+        """Return the SQL predicates of the filters, after checking they are indexed."""
+        self.check_indexed(sort)
+        target = models.Target
+        criteria = []
+        if self.last_name is not None:
+            criteria.append(target.last_name == self.last_name)
+        if self.last_name_prefix is not None:
+            criteria.append(
+                target.last_name.like(escape_like(self.last_name_prefix) + "%", escape=LIKE_ESCAPE)
+            )
+        if self.dob_from is not None:
+            criteria.append(target.dob >= self.dob_from)
+        if self.dob_to is not None:
+            criteria.append(target.dob <= self.dob_to)
+        if self.has_pictures is not None:
+            criteria.append(target.picture_count > 0 if self.has_pictures else target.picture_count == 0)
+        if self.min_pictures is not None:
+            criteria.append(target.picture_count >= self.min_pictures)
+        if self.max_pictures is not None:
+            criteria.append(target.picture_count <= self.max_pictures)
+        return criteria
@@ -0,0 +1,152 @@
+"""Helpers for alembic migrations."""
+import typing as tp
+
+from alembic import op
+from sqlalchemy import text
+
+# rows updated per transaction by update_in_batches
+BATCH_SIZE = 10000
+
+
+def _online_postgresql() -> bool:
+    context = op.get_context()
+    return context.dialect.name == "postgresql" and not context.as_sql
+
+
+def _index_valid(index_name: str) -> tp.Optional[bool]:
+    """Return whether the index is valid, None if it doesn't exist."""
+    return (
+        op.get_bind()
+        .execute(
+            text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+            {"name": index_name},
+        )
+        .scalar()
+    )
+
+
+def create_index_concurrently(
+    index_name: str, table_name: str, columns: tp.Sequence[tp.Any], **kw: tp.Any
+) -> None:
+    """Create an index without blocking the writes to a (large) table.
+
+    On Postgres the index is built with ``CREATE INDEX CONCURRENTLY``, which
+    can't run in a transaction: the migration transaction is committed first
+    and the index is built in autocommit mode. A build interrupted midway
+    leaves an invalid index behind, it is dropped and rebuilt when the
+    migration is run again, while a valid index is kept as is.
+
+    Other databases, and offline (``--sql``) migrations, get a plain
+    ``CREATE INDEX``.
+
+    Args:
+        index_name: name of the index
+        table_name: indexed table
+        columns: column names or expressions, as for ``op.create_index``
+        kw: other ``op.create_index`` arguments, e.g. ``unique`` or
+            ``postgresql_using``
+    """
+    if not _online_postgresql():
+        op.create_index(index_name, table_name, columns, **kw)
+        return
+    with op.get_context().autocommit_block():
+        valid = _index_valid(index_name)
+        if valid:
+            return
+        if valid is not None:
+            op.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"'))
+        op.create_index(index_name, table_name, columns, postgresql_concurrently=True, **kw)
+
+
+def drop_index_concurrently(index_name: str, table_name: str) -> None:
+    """Drop an index without blocking the reads and writes to its table."""
+    if not _online_postgresql():
+        op.drop_index(index_name, table_name=table_name)
+        return
+    with op.get_context().autocommit_block():
+        op.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"'))
+
+
+def set_not_null(table_name: str, columns: tp.Mapping[str, tp.Any]) -> None:
+    """Declare columns NOT NULL, failing first if some rows hold NULLs.
+
+    NULLs can't be backfilled without knowing the data (e.g. a date of
+    birth), so the migration stops with the count of the rows to fix.
+
+    On Postgres, the rows are checked by validating a ``CHECK (... IS NOT
+    NULL)`` constraint, which doesn't block the writes, and ``SET NOT NULL``
+    then relies on it instead of scanning the table under an exclusive lock.
+    Each statement commits on its own, an interrupted run can be resumed.
+
+    Args:
+        table_name: altered table
+        columns: column names mapped to their existing types
+    """
+    if not op.get_context().as_sql:
+        nulls = {
+            column: op.get_bind()
+            .execute(text(f'SELECT count(*) FROM "{table_name}" WHERE "{column}" IS NULL'))
+            .scalar()
+            for column in columns
+        }
+        nulls = {column: count for column, count in nulls.items() if count}
+        if nulls:
+            counts = ", ".join(f"{count} rows with a NULL {column}" for column, count in nulls.items())
+            raise RuntimeError(
+                f"Can't declare {', '.join(nulls)} of {table_name} NOT NULL: {counts}. "
+                f"Set or delete these rows and run the upgrade again."
+            )
+    if not _online_postgresql():
+        with op.batch_alter_table(table_name) as batch_op:
+            for column, existing_type in columns.items():
+                batch_op.alter_column(column, existing_type=existing_type, nullable=False)
+        return
+    with op.get_context().autocommit_block():
+        for column in columns:
+            constraint = f"ck_{table_name}_{column}_not_null"
+            op.execute(text(f'ALTER TABLE "{table_name}" DROP CONSTRAINT IF EXISTS "{constraint}"'))
+            op.execute(
+                text(
+                    f'ALTER TABLE "{table_name}" ADD CONSTRAINT "{constraint}" '
+                    f'CHECK ("{column}" IS NOT NULL) NOT VALID'
+                )
+            )
+            op.execute(text(f'ALTER TABLE "{table_name}" VALIDATE CONSTRAINT "{constraint}"'))
+            op.execute(text(f'ALTER TABLE "{table_name}" ALTER COLUMN "{column}" SET NOT NULL'))
+            op.execute(text(f'ALTER TABLE "{table_name}" DROP CONSTRAINT "{constraint}"'))
+
+
+def update_in_batches(
+    table_name: str, values: str, where: tp.Optional[str] = None, batch_size: int = BATCH_SIZE
+) -> None:
+    """Update a (large) table by ranges of ``batch_size`` ids.
+
+    On Postgres each range is updated and committed on its own, so that the
+    row locks are short-lived and an interrupted run keeps its progress: the
+    statement should be idempotent (e.g. restricted by ``where`` to the rows
+    still to update). Other databases, and offline migrations, get a single
+    ``UPDATE``.
+
+    Args:
+        table_name: updated table, with an integer ``id`` primary key
+        values: SQL of the ``SET`` clause
+        where: SQL condition restricting the updated rows
+        batch_size: ids per range
+    """
+    condition = f" AND ({where})" if where else ""
+    if not _online_postgresql():
+        op.execute(text(f'UPDATE "{table_name}" SET {values}' + (f" WHERE {where}" if where else "")))
+        return
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        low, high = bind.execute(text(f'SELECT min(id), max(id) FROM "{table_name}"')).first()
+        if low is None:
+            return
+        for start in range(low, high + 1, batch_size):
+            bind.execute(
+                text(
+                    f'UPDATE "{table_name}" SET {values} '
+                    f"WHERE id >= :start AND id < :stop{condition}"
+                ),
+                {"start": start, "stop": start + batch_size},
+            )
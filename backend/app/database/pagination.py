@@ -0,0 +1,140 @@
+"""Keyset (cursor) pagination helpers shared by ``crud`` and ``crud_async``."""
+import base64
+import binascii
+from datetime import date
+import json
+import os
+import typing as tp
+
+from fastapi import HTTPException
+from sqlalchemy import and_, cast, or_
+from sqlalchemy.sql.sqltypes import Float
+
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 1000))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class Page(tp.NamedTuple):
+    items: tp.List[tp.Any]
+    next_cursor: tp.Optional[str]
+
+
+class Keyset:
+    """Ordering of ``model`` by one optional sort key followed by ``id``.
+
+    ``sort`` is a column name, prefixed with ``-`` for descending order.
+    NULL sort values come last in both directions. On a NOT NULL column, the
+    order and the criterion after a cursor are those of an index on
+    (column, id), scanned forward or backward. ``columns`` maps sort
+    keys to labeled SQL expressions (e.g. a computed rank), the rows must
+    then carry the value as an attribute of the label name.
+    """
+
+    def __init__(
+        self,
+        model: tp.Any,
+        sort: str,
+        sortable: tp.Iterable[str],
+        columns: tp.Optional[tp.Mapping[str, tp.Any]] = None,
+    ) -> None:
+        self.sort = sort
+        self.descending = sort.startswith("-")
+        name = sort.lstrip("-")
+        if name not in sortable:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid sort key {name!r}, expected one of {sorted(sortable)}",
+            )
+        self.id_column = model.id
+        if name == "id":
+            self.column = None
+        elif columns and name in columns:
+            self.column = columns[name]
+        else:
+            self.column = getattr(model, name)
+        self.nullable = getattr(self.column, "nullable", True)
+
+    @property
+    def keys(self) -> tp.List[str]:
+        """Names of the row attributes the cursors are made of."""
+        return ["id"] if self.column is None else [self.column.key, "id"]
+
+    def order_by(self) -> tp.List[tp.Any]:
+        id_order = self.id_column.desc() if self.descending else self.id_column.asc()
+        if self.column is None:
+            return [id_order]
+        order = self.column.desc() if self.descending else self.column.asc()
+        return [order.nulls_last() if self.nullable else order, id_order]
+
+    def after(self, cursor: str) -> tp.Any:
+        """Return the criterion selecting the rows after ``cursor``."""
+        value, last_id = self._decode(cursor)
+        if value is not None and self.column is not None and isinstance(self.column.type, Float):
+            # compare in the column precision, a REAL isn't equal to its float8 reading
+            value = cast(value, self.column.type)
+        if self.descending:
+            id_after = self.id_column < last_id
+        else:
+            id_after = self.id_column > last_id
+        if self.column is None:
+            return id_after
+        if value is None:
+            return and_(self.column.is_(None), id_after)
+        if self.descending:
+            value_after, value_from = self.column < value, self.column <= value
+        else:
+            value_after, value_from = self.column > value, self.column >= value
+        if not self.nullable:
+            # value_from bounds the index range, the disjunction alone doesn't
+            return and_(value_from, or_(value_after, id_after))
+        return or_(
+            value_after,
+            and_(self.column == value, id_after),
+            self.column.is_(None),
+        )
+
+    def cursor(self, row: tp.Any) -> str:
+        """Return the opaque cursor pointing after ``row``."""
+        value = None if self.column is None else getattr(row, self.column.key)
+        if isinstance(value, date):
+            value = value.isoformat()
+        payload = json.dumps({"s": self.sort, "v": value, "id": row.id}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def _decode(self, cursor: str) -> tp.Tuple[tp.Any, int]:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            if payload["s"] != self.sort:
+                raise ValueError("cursor was issued for another sort order")
+            return self._value(payload["v"]), int(payload["id"])
+        except (binascii.Error, KeyError, TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
+    def _value(self, value: tp.Any) -> tp.Any:
+        """Check that a cursor value is a scalar of the sort column type."""
+        if value is None:
+            if self.column is None or self.nullable:
+                return None
+            raise ValueError("null value of a NOT NULL sort key")
+        if self.column is None:
+            raise ValueError("value given for the id order")
+        python_type = self.column.type.python_type
+        if python_type is date:
+            if not isinstance(value, str):
+                raise ValueError("date value isn't a string")
+            return date.fromisoformat(value)
+        # JSON has no float/int distinction, bool is a subclass of int
+        if python_type is float and type(value) is int:
+            return value
+        if type(value) is not python_type:
+            raise ValueError(f"{type(value).__name__} value of a {python_type.__name__} sort key")
+        return value
+
+    def page(self, rows: tp.List[tp.Any], limit: int) -> Page:
+        """Build the page out of ``limit + 1`` fetched rows."""
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return Page(rows, self.cursor(rows[-1]))
+        return Page(rows, None)
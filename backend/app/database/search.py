@@ -0,0 +1,82 @@
+"""Ranked search of targets by name, shared by ``crud`` and ``crud_async``."""
+import os
+import typing as tp
+
+from fastapi import HTTPException
+from sqlalchemy import Float, Integer, REAL, case, cast, func, literal, literal_column, or_, select
+
+from . import models
+from .pagination import Keyset, Page
+
+SEARCH_MIN_LENGTH = int(os.environ.get("SEARCH_MIN_LENGTH", 2))
+SEARCH_MAX_LENGTH = 100
+
+LIKE_ESCAPE = "\\"
+
+# "first_name last_name", lowercased. Constants are inlined rather than
+# bound so that the expression matches the one of ix_targets_name_trgm.
+TARGET_NAME = func.lower(
+    func.coalesce(models.Target.first_name, literal_column("''"))
+    + literal_column("' '")
+    + func.coalesce(models.Target.last_name, literal_column("''"))
+)
+
+
+def escape_like(term: str) -> str:
+    for char in (LIKE_ESCAPE, "%", "_"):
+        term = term.replace(char, LIKE_ESCAPE + char)
+    return term
+
+
+class TargetSearch:
+    """Search of the targets whose first or last name matches ``q``.
+
+    On Postgres, the names are ranked by their ``pg_trgm`` word distance to
+    ``q`` (0 for a name or prefix of a name equal to ``q``, then the
+    misspellings), only names above the word similarity threshold match.
+    The GiST index on (name, id) returns the rows in (distance, id) order, a
+    page reads about ``limit`` rows from the index however many targets
+    match. Other databases match the names containing ``q``, ranking those
+    with a word starting with ``q`` first.
+    """
+
+    def __init__(self, q: str, dialect: str) -> None:
+        term = " ".join(q.split()).lower()
+        if len(term) < SEARCH_MIN_LENGTH:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Search query must have at least {SEARCH_MIN_LENGTH} characters",
+            )
+        if dialect == "postgresql":
+            self.criterion = literal(term).op("<%")(TARGET_NAME)
+            distance = literal(term).op("<<->", return_type=REAL)(TARGET_NAME)
+            # distances are lossy, ties are ordered by an indexed float distance too
+            id_order = cast(models.Target.id, Float).op("<->", return_type=Float)(literal_column("0"))
+        else:
+            escaped = escape_like(term)
+            self.criterion = TARGET_NAME.like(f"%{escaped}%", escape=LIKE_ESCAPE)
+            word_prefix = or_(
+                TARGET_NAME.like(f"{escaped}%", escape=LIKE_ESCAPE),
+                TARGET_NAME.like(f"% {escaped}%", escape=LIKE_ESCAPE),
+            )
+            distance = case((word_prefix, 0), else_=1).cast(Integer)
+            id_order = models.Target.id
+        self.distance = distance.label("distance")
+        self.order_by = [self.distance, id_order]
+        self.keyset = Keyset(
+            models.Target, "distance", {"distance"}, columns={"distance": self.distance}
+        )
+
+    def query(self, limit: int, cursor: tp.Optional[str] = None) -> tp.Any:
+        """Return the select of ``limit + 1`` (target, distance) rows after ``cursor``."""
+        query = select(models.Target, self.distance).where(self.criterion)
+        if cursor:
+            query = query.where(self.keyset.after(cursor))
+        return query.order_by(*self.order_by).limit(limit + 1)
+
+    def page(self, rows: tp.Iterable[tp.Any], limit: int) -> Page:
+        targets = []
+        for target, distance in rows:
+            target.distance = distance
+            targets.append(target)
+        return self.keyset.page(targets, limit)
@@ -0,0 +1,81 @@
+"""Version counters of tables and targets, used to build ETags.
+
+The counters live in the database so that every worker process sees the
+same versions. The ``crud`` writes bump the versions of the targets they
+change in the same transaction as the change itself. The version of a
+table is one row every write updates: it is bumped right after the change
+commits, in a short transaction of its own (``bump_tables``), so that the
+writes don't queue up on its lock for the length of their transactions.
+The ETags read the versions before the rows, a list read in between has
+the new rows under the previous version and is read again after the bump.
+"""
+import typing as tp
+
+from sqlalchemy import select, update
+
+from . import models
+
+TARGETS = models.Target.__tablename__
+PICTURES = models.Picture.__tablename__
+
+
+def table_bump_statement(tables: tp.Collection[str]) -> tp.Any:
+    return (
+        update(models.TableVersion)
+        .where(models.TableVersion.name.in_(sorted(tables)))
+        .values(version=models.TableVersion.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def target_bump_statement(target_ids: tp.Collection[int]) -> tp.Any:
+    return (
+        update(models.Target)
+        .where(models.Target.id.in_(sorted(set(target_ids))))
+        .values(version=models.Target.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def bump_targets(db: tp.Any, target_ids: tp.Collection[int]) -> None:
+    """Bump the versions of ``target_ids``, in the transaction changing them."""
+    if target_ids:
+        db.execute(target_bump_statement(target_ids))
+
+
+def bump_tables(db: tp.Any, tables: tp.Collection[str]) -> None:
+    """Bump the versions of ``tables`` in a transaction of their own.
+
+    Called once the change is committed. Should the bump fail, the lists of
+    ``tables`` keep their ETags, and cached responses, until the next write.
+    """
+    db.execute(table_bump_statement(tables))
+    db.commit()
+
+
+def bump(db: tp.Any, tables: tp.Collection[str], target_ids: tp.Collection[int] = ()) -> None:
+    """Bump the versions of ``tables`` and ``target_ids`` in the current transaction.
+
+    For the bulk loads and maintenance scripts, the API writes use
+    ``bump_targets`` and ``bump_tables``.
+    """
+    db.execute(table_bump_statement(tables))
+    bump_targets(db, target_ids)
+
+
+def table_versions_query(tables: tp.Collection[str]) -> tp.Any:
+    return select(models.TableVersion.name, models.TableVersion.version).where(
+        models.TableVersion.name.in_(sorted(tables))
+    )
+
+
+def target_version_query(target_id: int) -> tp.Any:
+    return select(models.Target.version).where(models.Target.id == target_id)
+
+
+def get_table_versions(db: tp.Any, tables: tp.Collection[str]) -> tp.Dict[str, int]:
+    return dict(db.execute(table_versions_query(tables)).all())
+
+
+def get_target_version(db: tp.Any, target_id: int) -> tp.Optional[int]:
+    return db.execute(target_version_query(target_id)).scalar()
@@ -2,27 +2,38 @@
 from fastapi import Depends, FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
-from simber import Logger
+from fastapi.security import HTTPAuthorizationCredentials
 import uvicorn
 import os
 import secrets
 from urllib.parse import urlencode
 
-from app.router import auth, targets
+from app.database import session
+from app.database.cache import target_cache
+from app.database.pagination import NEXT_CURSOR_HEADER
+from app.database.pool import pool_stats
+from app.router import auth, serialization, targets, targets_async
+from app.service import logs, metrics, tracing
 from app.service.keycloak import (
-    verify_token, verify_permission, get_user_info, refresh_token as oidc_refresh_token, logout as oidc_logout
+    verify_token, verify_permission, get_user_info, refresh_token as oidc_refresh_token, logout as oidc_logout,
+    exchange_code, jwks_cache, close_keycloak_clients, close_keycloak_async_clients, get_keycloak_pool_stats,
+    token_cache, security,
 )
 
 
 # 移除FastAPIKeycloak依赖，直接使用python-keycloak
 
 
-LOG_FORMAT = "{levelname} [{filename}:{lineno}]:"
-logger = Logger(__name__, log_path="/logs/api.log")
-logger.update_format(LOG_FORMAT)
+logger = logs.get_logger(__name__)
 
 
-app = FastAPI(docs_url="/api/docs", openapi_url="/api/openapi")
+tracing.setup()
+
+app = FastAPI(
+    docs_url="/api/docs",
+    openapi_url="/api/openapi",
+    default_response_class=serialization.response_class,
+)
 
 origins = ["http://localhost", "http://frontend:3000"]
 
@@ -32,7 +43,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+if tracing.ENABLED:
+    app.add_middleware(tracing.TracingMiddleware, routes=app.router.routes)
+# added last, so it wraps CORS and times the whole request
+app.add_middleware(metrics.MetricsMiddleware, routes=app.router.routes)
+
+metrics.instrument_engine(session.engine)
+tracing.instrument_engine(session.engine)
+if session.ASYNC_DATABASE:
+    metrics.instrument_engine(session.async_engine)
+    tracing.instrument_engine(session.async_engine)
 
 # OIDC配置 - 延迟初始化
 # idp = None
@@ -64,14 +86,8 @@ async def oidc_login():
 async def oidc_callback(code: str, state: str = None):
     """处理OIDC回调"""
     try:
-        from app.service.keycloak import get_keycloak_openid
-        keycloak_openid = get_keycloak_openid()
-        token_data = keycloak_openid.token(
-            grant_type='authorization_code',
-            code=code,
-            redirect_uri='http://localhost/oidc/callback'
-        )
-        user_info = keycloak_openid.userinfo(token_data['access_token'])
+        token_data = await exchange_code(code, redirect_uri='http://localhost/oidc/callback')
+        user_info = await get_user_info(token_data['access_token'])
         return {
             "access_token": token_data['access_token'],
             "refresh_token": token_data.get('refresh_token'),
@@ -84,20 +100,22 @@ async def oidc_callback(code: str, state: str = None):
         raise HTTPException(status_code=400, detail="OIDC authentication failed")
 
 @app.get("/api/auth/oidc/user")
-async def oidc_user_info(token: str = Depends(verify_token)):
+async def oidc_user_info(
+    credentials: HTTPAuthorizationCredentials = Depends(security), _: dict = Depends(verify_token)
+):
     """获取当前OIDC用户信息"""
     try:
-        user_info = get_user_info(token)
+        user_info = await get_user_info(credentials.credentials)
         return user_info
     except Exception as e:
         logger.error(f"OIDC user info error: {e}")
         raise HTTPException(status_code=400, detail="Failed to get user info")
 
 @app.post("/api/auth/oidc/refresh")
-async def oidc_refresh_token(refresh_token: str):
+async def oidc_refresh(refresh_token: str):
     """刷新OIDC token"""
     try:
-        token_data = oidc_refresh_token(refresh_token)
+        token_data = await oidc_refresh_token(refresh_token)
         return {
             "access_token": token_data['access_token'],
             "refresh_token": token_data.get('refresh_token'),
@@ -112,7 +130,7 @@ async def oidc_refresh_token(refresh_token: str):
 async def oidc_logout_route(refresh_token: str):
     """OIDC登出"""
     try:
-        oidc_logout(refresh_token)
+        await oidc_logout(refresh_token)
         return {"message": "Logout successful"}
     except Exception as e:
         logger.error(f"OIDC logout error: {e}")
@@ -128,16 +146,40 @@ async def exception_handler(_: Request, exc: Exception) -> Response:
     Returns:
         HTTP 500 Internal Server Error
     """
-    logger.error(exc)
+    logger.error(exc, exc_info=exc)
     return Response(status_code=500)
 
 
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    """Stop background workers."""
+    jwks_cache.stop()
+    close_keycloak_clients()
+    await close_keycloak_async_clients()
+    if session.ASYNC_DATABASE:
+        await session.async_engine.dispose()
+    metrics.mark_process_dead()
+    tracing.shutdown()
+    logs.writer.stop()
+
+
 @app.get("/api")
 async def root() -> Response:
     """Health check."""
     return Response(status_code=200)
 
 
+app.add_route("/metrics", metrics.metrics, include_in_schema=False)
+
+
+if session.ASYNC_DATABASE:
+    app.include_router(
+        targets_async.router,
+        prefix="/api/targets",
+        tags=["targets"],
+        dependencies=[Depends(verify_token)],
+    )
+
 app.include_router(
     targets.router,
     prefix="/api/targets",
@@ -161,6 +203,41 @@ def company_admin(user = Depends(verify_permission(required_roles=["admin"]))):
     return f'Hi admin {user}'
 
 
+@app.get("/api/admin/keycloak-pool", dependencies=[Depends(verify_permission(required_roles=["admin"]))])
+def keycloak_pool_stats() -> dict:
+    """Keycloak HTTP connection pool counters."""
+    return get_keycloak_pool_stats()
+
+
+@app.get("/api/admin/db-pool", dependencies=[Depends(verify_permission(required_roles=["admin"]))])
+def db_pool_stats() -> dict:
+    """Database connection pool state and counters."""
+    stats = {"sync": pool_stats(session.engine)}
+    if session.ASYNC_DATABASE:
+        stats["async"] = pool_stats(session.async_engine)
+    return stats
+
+
+@app.get("/api/admin/token-cache", dependencies=[Depends(verify_permission(required_roles=["admin"]))])
+def token_cache_stats() -> dict:
+    """Verified-token cache hit/miss counters."""
+    return token_cache.stats()
+
+
+@app.get("/api/admin/target-cache", dependencies=[Depends(verify_permission(required_roles=["admin"]))])
+def target_cache_stats() -> dict:
+    """Target response cache hit/miss and eviction counters."""
+    return target_cache.stats()
+
+
+@app.get("/api/admin/traces", dependencies=[Depends(verify_permission(required_roles=["admin"]))])
+def traces(trace_id: str = None) -> list:
+    """Last finished spans, oldest first (TRACING_EXPORTER=memory)."""
+    if tracing.memory_exporter is None:
+        raise HTTPException(status_code=404, detail="Traces are not kept in memory")
+    return tracing.memory_exporter.spans(trace_id)
+
+
 @app.get("/protected", dependencies=[Depends(verify_permission(required_roles=["admin"]))])  # Requires the admin role
 def company_admin():
     return f'Hi, this is protected path'
@@ -0,0 +1,128 @@
+"""JSON rendering of the target and picture responses.
+
+By default the rows go through ``schemas.<Model>.from_orm`` (validation),
+``jsonable_encoder`` and ``json.dumps``, as FastAPI does. With
+``FAST_SERIALIZATION`` set, precompiled serializers read the attributes of
+ORM instances or Core rows straight into dicts in the schema field order,
+and orjson encodes them. The bytes are the same, the rows are trusted to
+match their schema. The rows of the ``?fields=`` selects lack some schema
+fields, they are always rendered by the serializers.
+"""
+from functools import lru_cache
+from operator import attrgetter
+import os
+import typing as tp
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+import orjson
+from pydantic import BaseModel
+
+from app.database import schemas
+from app.database.pagination import NEXT_CURSOR_HEADER
+from app.router.conditional import json_body
+
+FAST_SERIALIZATION = os.environ.get("FAST_SERIALIZATION", "false").lower() in ("1", "true", "yes")
+
+# response class of the endpoints rendered by FastAPI
+response_class = ORJSONResponse if FAST_SERIALIZATION else JSONResponse
+
+
+class Serializer:
+    """Render objects as the dict ``model(...).dict(include=include)`` would be.
+
+    Scalar fields are read with one ``attrgetter``, ``nested`` fields are
+    lists rendered by their own serializer.
+    """
+
+    def __init__(
+        self,
+        model: tp.Type[BaseModel],
+        include: tp.Optional[tp.Collection[str]] = None,
+        nested: tp.Optional[tp.Dict[str, "Serializer"]] = None,
+    ) -> None:
+        nested = nested or {}
+        self.names = [name for name in model.__fields__ if include is None or name in include]
+        self._scalars = [name for name in self.names if name not in nested]
+        self._nested = [(name, nested[name]) for name in self.names if name in nested]
+        getter = attrgetter(*self._scalars) if self._scalars else lambda _: ()
+        self._get = getter if len(self._scalars) != 1 else lambda obj: (getter(obj),)
+        # fields in schema order without reordering the dicts
+        self._ordered = self.names == self._scalars + [name for name, _ in self._nested]
+
+    def __call__(self, obj: tp.Any) -> dict:
+        data = dict(zip(self._scalars, self._get(obj)))
+        for name, serializer in self._nested:
+            data[name] = [serializer(item) for item in getattr(obj, name)]
+        return data if self._ordered else {name: data[name] for name in self.names}
+
+    def many(self, objs: tp.Iterable[tp.Any]) -> tp.List[dict]:
+        return [self(obj) for obj in objs]
+
+
+@lru_cache(maxsize=None)
+def picture_serializer(include: tp.Optional[tp.FrozenSet[str]] = None) -> Serializer:
+    """Serializer of ``schemas.Picture`` restricted to the ``include`` fields."""
+    return Serializer(schemas.Picture, include)
+
+
+@lru_cache(maxsize=None)
+def target_serializer(include: tp.Optional[tp.FrozenSet[str]] = None) -> Serializer:
+    """Serializer of ``schemas.Target`` restricted to the ``include`` fields."""
+    return Serializer(schemas.Target, include, nested={"pictures": picture_serializer()})
+
+
+def targets_body(targets: tp.Sequence[tp.Any], include: tp.Optional[tp.AbstractSet[str]] = None) -> bytes:
+    """JSON list of targets, restricted to the ``include`` fields."""
+    if FAST_SERIALIZATION:
+        serializer = target_serializer(frozenset(include) if include is not None else None)
+        return orjson.dumps(serializer.many(targets))
+    return json_body(
+        jsonable_encoder([schemas.Target.from_orm(target) for target in targets], include=include)
+    )
+
+
+def target_body(target: tp.Any) -> bytes:
+    """JSON of a target with its pictures."""
+    if FAST_SERIALIZATION:
+        return orjson.dumps(target_serializer()(target))
+    return json_body(jsonable_encoder(schemas.Target.from_orm(target)))
+
+
+def pictures_body(pictures: tp.Sequence[tp.Any]) -> bytes:
+    """JSON list of pictures."""
+    if FAST_SERIALIZATION:
+        return orjson.dumps(picture_serializer().many(pictures))
+    return json_body(jsonable_encoder([schemas.Picture.from_orm(picture) for picture in pictures]))
+
+
+def _dumps(data: tp.Any) -> bytes:
+    if FAST_SERIALIZATION:
+        return orjson.dumps(data)
+    return json_body(jsonable_encoder(data))
+
+
+def rows_body(rows: tp.Sequence[tp.Any], serializer: Serializer) -> bytes:
+    """JSON list of the rows of a column-restricted select (``?fields=``).
+
+    The rows lack the other fields of their schema, they are always
+    rendered by ``serializer``.
+    """
+    return _dumps(serializer.many(rows))
+
+
+def row_body(row: tp.Any, serializer: Serializer) -> bytes:
+    """JSON of one row of a column-restricted select (``?fields=``)."""
+    return _dumps(serializer(row))
+
+
+def batch_body(found: tp.Sequence[tp.Any], missing: tp.List[int], serializer: Serializer) -> bytes:
+    """JSON of a ``schemas.TargetBatchGetResult``."""
+    return _dumps({"found": serializer.many(found), "missing": missing})
+
+
+def page_response(body: bytes, next_cursor: tp.Optional[str]) -> Response:
+    """Response of a rendered page, its next page cursor sent in X-Next-Cursor."""
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    return Response(body, media_type="application/json", headers=headers)
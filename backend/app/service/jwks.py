@@ -0,0 +1,133 @@
+"""In-memory cache of the Keycloak realm signing keys (JWKS)."""
+import threading
+import time
+import typing as tp
+
+import jwt
+
+from app.service.logs import get_logger
+
+logger = get_logger(__name__)
+
+
+class SigningKey(tp.NamedTuple):
+    key: tp.Any
+    algorithm: str
+
+
+class JWKSUnavailableError(Exception):
+    """Raised when no signing keys could be loaded from the identity provider."""
+
+
+class JWKSCache:
+    """Signing keys of a realm indexed by their ``kid``.
+
+    Keys are fetched once and refreshed by a background thread every
+    ``refresh_interval`` seconds. A token carrying an unknown ``kid`` (key
+    rotation) triggers an immediate refetch, at most once every
+    ``min_refetch_interval`` seconds so that forged tokens can't hammer the
+    identity provider.
+    """
+
+    def __init__(
+        self,
+        fetch: tp.Callable[[], dict],
+        refresh_interval: float = 300.0,
+        min_refetch_interval: float = 10.0,
+    ) -> None:
+        self._fetch = fetch
+        self.refresh_interval = refresh_interval
+        self.min_refetch_interval = min_refetch_interval
+        self._keys: tp.Dict[tp.Optional[str], SigningKey] = {}
+        self._lock = threading.Lock()
+        self._last_fetch_attempt = float("-inf")
+        self._stop = threading.Event()
+        self._refresher: tp.Optional[threading.Thread] = None
+
+    @staticmethod
+    def _parse(jwks: dict) -> tp.Dict[tp.Optional[str], SigningKey]:
+        keys = {}
+        for jwk_data in jwks.get("keys", []):
+            if jwk_data.get("use", "sig") != "sig":
+                continue
+            try:
+                jwk = jwt.PyJWK(jwk_data)
+            except jwt.PyJWTError as e:
+                logger.warning(f"Skipping unusable JWK {jwk_data.get('kid')}: {e}")
+                continue
+            keys[jwk.key_id] = SigningKey(jwk.key, jwk_data.get("alg", "RS256"))
+        return keys
+
+    def refresh(self, force: bool = True) -> bool:
+        """Reload the key set from the identity provider.
+
+        Args:
+            force: ignore the refetch rate limit
+
+        Returns:
+            True if the key set was reloaded
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_fetch_attempt < self.min_refetch_interval:
+                return False
+            self._last_fetch_attempt = now
+            keys = self._parse(self._fetch())
+            if not keys:
+                raise JWKSUnavailableError("JWKS contains no usable signing key")
+            self._keys = keys
+            return True
+
+    def get_signing_key(self, kid: tp.Optional[str]) -> SigningKey:
+        """Return the signing key for ``kid``, refetching the key set if unknown."""
+        self.start()
+        key = self._lookup(kid)
+        if key is not None:
+            return key
+
+        try:
+            self.refresh(force=False)
+        except Exception as e:
+            if not self._keys:
+                raise JWKSUnavailableError(f"Failed to fetch JWKS: {e}") from e
+            logger.warning(f"JWKS refetch for unknown kid {kid} failed: {e}")
+
+        key = self._lookup(kid)
+        if key is None:
+            if not self._keys:
+                raise JWKSUnavailableError("No signing keys loaded")
+            raise jwt.InvalidTokenError(f"Unknown signing key id: {kid}")
+        return key
+
+    def _lookup(self, kid: tp.Optional[str]) -> tp.Optional[SigningKey]:
+        keys = self._keys
+        if kid is None and len(keys) == 1:
+            return next(iter(keys.values()))
+        return keys.get(kid)
+
+    def start(self) -> None:
+        """Start the background refresh thread (idempotent)."""
+        if self._refresher is not None or self.refresh_interval <= 0:
+            return
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._stop.clear()
+            self._refresher = threading.Thread(
+                target=self._run, name="jwks-refresh", daemon=True
+            )
+            self._refresher.start()
+
+    def stop(self) -> None:
+        """Stop the background refresh thread."""
+        self._stop.set()
+        refresher, self._refresher = self._refresher, None
+        if refresher is not None:
+            refresher.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Background JWKS refresh failed: {e}")
@@ -0,0 +1,170 @@
+"""Asyncio-native Keycloak OpenID Connect client built on httpx."""
+import asyncio
+import typing as tp
+
+import httpx
+
+from app.service.metrics import keycloak_timer
+
+URL_TOKEN = "realms/{realm}/protocol/openid-connect/token"
+URL_USERINFO = "realms/{realm}/protocol/openid-connect/userinfo"
+URL_LOGOUT = "realms/{realm}/protocol/openid-connect/logout"
+
+# responses worth retrying: the request never reached a healthy Keycloak
+RETRY_STATUS_CODES = {502, 503, 504}
+# errors after which a POST is known not to have been sent
+POST_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class KeycloakRequestError(Exception):
+    """Raised when Keycloak can't be reached or answers with an error."""
+
+    def __init__(self, endpoint: str, message: str, status_code: tp.Optional[int] = None) -> None:
+        super().__init__(f"{endpoint}: {message}")
+        self.endpoint = endpoint
+        self.status_code = status_code
+
+
+class AsyncKeycloakOpenID:
+    """Minimal OpenID Connect client for one realm.
+
+    The token, userinfo and logout calls share one ``httpx.AsyncClient``
+    (and its keep-alive pool), so they can run concurrently without
+    blocking the event loop. GET requests are retried ``max_retries`` times
+    with exponential backoff on transport errors and 502/503/504 responses.
+    POST requests (token, logout) are not idempotent, they are only retried
+    when the connection couldn't be opened. The requests and the
+    connections they open are counted (``pool_stats``).
+    """
+
+    def __init__(
+        self,
+        server_url: str,
+        realm_name: str,
+        client_id: str,
+        client_secret_key: tp.Optional[str] = None,
+        timeout: tp.Union[float, httpx.Timeout] = 30.0,
+        max_connections: int = 20,
+        max_retries: int = 1,
+        retry_backoff: float = 0.1,
+        verify: bool = True,
+    ) -> None:
+        self.server_url = server_url
+        self.realm_name = realm_name
+        self.client_id = client_id
+        self.client_secret_key = client_secret_key
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.requests = 0
+        self.new_connections = 0
+        self._client = httpx.AsyncClient(
+            base_url=server_url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            verify=verify,
+        )
+
+    def _url(self, template: str) -> str:
+        return template.format(realm=self.realm_name)
+
+    def _client_payload(self, **payload: tp.Any) -> dict:
+        payload["client_id"] = self.client_id
+        if self.client_secret_key:
+            payload["client_secret"] = self.client_secret_key
+        return {key: value for key, value in payload.items() if value is not None}
+
+    async def _request(self, endpoint: str, method: str, url: str, **kwargs: tp.Any) -> httpx.Response:
+        with keycloak_timer(endpoint):
+            return await self._send(endpoint, method, url, **kwargs)
+
+    async def _send(self, endpoint: str, method: str, url: str, **kwargs: tp.Any) -> httpx.Response:
+        idempotent = method != "POST"
+        retry_errors = httpx.TransportError if idempotent else POST_RETRY_ERRORS
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                self.requests += 1
+                response = await self._client.request(
+                    method, url, extensions={"trace": self._trace}, **kwargs
+                )
+            except httpx.TransportError as e:
+                if last_attempt or not isinstance(e, retry_errors):
+                    raise KeycloakRequestError(endpoint, f"Can't connect to server ({e!r})") from e
+            else:
+                if not idempotent or response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    break
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+        if response.is_error:
+            raise KeycloakRequestError(endpoint, response.text, response.status_code)
+        return response
+
+    async def _trace(self, event: str, info: dict) -> None:
+        # httpcore trace events of the request, a TCP connect is a new connection
+        if event == "connection.connect_tcp.complete":
+            self.new_connections += 1
+
+    def pool_stats(self) -> tp.Dict[str, int]:
+        """Return request and connection counters of the pool.
+
+        Returns:
+            ``requests`` sent, ``new_connections`` opened,
+            ``reused_connections`` (requests served by a kept-alive
+            connection), and the ``open_connections`` of the pool, of which
+            ``idle_connections``
+        """
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = pool.connections if pool is not None else []
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": max(self.requests - self.new_connections, 0),
+            "open_connections": sum(not connection.is_closed() for connection in connections),
+            "idle_connections": sum(connection.is_idle() for connection in connections),
+        }
+
+    async def token(
+        self,
+        username: tp.Optional[str] = None,
+        password: tp.Optional[str] = None,
+        grant_type: str = "password",
+        code: tp.Optional[str] = None,
+        redirect_uri: tp.Optional[str] = None,
+    ) -> dict:
+        """Request a token (password or authorization_code grant)."""
+        payload = self._client_payload(
+            grant_type=grant_type,
+            username=username,
+            password=password,
+            code=code,
+            redirect_uri=redirect_uri,
+        )
+        response = await self._request("token", "POST", self._url(URL_TOKEN), data=payload)
+        return response.json()
+
+    async def refresh_token(self, refresh_token: str) -> dict:
+        """Exchange a refresh token for a new token."""
+        payload = self._client_payload(grant_type="refresh_token", refresh_token=refresh_token)
+        response = await self._request("token", "POST", self._url(URL_TOKEN), data=payload)
+        return response.json()
+
+    async def userinfo(self, token: str) -> dict:
+        """Return the standard claims about the owner of ``token``."""
+        response = await self._request(
+            "userinfo",
+            "GET",
+            self._url(URL_USERINFO),
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        return response.json()
+
+    async def logout(self, refresh_token: str) -> None:
+        """End the session of ``refresh_token``."""
+        payload = self._client_payload(refresh_token=refresh_token)
+        await self._request("logout", "POST", self._url(URL_LOGOUT), data=payload)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
@@ -0,0 +1,256 @@
+"""JSON logging written off the request path.
+
+``get_logger`` returns a stdlib logger whose records are put on a bounded
+queue, a background thread writes them by batches to ``LOG_PATH`` (one JSON
+object per line), rotating the file at ``LOG_MAX_BYTES``. A full queue drops
+records instead of blocking the caller, the drops are logged afterwards.
+
+Repeated records from one call site (e.g. every ``verify_token`` while
+Keycloak is down) are rate-limited: at most ``LOG_RATE_LIMIT`` per
+``LOG_RATE_LIMIT_WINDOW`` seconds, the next one let through carries the
+count of the suppressed ones.
+"""
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import typing as tp
+
+from opentelemetry import trace
+
+# "{pid}" is replaced by the process id: one file per uvicorn worker, the
+# workers would otherwise race on the rotation of a shared file
+LOG_PATH = os.environ.get("LOG_PATH", "/logs/api-{pid}.log")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_CONSOLE = os.environ.get("LOG_CONSOLE", "true").lower() in ("1", "true", "yes")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+LOG_BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", 500))
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", 1.0))
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", 10))
+LOG_RATE_LIMIT_WINDOW = float(os.environ.get("LOG_RATE_LIMIT_WINDOW", 60.0))
+
+
+class RateLimitFilter(logging.Filter):
+    """Let at most ``limit`` records per call site through every ``window`` seconds."""
+
+    def __init__(self, limit: int, window: float) -> None:
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        # call site -> [window start, records let through, records suppressed]
+        self._sites: tp.Dict[tp.Tuple[str, int], tp.List[tp.Any]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            state = self._sites.get(site)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                self._sites[site] = [now, 1, 0]
+            elif state[1] < self.limit:
+                suppressed = state[2]
+                state[1] += 1
+                state[2] = 0
+            else:
+                state[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class QueueHandler(logging.Handler):
+    """Turn the records into JSON-able dicts and queue them for the writer."""
+
+    def __init__(self, writer: "LogWriter") -> None:
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            entry = {
+                "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                .isoformat(timespec="milliseconds"),
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+                "file": record.filename,
+                "line": record.lineno,
+            }
+            span_context = trace.get_current_span().get_span_context()
+            if span_context.is_valid:
+                entry["trace_id"] = trace.format_trace_id(span_context.trace_id)
+            if record.exc_info:
+                entry["exception"] = logging.Formatter().formatException(record.exc_info)
+            if getattr(record, "suppressed", 0):
+                entry["suppressed"] = record.suppressed
+        except Exception:
+            self.handleError(record)
+            return
+        self.writer.put(entry)
+
+
+class LogWriter:
+    """Background thread writing the queued entries to a rotating file.
+
+    Entries are written by batches of up to ``batch_size``, at least every
+    ``flush_interval`` seconds. The file is rotated to ``path.1`` ...
+    ``path.<backup_count>`` when a batch would grow it past ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        path: tp.Optional[str],
+        console: bool = True,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+    ) -> None:
+        self.path = path
+        self.console = console
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[tp.Optional[dict]]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread: tp.Optional[threading.Thread] = None
+        self._file: tp.Optional[tp.TextIO] = None
+        self.dropped = 0
+
+    def put(self, entry: dict) -> None:
+        """Queue an entry, dropping it if the queue is full."""
+        self.start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        """Start the writer thread (idempotent)."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Write the queued entries and stop the writer thread."""
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            # the writer is stuck (e.g. a blocked disk): drop an entry for the
+            # sentinel rather than hang the shutdown
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+                self._queue.put_nowait(None)
+            except (queue.Empty, queue.Full):
+                pass
+        thread.join(timeout=timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: tp.List[dict] = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                batch.append(self._dropped_entry(dropped))
+            if batch:
+                self._write("".join(json.dumps(entry, default=str) + "\n" for entry in batch))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def _dropped_entry(count: int) -> dict:
+        return {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": "WARNING",
+            "logger": __name__,
+            "message": f"{count} log records dropped, the log queue was full",
+        }
+
+    def _write(self, text: str) -> None:
+        if self.console:
+            sys.stderr.write(text)
+            sys.stderr.flush()
+        if self.path is None:
+            return
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            size = self._file.tell()
+            if size and size + len(text) > self.max_bytes:
+                self._rotate()
+            self._file.write(text)
+            self._file.flush()
+        except OSError as e:
+            sys.stderr.write(f"Can't write logs to {self.path} ({e}), logging to stderr only\n")
+            if not self.console:
+                sys.stderr.write(text)
+            self.path = None
+            self.console = True
+
+    def _rotate(self) -> None:
+        self._file.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "w", encoding="utf-8")
+
+
+writer = LogWriter(
+    LOG_PATH.format(pid=os.getpid()) if LOG_PATH else None,
+    console=LOG_CONSOLE,
+    max_bytes=LOG_MAX_BYTES,
+    backup_count=LOG_BACKUP_COUNT,
+    queue_size=LOG_QUEUE_SIZE,
+    batch_size=LOG_BATCH_SIZE,
+    flush_interval=LOG_FLUSH_INTERVAL,
+)
+handler = QueueHandler(writer)
+handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_LIMIT_WINDOW))
+atexit.register(writer.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Return a logger writing through the shared queue."""
+    logger = logging.getLogger(name)
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+    return logger
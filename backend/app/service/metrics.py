@@ -0,0 +1,209 @@
+"""Prometheus metrics of the HTTP requests, database queries and Keycloak calls.
+
+With several uvicorn workers, set ``PROMETHEUS_MULTIPROC_DIR`` to an empty
+directory shared by the workers (``entrypoint.sh`` empties it at startup):
+each worker then writes its samples there and ``/metrics`` aggregates them,
+whichever worker serves the scrape.
+"""
+from contextlib import contextmanager
+import contextvars
+import os
+import time
+import typing as tp
+
+import anyio
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# label of the requests matching no route, paths aren't labels (cardinality)
+UNMATCHED_ROUTE = "<unmatched>"
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request duration, until the response is sent",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being served",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent executing database statements per HTTP request",
+    ["method", "route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_DB_STATEMENTS = Histogram(
+    "http_request_db_statements",
+    "Database statements executed per HTTP request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+KEYCLOAK_DURATION = Histogram(
+    "keycloak_request_duration_seconds", "Keycloak request duration", ["endpoint"]
+)
+KEYCLOAK_ERRORS = Counter(
+    "keycloak_request_errors_total", "Failed Keycloak requests", ["endpoint"]
+)
+THREADPOOL_SIZE = Gauge(
+    "threadpool_threads", "Threads of the sync endpoints pool", multiprocess_mode="livesum"
+)
+THREADPOOL_BUSY = Gauge(
+    "threadpool_threads_busy", "Threads running a sync endpoint", multiprocess_mode="livesum"
+)
+THREADPOOL_WAITING = Gauge(
+    "threadpool_tasks_waiting", "Sync endpoints waiting for a thread", multiprocess_mode="livesum"
+)
+
+
+class _QueryTimer:
+    """Database time of the current request."""
+
+    __slots__ = ("seconds", "statements")
+
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self.statements = 0
+
+
+# shared by reference with the threadpool threads and tasks of the request
+_query_timer: contextvars.ContextVar[tp.Optional[_QueryTimer]] = contextvars.ContextVar(
+    "query_timer", default=None
+)
+
+
+def _before_cursor_execute(conn: tp.Any, *args: tp.Any) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: tp.Any, *args: tp.Any) -> None:
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    timer = _query_timer.get()
+    if timer is not None:
+        timer.seconds += elapsed
+        timer.statements += 1
+
+
+def _handle_error(exception_context: tp.Any) -> None:
+    # a failed statement has no after_cursor_execute, drop its start time
+    connection = exception_context.connection
+    starts = connection.info.get("query_start") if connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine: tp.Any) -> None:
+    """Time the statements of a (sync or async) engine."""
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+@contextmanager
+def keycloak_timer(endpoint: str) -> tp.Iterator[None]:
+    """Time a call to a Keycloak endpoint, counting the ones raising as errors."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        KEYCLOAK_ERRORS.labels(endpoint).inc()
+        raise
+    finally:
+        KEYCLOAK_DURATION.labels(endpoint).observe(time.perf_counter() - start)
+
+
+def _sample_threadpool() -> None:
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    THREADPOOL_SIZE.set(limiter.total_tokens)
+    THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+    THREADPOOL_WAITING.set(limiter.statistics().tasks_waiting)
+
+
+def route_template(routes: tp.Iterable[tp.Any], scope: Scope) -> str:
+    """Return the path template of the route serving ``scope``, as the router picks it."""
+    partial = None
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Count, time and track the in-flight HTTP requests by route template."""
+
+    def __init__(self, app: ASGIApp, routes: tp.Iterable[tp.Any]) -> None:
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(self.routes, scope)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        _sample_threadpool()
+        timer = _QueryTimer()
+        token = _query_timer.set(timer)
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_progress.dec()
+            _query_timer.reset(token)
+            REQUESTS.labels(method, route, status).inc()
+            REQUEST_DURATION.labels(method, route, status).observe(elapsed)
+            REQUEST_DB_DURATION.labels(method, route).observe(timer.seconds)
+            REQUEST_DB_STATEMENTS.labels(method, route).observe(timer.statements)
+
+
+async def metrics(_: Request) -> Response:
+    """Prometheus exposition of the metrics of every worker."""
+    _sample_threadpool()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead() -> None:
+    """Drop the live gauges of this worker (multiprocess mode)."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
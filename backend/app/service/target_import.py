@@ -0,0 +1,146 @@
+"""Incremental parsing of CSV and NDJSON target imports."""
+import codecs
+from collections import deque
+import csv
+import json
+import os
+import typing as tp
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from app.database import schemas
+
+FORMATS = ("csv", "ndjson")
+
+# separator of the picture paths in the CSV ``pictures`` column
+CSV_PICTURES_SEPARATOR = "|"
+
+# characters of a line (or CSV record), longer ones are rejected
+IMPORT_MAX_LINE_LENGTH = int(os.environ.get("IMPORT_MAX_LINE_LENGTH", 1024 * 1024))
+
+
+class ParsedRow(tp.NamedTuple):
+    row: int
+    target: tp.Optional[schemas.TargetImportIn]
+    errors: tp.List[tp.Dict[str, tp.Any]]
+
+
+def _check_length(length: int, max_length: int, what: str = "Line") -> None:
+    if length > max_length:
+        raise HTTPException(
+            status_code=413, detail=f"{what} longer than {max_length} characters"
+        )
+
+
+async def iter_lines(
+    chunks: tp.AsyncIterator[bytes], max_length: int = IMPORT_MAX_LINE_LENGTH
+) -> tp.AsyncIterator[str]:
+    """Split a byte stream into text lines (ending with ``\\n``) without buffering it.
+
+    A line longer than ``max_length`` characters is rejected (413) as soon
+    as that much of it is read.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            _check_length(len(line), max_length)
+            yield line + "\n"
+        _check_length(len(pending), max_length)
+    pending += decoder.decode(b"", final=True)
+    _check_length(len(pending), max_length)
+    if pending:
+        yield pending
+
+
+class _LineFeed:
+    """Iterator the CSV reader pulls complete records from."""
+
+    def __init__(self) -> None:
+        self.lines: tp.Deque[str] = deque()
+
+    def __iter__(self) -> "_LineFeed":
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+def _validate(row: int, data: tp.Any) -> ParsedRow:
+    try:
+        return ParsedRow(row, schemas.TargetImportIn.parse_obj(data), [])
+    except ValidationError as e:
+        return ParsedRow(row, None, e.errors())
+
+
+def _csv_record(record: tp.Dict[str, tp.Optional[str]]) -> tp.Dict[str, tp.Any]:
+    data: tp.Dict[str, tp.Any] = {key: value for key, value in record.items() if value}
+    paths = data.pop("pictures", "")
+    data["pictures"] = [
+        {"path": path} for path in paths.split(CSV_PICTURES_SEPARATOR) if path
+    ]
+    return data
+
+
+async def parse_csv(
+    chunks: tp.AsyncIterator[bytes], max_length: int = IMPORT_MAX_LINE_LENGTH
+) -> tp.AsyncIterator[ParsedRow]:
+    """Parse a CSV upload with a header row.
+
+    Columns are ``first_name``, ``last_name``, ``dob``, the optional ``id``
+    of an existing target to update and ``pictures``, a ``|`` separated
+    list of picture paths. A record is at most ``max_length`` characters,
+    over all its lines.
+    """
+    feed = _LineFeed()
+    reader: tp.Optional[csv.DictReader] = None
+    record_lines: tp.List[str] = []
+    record_length = 0
+    quotes = 0
+    row = 0
+    async for line in iter_lines(chunks, max_length):
+        # a record may span several lines inside a quoted field, hand it to
+        # the CSV reader once its quotes are balanced
+        record_lines.append(line)
+        record_length += len(line)
+        _check_length(record_length, max_length, f"Record {row + 1}")
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        feed.lines.extend(record_lines)
+        record_lines, record_length, quotes = [], 0, 0
+        if reader is None:
+            reader = csv.DictReader(feed)
+        for record in reader:
+            row += 1
+            if None in record:
+                yield ParsedRow(row, None, [{"loc": [], "msg": "too many columns", "type": "value_error.csv"}])
+                continue
+            yield _validate(row, _csv_record(record))
+    if record_lines:
+        yield ParsedRow(row + 1, None, [{"loc": [], "msg": "unterminated quoted field", "type": "value_error.csv"}])
+
+
+async def parse_ndjson(
+    chunks: tp.AsyncIterator[bytes], max_length: int = IMPORT_MAX_LINE_LENGTH
+) -> tp.AsyncIterator[ParsedRow]:
+    """Parse one ``TargetImportIn`` JSON object per line."""
+    row = 0
+    async for line in iter_lines(chunks, max_length):
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield ParsedRow(row, None, [{"loc": [], "msg": str(e), "type": "value_error.json"}])
+            continue
+        yield _validate(row, data)
+
+
+PARSERS = {"csv": parse_csv, "ndjson": parse_ndjson}
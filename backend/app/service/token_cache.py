@@ -0,0 +1,128 @@
+"""Bounded in-process cache of verified token claims."""
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+import typing as tp
+
+# rough per-entry bookkeeping overhead (key, tuple, claims dict) in bytes
+ENTRY_OVERHEAD = 512
+
+
+class _Entry(tp.NamedTuple):
+    claims: dict
+    expires_at: float
+    session_id: tp.Optional[str]
+    size: int
+
+
+def _session_id(claims: dict) -> tp.Optional[str]:
+    return claims.get("sid") or claims.get("session_state")
+
+
+class TokenCache:
+    """LRU cache of decoded claims keyed by the SHA-256 of the raw token.
+
+    Entries expire at the token ``exp``. The cache holds at most
+    ``max_entries`` tokens and about ``max_bytes`` of memory, the size of an
+    entry being estimated from the length of the token. Tokens of revoked
+    sessions are evicted and never cached again.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 32 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._revoked: tp.Dict[str, float] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> tp.Optional[dict]:
+        """Return the cached claims of ``token`` or None."""
+        if not self.enabled:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.time() or entry.session_id in self._revoked:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.claims
+
+    def put(self, token: str, claims: dict) -> None:
+        """Cache the verified ``claims`` of ``token`` until its expiry."""
+        expires_at = claims.get("exp")
+        if not self.enabled or not isinstance(expires_at, (int, float)):
+            return
+        session_id = _session_id(claims)
+        entry = _Entry(claims, float(expires_at), session_id, len(token) + ENTRY_OVERHEAD)
+        if entry.size > self.max_bytes or expires_at <= time.time():
+            return
+        key = self._key(token)
+        with self._lock:
+            if session_id is not None and session_id in self._revoked:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def revoke_session(self, session_id: str, until: tp.Optional[float] = None) -> None:
+        """Evict and stop caching the tokens of a session (e.g. after logout).
+
+        Args:
+            session_id: ``sid`` claim of the session
+            until: epoch after which the session can be forgotten, defaults
+                to one day from now
+        """
+        now = time.time()
+        with self._lock:
+            self._revoked = {sid: exp for sid, exp in self._revoked.items() if exp > now}
+            self._revoked[session_id] = until if until is not None else now + 86400
+            for key in [k for k, e in self._entries.items() if e.session_id == session_id]:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        """Return hit/miss counters and current occupancy."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "revoked_sessions": len(self._revoked),
+        }
@@ -0,0 +1,272 @@
+"""OpenTelemetry tracing of the requests, Keycloak calls, crud functions and SQL statements.
+
+Disabled unless ``TRACING_EXPORTER`` is set. Spans go then to:
+
+- ``memory``: the last ``TRACING_MEMORY_SPANS`` spans, served by ``/api/admin/traces``
+- ``file``: ``TRACING_FILE``, one OTLP-like JSON span per line
+- ``console``: stdout
+
+Incoming W3C ``traceparent`` headers (e.g. forwarded by nginx) continue their
+trace, and their sampling decision is kept. Other traces are sampled at
+``TRACING_SAMPLE_RATE``.
+"""
+from collections import deque
+from contextlib import contextmanager
+import functools
+import inspect
+import os
+import threading
+import typing as tp
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from sqlalchemy import event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.service.metrics import route_template
+
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "none")
+TRACING_SAMPLE_RATE = float(os.environ.get("TRACING_SAMPLE_RATE", 1.0))
+TRACING_FILE = os.environ.get("TRACING_FILE", "/logs/traces.jsonl")
+TRACING_MEMORY_SPANS = int(os.environ.get("TRACING_MEMORY_SPANS", 10000))
+ENABLED = TRACING_EXPORTER != "none"
+
+# statements are truncated in the span attributes
+MAX_STATEMENT_LENGTH = 1000
+
+tracer = trace.get_tracer("app")
+
+
+class MemorySpanExporter(SpanExporter):
+    """Keep the last ``max_spans`` finished spans."""
+
+    def __init__(self, max_spans: int) -> None:
+        self._spans: tp.Deque[ReadableSpan] = deque(maxlen=max_spans)
+
+    def export(self, spans: tp.Sequence[ReadableSpan]) -> SpanExportResult:
+        self._spans.extend(spans)
+        return SpanExportResult.SUCCESS
+
+    def spans(self, trace_id: tp.Optional[str] = None) -> tp.List[dict]:
+        """Return the kept spans, oldest first, optionally of one trace."""
+        return [
+            span_dict(finished)
+            for finished in list(self._spans)
+            if trace_id is None or trace.format_trace_id(finished.context.trace_id) == trace_id
+        ]
+
+    def clear(self) -> None:
+        self._spans.clear()
+
+
+class FileSpanExporter(SpanExporter):
+    """Append the spans to a JSON lines file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: tp.Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        try:
+            with self._lock, open(self.path, "a") as f:
+                f.write(lines)
+        except OSError:
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+
+def span_dict(span: ReadableSpan) -> dict:
+    """Return a compact JSON-able description of a finished span."""
+    return {
+        "name": span.name,
+        "trace_id": trace.format_trace_id(span.context.trace_id),
+        "span_id": trace.format_span_id(span.context.span_id),
+        "parent_id": trace.format_span_id(span.parent.span_id) if span.parent else None,
+        "start": span.start_time / 1e9,
+        "duration_ms": (span.end_time - span.start_time) / 1e6,
+        "status": span.status.status_code.name,
+        "attributes": dict(span.attributes),
+    }
+
+
+memory_exporter: tp.Optional[MemorySpanExporter] = None
+
+
+def setup() -> None:
+    """Install the tracer provider and exporter configured by env vars."""
+    global memory_exporter
+    if not ENABLED:
+        return
+    # the service name comes from OTEL_SERVICE_NAME
+    provider = TracerProvider(
+        resource=Resource.create(),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATE)),
+    )
+    if TRACING_EXPORTER == "memory":
+        memory_exporter = MemorySpanExporter(TRACING_MEMORY_SPANS)
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    elif TRACING_EXPORTER == "file":
+        provider.add_span_processor(BatchSpanProcessor(FileSpanExporter(TRACING_FILE)))
+    elif TRACING_EXPORTER == "console":
+        provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+    else:
+        raise ValueError(
+            f"Unknown TRACING_EXPORTER {TRACING_EXPORTER!r}, expected none, memory, file or console"
+        )
+    trace.set_tracer_provider(provider)
+
+
+def shutdown() -> None:
+    """Flush the pending spans."""
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, TracerProvider):
+        provider.shutdown()
+
+
+@contextmanager
+def span(name: str, **attributes: tp.Any) -> tp.Iterator[tp.Any]:
+    """Trace a block as a child of the current span."""
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def traced(name: tp.Optional[str] = None) -> tp.Callable[[tp.Callable], tp.Callable]:
+    """Trace each call of a (sync or async) function.
+
+    The span is named ``name``, by default ``<module>.<function>``. With
+    tracing disabled the function is returned as is. The signature is kept,
+    so decorated FastAPI dependencies are resolved as before.
+    """
+
+    def decorator(function: tp.Callable) -> tp.Callable:
+        if not ENABLED:
+            return function
+        span_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args: tp.Any, **kwargs: tp.Any) -> tp.Any:
+                with tracer.start_as_current_span(span_name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args: tp.Any, **kwargs: tp.Any) -> tp.Any:
+            with tracer.start_as_current_span(span_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_attribute(key: str, value: tp.Any) -> None:
+    """Set an attribute of the current span, if it is recorded."""
+    current = trace.get_current_span()
+    if current.is_recording():
+        current.set_attribute(key, value)
+
+
+def _before_cursor_execute(
+    conn: tp.Any, cursor: tp.Any, statement: str, parameters: tp.Any, context: tp.Any, executemany: bool
+) -> None:
+    spans = conn.info.setdefault("trace_spans", [])
+    if not trace.get_current_span().is_recording():
+        spans.append(None)
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+    spans.append(
+        tracer.start_span(
+            operation,
+            kind=SpanKind.CLIENT,
+            attributes={
+                "db.system": conn.engine.dialect.name,
+                "db.operation": operation,
+                "db.statement": statement[:MAX_STATEMENT_LENGTH],
+                "db.executemany": executemany,
+            },
+        )
+    )
+
+
+def _after_cursor_execute(conn: tp.Any, *args: tp.Any) -> None:
+    current = conn.info["trace_spans"].pop()
+    if current is not None:
+        current.end()
+
+
+def _handle_error(exception_context: tp.Any) -> None:
+    spans = exception_context.connection.info.get("trace_spans") if exception_context.connection else None
+    if not spans:
+        return
+    current = spans.pop()
+    if current is not None:
+        current.record_exception(exception_context.original_exception)
+        current.set_status(Status(StatusCode.ERROR))
+        current.end()
+
+
+def instrument_engine(engine: tp.Any) -> None:
+    """Trace the statements of a (sync or async) engine."""
+    if not ENABLED:
+        return
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class TracingMiddleware:
+    """Trace the HTTP requests, continuing the trace of a ``traceparent`` header."""
+
+    def __init__(self, app: ASGIApp, routes: tp.Iterable[tp.Any]) -> None:
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {
+            name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]
+        }
+        method = scope["method"]
+        route = route_template(self.routes, scope)
+        attributes = {
+            "http.method": method,
+            "http.route": route,
+            "http.target": scope["path"],
+        }
+        if "x-request-id" in headers:
+            attributes["http.request_id"] = headers["x-request-id"]
+
+        with tracer.start_as_current_span(
+            f"{method} {route}",
+            context=propagate.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes=attributes,
+        ) as current:
+
+            async def send_wrapper(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    current.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        current.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
@@ -1,4 +1,9 @@
 #!/bin/sh
 
 alembic upgrade head
+# samples of the previous run's workers would be aggregated into /metrics
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    rm -f "$PROMETHEUS_MULTIPROC_DIR"/*.db
+fi
 python app/main.py
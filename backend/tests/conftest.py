@@ -0,0 +1,113 @@
+"""Fixtures of the backend tests, run from the backend directory with ``python -m pytest``.
+
+The app is imported against a throwaway SQLite database, with the auth
+dependency overridden and the logs kept off the disk.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import typing as tp
+
+import pytest
+from sqlalchemy import event
+
+_DATA_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+# read by app.database.session, app.service.logs and app.database.cache at import
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DATA_DIR, 'test.db')}"
+os.environ.setdefault("DATABASE_MODE", "sync")
+os.environ["LOG_PATH"] = ""
+os.environ["LOG_CONSOLE"] = "false"
+os.environ["TARGET_CACHE"] = "memory"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.database import models  # noqa: E402,F401
+from app.database.cache import target_cache  # noqa: E402
+from app.database import session  # noqa: E402
+from app.database.session import Base, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.service.keycloak import verify_token  # noqa: E402
+
+ADMIN_CLAIMS = {"sub": "test-user", "realm_access": {"roles": ["admin"]}}
+
+
+@pytest.fixture(scope="session")
+def api() -> str:
+    """Prefix of the API routes (``/api``, ``/api2`` in backend2)."""
+    targets_path = next(route.path for route in app.routes if route.path.endswith("/targets"))
+    return targets_path[: -len("/targets")]
+
+
+@pytest.fixture
+def db() -> tp.Iterator[None]:
+    """Empty tables and cache."""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    # not invalidate(): the new tables reuse the ids of the cached targets
+    target_cache.clear()
+    yield
+    engine.dispose()
+
+
+@pytest.fixture
+def client(db: None) -> tp.Iterator[TestClient]:
+    """Client of the app authenticated as an admin."""
+    app.dependency_overrides[verify_token] = lambda: ADMIN_CLAIMS
+    with TestClient(app) as test_client:
+        yield test_client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def statements() -> tp.Iterator[tp.List[str]]:
+    """SQL statements run by the app during the test."""
+    app_engine = session.async_engine.sync_engine if session.ASYNC_DATABASE else engine
+    executed: tp.List[str] = []
+
+    def record(conn: tp.Any, cursor: tp.Any, statement: str, *args: tp.Any) -> None:
+        executed.append(statement)
+
+    event.listen(app_engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(app_engine, "before_cursor_execute", record)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def redis_url() -> tp.Iterator[str]:
+    """URL of a local Redis server, started for the session."""
+    try:
+        import redis_server
+
+        server_path = redis_server.REDIS_SERVER_PATH
+    except ImportError:
+        server_path = shutil.which("redis-server")
+    if server_path is None:
+        pytest.skip("no redis-server (pip install redis-server)")
+    port = _free_port()
+    process = subprocess.Popen(
+        [server_path, "--port", str(port), "--save", "", "--appendonly", "no"],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        yield f"redis://127.0.0.1:{port}/0"
+    finally:
+        process.terminate()
+        process.wait()
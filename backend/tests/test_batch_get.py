@@ -0,0 +1,74 @@
+import typing as tp
+
+import pytest
+
+from app.router import target_requests
+
+TARGETS = [
+    {"first_name": "Ann", "last_name": "Doe", "dob": "1985-03-01", "pictures": [{"path": "/a"}]},
+    {"first_name": "Bea", "last_name": "Roe", "dob": "1992-07-15", "pictures": []},
+    {"first_name": "Cid", "last_name": "Poe", "dob": "2001-11-30", "pictures": [{"path": "/c"}]},
+]
+
+
+@pytest.fixture
+def targets(client: tp.Any, api: str) -> tp.List[dict]:
+    return client.post(f"{api}/targets/bulk", json=TARGETS).json()["created"]
+
+
+def batch_get(client: tp.Any, api: str, ids: tp.List[tp.Any], **params: str) -> tp.Any:
+    return client.post(f"{api}/targets/batch-get", params=params, json={"ids": ids})
+
+
+def test_found_in_the_order_of_ids(client: tp.Any, api: str, targets: tp.List[dict]) -> None:
+    ids = [target["id"] for target in targets]
+    response = batch_get(client, api, [ids[2], ids[0], ids[1]])
+    assert response.status_code == 200
+    assert response.json() == {"found": [targets[2], targets[0], targets[1]], "missing": []}
+    # the same bodies as the single target reads
+    assert response.json()["found"][0] == client.get(f"{api}/targets/{ids[2]}").json()
+
+
+def test_missing_ids(client: tp.Any, api: str, targets: tp.List[dict]) -> None:
+    ids = [target["id"] for target in targets]
+    response = batch_get(client, api, [999, ids[1], -1, ids[0], 0])
+    assert response.json() == {"found": [targets[1], targets[0]], "missing": [999, -1, 0]}
+    assert batch_get(client, api, []).json() == {"found": [], "missing": []}
+
+
+def test_duplicate_ids_returned_once(client: tp.Any, api: str, targets: tp.List[dict]) -> None:
+    ids = [target["id"] for target in targets]
+    response = batch_get(client, api, [ids[1], ids[0], ids[1], 999, ids[0], 999])
+    assert response.json() == {"found": [targets[1], targets[0]], "missing": [999]}
+
+
+def test_one_query_per_table(
+    client: tp.Any, api: str, targets: tp.List[dict], statements: tp.List[str]
+) -> None:
+    batch_get(client, api, [target["id"] for target in targets] + [999])
+    assert [statement.split("FROM ")[1].split()[0] for statement in statements] == [
+        "targets",
+        "pictures",
+    ]
+    del statements[:]
+    batch_get(client, api, [target["id"] for target in targets], fields="id,last_name")
+    assert len(statements) == 1
+
+
+def test_id_count_limit(
+    client: tp.Any, api: str, targets: tp.List[dict], monkeypatch: tp.Any
+) -> None:
+    monkeypatch.setattr(target_requests, "BATCH_GET_MAX_IDS", 2)
+    ids = [target["id"] for target in targets]
+    response = batch_get(client, api, ids)
+    assert response.status_code == 413
+    assert response.json()["detail"] == "At most 2 ids per request"
+    # counted once deduplicated
+    response = batch_get(client, api, [ids[0], ids[1], ids[0], ids[1]])
+    assert response.status_code == 200
+    assert len(response.json()["found"]) == 2
+
+
+@pytest.mark.parametrize("ids", [None, "1,2", ["one"], [[1]]])
+def test_invalid_ids_rejected(client: tp.Any, api: str, ids: tp.Any) -> None:
+    assert batch_get(client, api, ids).status_code == 422
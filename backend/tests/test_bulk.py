@@ -0,0 +1,111 @@
+import typing as tp
+
+import pytest
+
+from app.database import crud
+from app.router import targets as targets_router
+
+TARGET = {"first_name": "Ada", "last_name": "Lovelace", "dob": "1815-12-10"}
+
+
+def names(client: tp.Any, api: str) -> tp.List[str]:
+    return [target["first_name"] for target in client.get(f"{api}/targets").json()]
+
+
+def test_bulk_create_targets(client: tp.Any, api: str) -> None:
+    items = [
+        dict(TARGET, pictures=[{"path": "/a.png"}, {"path": "/b.png"}]),
+        dict(TARGET, first_name="Bea"),
+    ]
+    response = client.post(f"{api}/targets/bulk", json=items)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["errors"] == []
+    created = result["created"]
+    assert [target["first_name"] for target in created] == ["Ada", "Bea"]
+    assert [p["path"] for p in created[0]["pictures"]] == ["/a.png", "/b.png"]
+    assert {p["target_id"] for p in created[0]["pictures"]} == {created[0]["id"]}
+    assert created[1]["pictures"] == []
+
+    target = client.get(f"{api}/targets/{created[0]['id']}").json()
+    assert target == created[0]
+    response = client.get(f"{api}/targets", params={"min_pictures": 2, "sort": "picture_count"})
+    assert [target["id"] for target in response.json()] == [created[0]["id"]]
+
+
+def test_bulk_create_reports_invalid_items(client: tp.Any, api: str) -> None:
+    items = [
+        TARGET,
+        dict(TARGET, dob="not a date"),
+        dict(TARGET, first_name="Bea"),
+        "not an object",
+        dict(TARGET, pictures=[{"name": "/a.png"}]),
+    ]
+    result = client.post(f"{api}/targets/bulk", json=items).json()
+    assert [target["first_name"] for target in result["created"]] == ["Ada", "Bea"]
+    assert [error["index"] for error in result["errors"]] == [1, 3, 4]
+    assert result["errors"][0]["errors"][0]["loc"] == ["dob"]
+    assert result["errors"][2]["errors"][0]["loc"] == ["pictures", 0, "path"]
+    assert names(client, api) == ["Ada", "Bea"]
+
+
+def test_bulk_create_all_or_nothing(client: tp.Any, api: str) -> None:
+    items = [TARGET, dict(TARGET, dob="not a date")]
+    response = client.post(f"{api}/targets/bulk", params={"all_or_nothing": True}, json=items)
+    assert response.status_code == 422
+    assert [error["index"] for error in response.json()["detail"]] == [1]
+    assert names(client, api) == []
+
+    response = client.post(f"{api}/targets/bulk", params={"all_or_nothing": True}, json=[TARGET])
+    assert response.status_code == 200
+    assert names(client, api) == ["Ada"]
+
+
+def test_bulk_size_limit(client: tp.Any, api: str, monkeypatch: tp.Any) -> None:
+    monkeypatch.setattr(targets_router, "BULK_MAX_ITEMS", 2)
+    response = client.post(f"{api}/targets/bulk", json=[TARGET] * 3)
+    assert response.status_code == 413
+    assert names(client, api) == []
+    assert client.post(f"{api}/targets/bulk", json=[TARGET] * 2).status_code == 200
+
+    target_id = client.get(f"{api}/targets").json()[0]["id"]
+    pictures = [{"path": f"/{index}.png"} for index in range(3)]
+    response = client.post(f"{api}/targets/{target_id}/pictures/bulk", json=pictures)
+    assert response.status_code == 413
+    assert client.get(f"{api}/targets/{target_id}").json()["pictures"] == []
+
+
+def test_bulk_create_is_one_transaction(client: tp.Any, api: str, monkeypatch: tp.Any) -> None:
+    insert_many = crud._insert_many
+
+    def failing_pictures(db: tp.Any, model: tp.Any, rows: tp.List[dict]) -> tp.Any:
+        if model.__tablename__ == "pictures":
+            raise RuntimeError("insert failed")
+        return insert_many(db, model, rows)
+
+    monkeypatch.setattr(crud, "_insert_many", failing_pictures)
+    with pytest.raises(RuntimeError):
+        client.post(f"{api}/targets/bulk", json=[dict(TARGET, pictures=[{"path": "/a.png"}])])
+    # the targets inserted before the failure are rolled back with it
+    assert names(client, api) == []
+
+
+def test_bulk_create_pictures(client: tp.Any, api: str) -> None:
+    target_id = client.post(f"{api}/targets", json=TARGET).json()["id"]
+    pictures = [{"path": "/a.png"}, {"url": "/b.png"}, {"path": "/c.png"}]
+    result = client.post(f"{api}/targets/{target_id}/pictures/bulk", json=pictures).json()
+    assert [picture["path"] for picture in result["created"]] == ["/a.png", "/c.png"]
+    assert [error["index"] for error in result["errors"]] == [1]
+    target = client.get(f"{api}/targets/{target_id}").json()
+    assert [picture["path"] for picture in target["pictures"]] == ["/a.png", "/c.png"]
+
+    response = client.post(
+        f"{api}/targets/{target_id}/pictures/bulk",
+        params={"all_or_nothing": True},
+        json=[{"path": "/d.png"}, {}],
+    )
+    assert response.status_code == 422
+    assert len(client.get(f"{api}/targets/{target_id}").json()["pictures"]) == 2
+
+    response = client.post(f"{api}/targets/{target_id + 1}/pictures/bulk", json=[{"path": "/e"}])
+    assert response.status_code == 404
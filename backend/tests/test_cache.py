@@ -0,0 +1,151 @@
+import typing as tp
+import uuid
+
+import pytest
+from sqlalchemy import update
+
+from app.database import models, versions
+from app.database.cache import CachedResponse, MemoryCache, RedisCache, TargetCache, target_cache
+from app.database.session import SessionLocal
+
+TARGET = {"first_name": "Ada", "last_name": "Lovelace", "dob": "1815-12-10"}
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache_backend(request: tp.Any, client: tp.Any) -> tp.Iterator[tp.Any]:
+    """Install each backend in the app cache."""
+    backend = (
+        MemoryCache()
+        if request.param == "memory"
+        else RedisCache(request.getfixturevalue("redis_url"))
+    )
+    previous, target_cache.backend = target_cache.backend, backend
+    prefix, target_cache.prefix = target_cache.prefix, f"test-{uuid.uuid4().hex}:"
+    revalidate = target_cache._revalidate
+    yield backend
+    target_cache.backend, target_cache.prefix = previous, prefix
+    target_cache._revalidate = revalidate
+
+
+def test_target_invalidated_by_edit(client: tp.Any, api: str, cache_backend: tp.Any) -> None:
+    target_id = client.post(f"{api}/targets", json=TARGET).json()["id"]
+    assert client.get(f"{api}/targets/{target_id}").json()["first_name"] == "Ada"
+    hits = target_cache.hits
+    assert client.get(f"{api}/targets/{target_id}").json()["first_name"] == "Ada"
+    assert target_cache.hits == hits + 1
+
+    client.put(f"{api}/targets/{target_id}", json=dict(TARGET, first_name="Augusta"))
+    assert client.get(f"{api}/targets/{target_id}").json()["first_name"] == "Augusta"
+
+
+def test_target_invalidated_by_picture(client: tp.Any, api: str, cache_backend: tp.Any) -> None:
+    target_id = client.post(f"{api}/targets", json=TARGET).json()["id"]
+    assert client.get(f"{api}/targets/{target_id}").json()["pictures"] == []
+    client.post(f"{api}/targets/{target_id}/pictures", json={"path": "/a.png"})
+    pictures = client.get(f"{api}/targets/{target_id}").json()["pictures"]
+    assert [picture["path"] for picture in pictures] == ["/a.png"]
+
+
+def test_list_invalidated_by_writes(client: tp.Any, api: str, cache_backend: tp.Any) -> None:
+    target_id = client.post(f"{api}/targets", json=TARGET).json()["id"]
+    assert [t["id"] for t in client.get(f"{api}/targets").json()] == [target_id]
+    client.get(f"{api}/targets")
+
+    other_id = client.post(f"{api}/targets", json=TARGET).json()["id"]
+    assert [t["id"] for t in client.get(f"{api}/targets").json()] == [target_id, other_id]
+    client.delete(f"{api}/targets/{other_id}")
+    assert [t["id"] for t in client.get(f"{api}/targets").json()] == [target_id]
+
+
+def test_write_unseen_by_cache_not_served(client: tp.Any, api: str, cache_backend: tp.Any) -> None:
+    """A write of another process (no invalidation here) makes the revalidated entries stale."""
+    target_cache._revalidate = True
+    target_id = client.post(f"{api}/targets", json=TARGET).json()["id"]
+    client.get(f"{api}/targets/{target_id}")
+    client.get(f"{api}/targets")
+    with SessionLocal() as db:
+        db.execute(
+            update(models.Target)
+            .where(models.Target.id == target_id)
+            .values(first_name="Augusta")
+        )
+        versions.bump(db, {versions.TARGETS}, {target_id})
+        db.commit()
+
+    stale = target_cache.stale
+    assert client.get(f"{api}/targets/{target_id}").json()["first_name"] == "Augusta"
+    assert client.get(f"{api}/targets").json()[0]["first_name"] == "Augusta"
+    assert target_cache.stale == stale + 2
+
+
+@pytest.mark.parametrize("revalidate", [True, False])
+def test_hits_query_the_database_if_revalidated(
+    client: tp.Any, api: str, cache_backend: tp.Any, statements: tp.List[str], revalidate: bool
+) -> None:
+    target_cache._revalidate = revalidate
+    target_id = client.post(f"{api}/targets", json=TARGET).json()["id"]
+    for url in (f"{api}/targets/{target_id}", f"{api}/targets"):
+        etag = client.get(url).headers["etag"]
+        del statements[:]
+        hits, direct_hits = target_cache.hits, target_cache.direct_hits
+
+        response = client.get(url)
+        assert response.status_code == 200 and response.headers["etag"] == etag
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+        # a revalidated 304 is answered out of the versions, not of the entry
+        assert target_cache.hits == hits + (1 if revalidate else 2)
+        assert target_cache.direct_hits == direct_hits + (0 if revalidate else 2)
+        assert bool(statements) == revalidate
+
+
+def test_revalidate_default_follows_backend(cache_backend: tp.Any) -> None:
+    target_cache._revalidate = None
+    assert target_cache.revalidate is not cache_backend.shared
+    assert target_cache.stats()["revalidate"] is target_cache.revalidate
+
+
+def test_redis_backend(redis_url: str) -> None:
+    cache = TargetCache(RedisCache(redis_url), ttl=60, prefix=f"test-{uuid.uuid4().hex}:")
+    assert not cache.revalidate
+    response = CachedResponse('"target-1-1"', {"X-Next-Cursor": "abc"}, b'{"id":1}')
+    key = cache.target_key(1)
+    assert cache.get(key) is None
+    cache.put(key, response)
+    assert cache.get(key) == response
+    assert cache.validate(response, '"target-1-2"') is None
+
+    list_key = cache.list_key("query")
+    assert cache.list_key("query") == list_key
+    cache.put(list_key, response)
+    cache.invalidate([1])
+    assert cache.get(key) is None
+    assert cache.list_key("query") != list_key
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["direct_hits"], stats["misses"], stats["stale"]) == (1, 1, 3, 1)
+    assert (stats["errors"], stats["backend"]) == (0, "RedisCache")
+
+
+def test_redis_down_is_a_miss() -> None:
+    cache = TargetCache(RedisCache("redis://127.0.0.1:1/0", timeout=0.1))
+    response = CachedResponse('"target-1-1"', {}, b"{}")
+    cache.put(cache.target_key(1), response)
+    assert cache.get(cache.target_key(1)) is None
+    assert cache.errors == 2
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_clear_drops_the_prefixed_entries(request: tp.Any, backend: str) -> None:
+    cache_backend = (
+        MemoryCache() if backend == "memory" else RedisCache(request.getfixturevalue("redis_url"))
+    )
+    cache = TargetCache(cache_backend, prefix=f"test-{uuid.uuid4().hex}:")
+    other = TargetCache(cache_backend, prefix=f"test-{uuid.uuid4().hex}:")
+    response = CachedResponse('"target-1-1"', {}, b"{}")
+    for target_id in range(1500):
+        cache.put(cache.target_key(target_id), response)
+    other.put(other.target_key(1), response)
+
+    cache.clear()
+    assert cache.get(cache.target_key(1)) is None and cache.get(cache.target_key(1499)) is None
+    assert other.get(other.target_key(1)) == response
@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+import typing as tp
+
+import pytest
+from sqlalchemy import event
+
+from app.database import session
+from app.database.cache import target_cache
+from app.database.session import Base, engine
+from app.router import targets as targets_router
+
+TARGETS = [
+    {
+        "first_name": 'Quote "Q"',
+        "last_name": "Back\\slash",
+        "dob": "1990-01-01",
+        "pictures": [{"path": "/a b.png"}, {"path": "/ü.png"}],
+    },
+    {"first_name": "Multi\nLine", "last_name": "Comma, Semi;", "dob": "1985-02-03", "pictures": []},
+    {
+        "first_name": "Ünïcödé \u2028",
+        "last_name": "Tab\tEnd",
+        "dob": "2000-12-31",
+        "pictures": [{"path": "/c.png"}],
+    },
+    {"first_name": "Plain", "last_name": "Doe", "dob": "1970-01-01", "pictures": []},
+    {
+        "first_name": "Last",
+        "last_name": "'Single'",
+        "dob": "1999-09-09",
+        "pictures": [{"path": "/d.png"}],
+    },
+]
+
+
+@pytest.fixture
+def batch_size(monkeypatch: tp.Any) -> int:
+    """Export batches smaller than the targets, the last one partial."""
+    monkeypatch.setattr(targets_router, "EXPORT_BATCH_SIZE", 2)
+    return 2
+
+
+def export(client: tp.Any, api: str) -> tp.List[dict]:
+    response = client.get(f"{api}/targets/export", params={"include": "pictures"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    *lines, last = response.text.split("\n")
+    assert last == ""
+    return [json.loads(line) for line in lines]
+
+
+def without_ids(targets: tp.List[dict]) -> tp.List[dict]:
+    return [
+        {
+            "first_name": target["first_name"],
+            "last_name": target["last_name"],
+            "dob": target["dob"],
+            "pictures": [{"path": picture["path"]} for picture in target["pictures"]],
+        }
+        for target in targets
+    ]
+
+
+def reset() -> None:
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    target_cache.clear()
+
+
+def to_csv(targets: tp.List[dict]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["first_name", "last_name", "dob", "pictures"])
+    for target in targets:
+        paths = "|".join(picture["path"] for picture in target["pictures"])
+        writer.writerow([target["first_name"], target["last_name"], target["dob"], paths])
+    return buffer.getvalue()
+
+
+def test_export(client: tp.Any, api: str, batch_size: int) -> None:
+    client.post(f"{api}/targets/bulk", json=TARGETS)
+    exported = export(client, api)
+    assert without_ids(exported) == TARGETS
+    assert [target["id"] for target in exported] == [1, 2, 3, 4, 5]
+
+    response = client.get(f"{api}/targets/export")
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {key: value for key, value in target.items() if key != "pictures"} for target in exported
+    ]
+
+
+def test_export_loads_pictures_per_batch(client: tp.Any, api: str, batch_size: int) -> None:
+    client.post(f"{api}/targets/bulk", json=TARGETS)
+    statements: tp.List[str] = []
+
+    def record(conn: tp.Any, cursor: tp.Any, statement: str, *args: tp.Any) -> None:
+        statements.append(statement)
+
+    # the export reads with its own synchronous session in either mode
+    event.listen(session.engine, "before_cursor_execute", record)
+    try:
+        assert len(export(client, api)) == len(TARGETS)
+    finally:
+        event.remove(session.engine, "before_cursor_execute", record)
+    # one query for the targets, streamed, and one for the pictures of each batch
+    assert sum("FROM targets" in statement for statement in statements) == 1
+    assert sum("FROM pictures" in statement for statement in statements) == 3
+
+
+@pytest.mark.parametrize("format", ["ndjson", "csv"])
+def test_export_import_round_trip(client: tp.Any, api: str, batch_size: int, format: str) -> None:
+    client.post(f"{api}/targets/bulk", json=TARGETS)
+    exported = export(client, api)
+
+    if format == "ndjson":
+        # ids would update the targets, an empty database has none
+        body = "".join(json.dumps(target) + "\n" for target in without_ids(exported))
+    else:
+        body = to_csv(exported)
+    reset()
+    response = client.post(f"{api}/targets/import", params={"format": format}, data=body.encode())
+    report = response.json()
+    assert (report["rows"], report["created"], report["invalid"]) == (len(TARGETS), len(TARGETS), 0)
+    assert report["pictures"] == sum(len(target["pictures"]) for target in TARGETS)
+
+    assert export(client, api) == exported
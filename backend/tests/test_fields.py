@@ -0,0 +1,119 @@
+import typing as tp
+
+import pytest
+
+from app.database.cache import target_cache
+
+TARGETS = [
+    {"first_name": "Ann", "last_name": "Doe", "dob": "1985-03-01", "pictures": [{"path": "/a"}]},
+    {"first_name": "Bea", "last_name": "Roe", "dob": "1992-07-15", "pictures": []},
+]
+
+
+@pytest.fixture
+def target_ids(client: tp.Any, api: str) -> tp.List[int]:
+    created = client.post(f"{api}/targets/bulk", json=TARGETS).json()["created"]
+    return [target["id"] for target in created]
+
+
+def selects(statements: tp.List[str]) -> tp.List[str]:
+    return [statement for statement in statements if statement.startswith("SELECT")]
+
+
+def test_list_projection(client: tp.Any, api: str, target_ids: tp.List[int]) -> None:
+    response = client.get(f"{api}/targets", params={"fields": " dob,last_name, dob "})
+    assert response.status_code == 200
+    # schema order, only the fields asked for
+    assert response.json() == [
+        {"last_name": "Doe", "dob": "1985-03-01"},
+        {"last_name": "Roe", "dob": "1992-07-15"},
+    ]
+    response = client.get(f"{api}/targets", params={"fields": "id,pictures"})
+    assert response.json() == [
+        {"id": target_ids[0], "pictures": [{"path": "/a", "id": 1, "target_id": target_ids[0]}]},
+        {"id": target_ids[1], "pictures": []},
+    ]
+
+
+def test_projection_selects_only_its_columns(
+    client: tp.Any, api: str, target_ids: tp.List[int], statements: tp.List[str]
+) -> None:
+    client.get(f"{api}/targets", params={"fields": "last_name"})
+    client.get(f"{api}/targets/{target_ids[0]}", params={"fields": "dob"})
+    client.get(f"{api}/targets/pictures", params={"fields": "path"})
+    queries = [query for query in selects(statements) if "table_versions" not in query]
+    assert len(queries) == 3
+    assert not any("first_name" in query.split("FROM")[0] for query in queries)
+    assert "target_id" not in queries[2].split("FROM")[0]
+
+
+def test_target_and_picture_projection(
+    client: tp.Any, api: str, target_ids: tp.List[int]
+) -> None:
+    response = client.get(f"{api}/targets/{target_ids[1]}", params={"fields": "first_name"})
+    assert response.json() == {"first_name": "Bea"}
+    response = client.get(f"{api}/targets/pictures", params={"fields": "target_id,path"})
+    assert response.json() == [{"path": "/a", "target_id": target_ids[0]}]
+    response = client.post(
+        f"{api}/targets/batch-get", params={"fields": "last_name"}, json={"ids": target_ids}
+    )
+    assert response.json() == {"found": [{"last_name": "Doe"}, {"last_name": "Roe"}], "missing": []}
+
+
+@pytest.mark.parametrize("fields", ["", ",", "id,age", "picture_count", "version"])
+@pytest.mark.parametrize("path", ["/targets", "/targets/{id}", "/targets/pictures"])
+def test_unknown_fields_rejected(
+    client: tp.Any, api: str, target_ids: tp.List[int], fields: str, path: str
+) -> None:
+    response = client.get(api + path.format(id=target_ids[0]), params={"fields": fields})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Invalid fields")
+
+
+def test_batch_get_unknown_fields_rejected(
+    client: tp.Any, api: str, target_ids: tp.List[int]
+) -> None:
+    response = client.post(
+        f"{api}/targets/batch-get", params={"fields": "id,age"}, json={"ids": target_ids}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/targets", "/targets/{id}"])
+def test_etag_varies_with_fields(
+    client: tp.Any, api: str, target_ids: tp.List[int], path: str
+) -> None:
+    url = api + path.format(id=target_ids[0])
+    etags = {
+        fields: client.get(url, params={"fields": fields} if fields else {}).headers["etag"]
+        for fields in (None, "last_name", "dob", "last_name,dob")
+    }
+    assert len(set(etags.values())) == len(etags)
+
+    # the ETag of other fields does not validate these
+    headers = {"If-None-Match": etags["last_name"]}
+    response = client.get(url, params={"fields": "dob"}, headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body == {"dob": "1985-03-01"} or body == [{"dob": "1985-03-01"}, {"dob": "1992-07-15"}]
+    response = client.get(url, params={"fields": "last_name"}, headers=headers)
+    assert response.status_code == 304
+
+
+def test_list_cache_key_varies_with_fields(
+    client: tp.Any, api: str, target_ids: tp.List[int]
+) -> None:
+    first = client.get(f"{api}/targets", params={"fields": "last_name"}).json()
+    hits = target_cache.hits
+    assert client.get(f"{api}/targets", params={"fields": "last_name"}).json() == first
+    assert target_cache.hits == hits + 1
+
+    assert client.get(f"{api}/targets", params={"fields": "first_name"}).json() == [
+        {"first_name": "Ann"},
+        {"first_name": "Bea"},
+    ]
+    assert client.get(f"{api}/targets").json() == [
+        {"id": target_ids[0], "first_name": "Ann", "last_name": "Doe"},
+        {"id": target_ids[1], "first_name": "Bea", "last_name": "Roe"},
+    ]
+    assert target_cache.hits == hits + 1
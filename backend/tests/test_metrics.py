@@ -0,0 +1,29 @@
+import typing as tp
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app.service import metrics
+
+
+def test_failed_statement_start_time_dropped() -> None:
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    with engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing_table"))
+        connection.execute(text("SELECT 1"))
+        assert connection.connection.info["query_start"] == []
+
+
+def test_statements_timed_per_request(client: tp.Any, api: str) -> None:
+    client.get(f"{api}/targets")
+    samples = {
+        sample.labels["route"]: sample.value
+        for family in metrics.REQUEST_DB_STATEMENTS.collect()
+        for sample in family.samples
+        if sample.name.endswith("_count")
+    }
+    assert samples[f"{api}/targets"] >= 1
@@ -0,0 +1,97 @@
+import typing as tp
+
+import pytest
+
+from app.service import token_cache as token_cache_module
+from app.service.token_cache import ENTRY_OVERHEAD, TokenCache
+
+NOW = 1_700_000_000.0
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = NOW
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: tp.Any) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(token_cache_module, "time", clock)
+    return clock
+
+
+def claims(sid: str = "s1", exp: float = NOW + 300, **extra: tp.Any) -> dict:
+    return dict({"sub": "u1", "sid": sid, "exp": exp}, **extra)
+
+
+def test_hit_until_exp(clock: Clock) -> None:
+    cache = TokenCache()
+    cache.put("token", claims())
+    assert cache.get("token") == claims()
+    clock.now = NOW + 299
+    assert cache.get("token") == claims()
+    clock.now = NOW + 300
+    assert cache.get("token") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"], stats["entries"]) == (2, 1, 1, 0)
+
+
+def test_expired_or_exp_less_tokens_not_cached(clock: Clock) -> None:
+    cache = TokenCache()
+    cache.put("expired", claims(exp=NOW))
+    cache.put("no-exp", {"sub": "u1"})
+    cache.put("bad-exp", claims(exp="tomorrow"))
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction_by_entries(clock: Clock) -> None:
+    cache = TokenCache(max_entries=2)
+    cache.put("a", claims())
+    cache.put("b", claims())
+    assert cache.get("a") is not None
+    cache.put("c", claims())
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_eviction_by_bytes(clock: Clock) -> None:
+    cache = TokenCache(max_bytes=2 * (10 + ENTRY_OVERHEAD))
+    for token in ("aaaaaaaaaa", "bbbbbbbbbb", "cccccccccc"):
+        cache.put(token, claims())
+    assert cache.get("aaaaaaaaaa") is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 2 * (10 + ENTRY_OVERHEAD), 1)
+    # a token larger than the whole cache is not cached, nothing is evicted for it
+    cache.put("x" * (2 * ENTRY_OVERHEAD), claims())
+    assert cache.stats()["entries"] == 2
+
+
+def test_revoke_session(clock: Clock) -> None:
+    cache = TokenCache()
+    cache.put("a", claims(sid="s1"))
+    cache.put("b", {"sub": "u1", "session_state": "s1", "exp": NOW + 300})
+    cache.put("c", claims(sid="s2"))
+    cache.revoke_session("s1", until=NOW + 600)
+    assert cache.get("a") is None and cache.get("b") is None
+    assert cache.get("c") is not None
+    # tokens of the revoked session are not cached again
+    cache.put("a", claims(sid="s1"))
+    assert cache.get("a") is None
+
+    # the revocation is forgotten after ``until``
+    clock.now = NOW + 601
+    cache.revoke_session("s3")
+    assert cache.stats()["revoked_sessions"] == 1
+    cache.put("a", claims(sid="s1", exp=NOW + 900))
+    assert cache.get("a") is not None
+
+
+def test_disabled(clock: Clock) -> None:
+    cache = TokenCache(max_entries=0)
+    cache.put("a", claims())
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 0
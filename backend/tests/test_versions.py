@@ -0,0 +1,69 @@
+import typing as tp
+
+from sqlalchemy import event
+
+from app.database import versions
+from app.database import session
+from app.database.session import SessionLocal
+
+TARGET = {"first_name": "Ada", "last_name": "Lovelace", "dob": "1815-12-10"}
+
+
+def current_versions(target_id: int) -> tp.Tuple[int, int, tp.Optional[int]]:
+    """Versions of the targets and pictures tables, and of the target."""
+    with SessionLocal() as db:
+        tables = versions.get_table_versions(db, {versions.TARGETS, versions.PICTURES})
+        return (
+            tables[versions.TARGETS],
+            tables[versions.PICTURES],
+            versions.get_target_version(db, target_id),
+        )
+
+
+def test_writes_bump_versions(client: tp.Any, api: str) -> None:
+    target_id = client.post(f"{api}/targets", json=TARGET).json()["id"]
+    targets, pictures, target = current_versions(target_id)
+
+    client.put(f"{api}/targets/{target_id}", json=dict(TARGET, first_name="Augusta"))
+    assert current_versions(target_id) == (targets + 1, pictures, target + 1)
+
+    client.post(f"{api}/targets/{target_id}/pictures", json={"path": "/a.png"})
+    assert current_versions(target_id) == (targets + 1, pictures + 1, target + 2)
+
+    client.post(f"{api}/targets/{target_id}/pictures/bulk", json=[{"path": "/b.png"}])
+    assert current_versions(target_id) == (targets + 1, pictures + 2, target + 3)
+
+    other_id = client.post(f"{api}/targets/bulk", json=[TARGET]).json()["created"][0]["id"]
+    assert current_versions(target_id) == (targets + 2, pictures + 2, target + 3)
+
+    client.delete(f"{api}/targets/{other_id}")
+    assert current_versions(target_id) == (targets + 3, pictures + 3, target + 3)
+
+
+def test_table_versions_bumped_after_commit(client: tp.Any, api: str) -> None:
+    """The shared counters aren't locked for the length of the write transactions."""
+    target_id = client.post(f"{api}/targets", json=TARGET).json()["id"]
+    events: tp.List[str] = []
+
+    def statement(conn: tp.Any, cursor: tp.Any, sql: str, *args: tp.Any) -> None:
+        if not sql.startswith("SELECT"):
+            events.append(" ".join(sql.split()[:2]))
+
+    def commit(conn: tp.Any) -> None:
+        events.append("COMMIT")
+
+    engine = session.async_engine.sync_engine if session.ASYNC_DATABASE else session.engine
+    event.listen(engine, "before_cursor_execute", statement)
+    event.listen(engine, "commit", commit)
+    try:
+        client.put(f"{api}/targets/{target_id}", json=dict(TARGET, first_name="Augusta"))
+    finally:
+        event.remove(engine, "before_cursor_execute", statement)
+        event.remove(engine, "commit", commit)
+    assert events == [
+        "UPDATE targets",
+        "UPDATE targets",
+        "COMMIT",
+        "UPDATE table_versions",
+        "COMMIT",
+    ]
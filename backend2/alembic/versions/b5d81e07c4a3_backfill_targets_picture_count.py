@@ -0,0 +1,29 @@
+"""Backfill targets.picture_count
+
+Revision ID: b5d81e07c4a3
+Revises: f7c3a19e5d62
+Create Date: 2026-10-18 19:44:51.062417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database.migration_helpers import update_in_batches
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d81e07c4a3'
+down_revision = 'f7c3a19e5d62'
+branch_labels = None
+depends_on = None
+
+PICTURE_COUNT = "(SELECT count(*) FROM pictures WHERE pictures.target_id = targets.id)"
+
+
+def upgrade():
+    # only the wrong counts are written, a resumed run skips the updated ranges
+    update_in_batches('targets', f"picture_count = {PICTURE_COUNT}", f"picture_count <> {PICTURE_COUNT}")
+
+
+def downgrade():
+    pass
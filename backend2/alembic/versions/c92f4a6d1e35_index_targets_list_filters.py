@@ -0,0 +1,44 @@
+"""Index the sort keys and filters of the targets list
+
+Revision ID: c92f4a6d1e35
+Revises: b5d81e07c4a3
+Create Date: 2026-10-18 19:47:13.894520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database.migration_helpers import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'c92f4a6d1e35'
+down_revision = 'b5d81e07c4a3'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_targets_first_name_id', ['first_name', 'id'], {}),
+    ('ix_targets_last_name_id', ['last_name', 'id'], {}),
+    ('ix_targets_last_name_dob', ['last_name', 'dob', 'id'], {}),
+    (
+        'ix_targets_last_name_pattern',
+        ['last_name'],
+        {'postgresql_ops': {'last_name': 'varchar_pattern_ops'}},
+    ),
+    ('ix_targets_dob_id', ['dob', 'id'], {}),
+    ('ix_targets_picture_count_id', ['picture_count', 'id'], {}),
+]
+
+
+def upgrade():
+    for index_name, columns, kw in INDEXES:
+        create_index_concurrently(index_name, 'targets', columns, **kw)
+    if op.get_context().dialect.name == 'postgresql':
+        # statistics of the new column, for the plans of the picture filters
+        op.execute('ANALYZE targets')
+
+
+def downgrade():
+    for index_name, _, _ in reversed(INDEXES):
+        drop_index_concurrently(index_name, 'targets')
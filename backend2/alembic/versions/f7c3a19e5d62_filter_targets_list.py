@@ -0,0 +1,37 @@
+"""Filter and sort the targets list by indexed columns
+
+Revision ID: f7c3a19e5d62
+Revises: d41c7e5b2f83
+Create Date: 2026-10-18 19:42:08.731904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.database.migration_helpers import set_not_null
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7c3a19e5d62'
+down_revision = 'd41c7e5b2f83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the API never writes NULLs, declaring it lets the sort orders be index scans
+    set_not_null('targets', {'first_name': sa.String(), 'last_name': sa.String(), 'dob': sa.Date()})
+    # denormalized so that the picture filters are an index range, filled by
+    # b5d81e07c4a3 and indexed by c92f4a6d1e35
+    op.add_column(
+        'targets',
+        sa.Column('picture_count', sa.Integer(), server_default='0', nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_column('targets', 'picture_count')
+    with op.batch_alter_table('targets') as batch_op:
+        for column in ('first_name', 'last_name'):
+            batch_op.alter_column(column, existing_type=sa.String(), nullable=True)
+        batch_op.alter_column('dob', existing_type=sa.Date(), nullable=True)
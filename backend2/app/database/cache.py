@@ -0,0 +1,379 @@
+"""Read-through cache of the target responses, invalidated by the crud writes.
+
+The backend is selected with ``TARGET_CACHE``:
+
+- ``memory``: LRU bounded in entries and bytes, private to the process
+- ``redis``: any Redis-protocol server at ``TARGET_CACHE_REDIS_URL``, shared
+  by every process and service using the same database
+- ``none``: no caching
+
+``TARGET_CACHE_REVALIDATE`` (``auto`` by default) decides whether a hit is
+checked against the database. A checked entry is only served if its ETag
+is still the one of the version counters read from the database (one
+primary key lookup), so writes the cache can't see are never served
+stale, e.g. those of another process with the memory backend. An
+unchecked hit needs no database query, and writes the cache doesn't see
+(``fake_data.py``, SQL) are served until the entry expires. ``auto``
+checks the hits of the memory backend, private to the process, but not
+those of redis, whose entries the writes of every process invalidate.
+Entries expire after ``TARGET_CACHE_TTL`` seconds.
+"""
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
+import typing as tp
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+import redis
+
+TARGET_CACHE = os.environ.get("TARGET_CACHE", "memory")
+TARGET_CACHE_TTL = float(os.environ.get("TARGET_CACHE_TTL", 60))
+TARGET_CACHE_SIZE = int(os.environ.get("TARGET_CACHE_SIZE", 10000))
+TARGET_CACHE_MAX_BYTES = int(os.environ.get("TARGET_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+TARGET_CACHE_REDIS_URL = os.environ.get("TARGET_CACHE_REDIS_URL", "redis://localhost:6379/0")
+TARGET_CACHE_PREFIX = os.environ.get("TARGET_CACHE_PREFIX", "targets:")
+TARGET_CACHE_REVALIDATE = os.environ.get("TARGET_CACHE_REVALIDATE", "auto").lower()
+
+# rough per-entry bookkeeping overhead (key, tuple, OrderedDict node) in bytes
+ENTRY_OVERHEAD = 128
+
+
+class CachedResponse(tp.NamedTuple):
+    etag: str
+    headers: tp.Dict[str, str]
+    body: bytes
+
+    def dumps(self) -> bytes:
+        meta = json.dumps({"etag": self.etag, "headers": self.headers}, separators=(",", ":"))
+        return meta.encode() + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, value: bytes) -> "CachedResponse":
+        meta, body = value.split(b"\n", 1)
+        fields = json.loads(meta)
+        return cls(fields["etag"], fields["headers"], body)
+
+
+class NullCache:
+    """Backend caching nothing."""
+
+    blocking = False
+    shared = False
+
+    def get(self, key: str) -> tp.Optional[bytes]:
+        return None
+
+    def set(self, key: str, value: bytes, ttl: tp.Optional[float] = None) -> None:
+        pass
+
+    def add(self, key: str, value: bytes) -> None:
+        pass
+
+    def delete(self, *keys: str) -> None:
+        pass
+
+    def clear(self, prefix: str = "") -> None:
+        pass
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        return {}
+
+
+class _Entry(tp.NamedTuple):
+    value: bytes
+    expires_at: tp.Optional[float]
+    size: int
+
+
+class MemoryCache:
+    """Thread-safe LRU cache of bytes holding at most ``max_entries`` entries
+    and about ``max_bytes`` of memory.
+    """
+
+    blocking = False
+    shared = False
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> tp.Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def set(self, key: str, value: bytes, ttl: tp.Optional[float] = None) -> None:
+        entry = _Entry(
+            value,
+            time.monotonic() + ttl if ttl else None,
+            len(key) + len(value) + ENTRY_OVERHEAD,
+        )
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def add(self, key: str, value: bytes) -> None:
+        """Set ``key`` unless it is already cached."""
+        with self._lock:
+            if key in self._entries:
+                return
+        self.set(key, value)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def clear(self, prefix: str = "") -> None:
+        """Delete the entries whose key starts with ``prefix``."""
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._remove(key)
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        return {
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+
+class RedisCache:
+    """Backend storing the entries on a Redis-protocol server."""
+
+    blocking = True
+    shared = True
+
+    def __init__(self, url: str, timeout: float = 0.5) -> None:
+        self._client = redis.Redis.from_url(
+            url, socket_timeout=timeout, socket_connect_timeout=timeout
+        )
+
+    def get(self, key: str) -> tp.Optional[bytes]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: tp.Optional[float] = None) -> None:
+        self._client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key: str, value: bytes) -> None:
+        self._client.set(key, value, nx=True)
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self._client.delete(*keys)
+
+    def clear(self, prefix: str = "") -> None:
+        """Delete the keys starting with ``prefix``, a batch at a time."""
+        batch = []
+        for key in self._client.scan_iter(match=prefix + "*", count=1000):
+            batch.append(key)
+            if len(batch) >= 1000:
+                self._client.delete(*batch)
+                batch = []
+        self.delete(*batch)
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        """Return the server-wide counters, the server may be shared."""
+        info = self._client.info()
+        return {
+            "evictions": info.get("evicted_keys"),
+            "expirations": info.get("expired_keys"),
+            "entries": self._client.dbsize(),
+            "bytes": info.get("used_memory"),
+        }
+
+
+def revalidate_from_env() -> tp.Optional[bool]:
+    if TARGET_CACHE_REVALIDATE == "auto":
+        return None
+    return TARGET_CACHE_REVALIDATE in ("1", "true", "yes")
+
+
+def backend_from_env() -> tp.Any:
+    if TARGET_CACHE == "none":
+        return NullCache()
+    if TARGET_CACHE == "memory":
+        return MemoryCache(TARGET_CACHE_SIZE, TARGET_CACHE_MAX_BYTES)
+    if TARGET_CACHE == "redis":
+        return RedisCache(TARGET_CACHE_REDIS_URL)
+    raise ValueError(f"Unknown TARGET_CACHE {TARGET_CACHE!r}, expected none, memory or redis")
+
+
+class TargetCache:
+    """Cache of the ``GET /targets/{id}`` and ``GET /targets`` responses.
+
+    A target entry is deleted by the writes to that target. The list
+    entries are keyed by a generation which every write renews. With
+    ``revalidate`` (by default, unless the backend is shared by the
+    processes), a hit is then passed to ``validate``: if its ETag doesn't
+    match the current versions (e.g. stored by a read racing a write) it
+    is a miss, counted as ``stale``. Otherwise ``get`` serves it at once,
+    counted as a ``direct_hit``.
+
+    A failing backend (e.g. Redis being down) is counted as ``errors`` and
+    treated as a miss, the reads fall back to the database.
+    """
+
+    def __init__(
+        self,
+        backend: tp.Any,
+        ttl: float = 60,
+        prefix: str = "targets:",
+        revalidate: tp.Optional[bool] = None,
+    ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self._revalidate = revalidate
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.direct_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale = 0
+        self.errors = 0
+
+    @property
+    def revalidate(self) -> bool:
+        """Whether the hits are checked against the database versions."""
+        if self._revalidate is None:
+            return not self.backend.shared
+        return self._revalidate
+
+    @property
+    def _generation_key(self) -> str:
+        return f"{self.prefix}generation"
+
+    def target_key(self, target_id: int) -> str:
+        return f"{self.prefix}target:{target_id}"
+
+    def list_key(self, query: str) -> str:
+        """Return the key of a list response, ``query`` identifies its parameters."""
+        generation = self._call(self.backend.get, self._generation_key)
+        if generation is None:
+            # first use, or the generation was evicted: start a new one
+            self._call(self.backend.add, self._generation_key, uuid.uuid4().hex.encode())
+            generation = self._call(self.backend.get, self._generation_key) or b"none"
+        return f"{self.prefix}list:{generation.decode()}:{query}"
+
+    def get(self, key: str) -> tp.Optional[CachedResponse]:
+        """Return the cached response, to ``validate`` if ``revalidate`` is set."""
+        value = self._call(self.backend.get, key)
+        response = CachedResponse.loads(value) if value is not None else None
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            elif not self.revalidate:
+                self.hits += 1
+                self.direct_hits += 1
+        return response
+
+    def validate(
+        self, response: tp.Optional[CachedResponse], etag: str
+    ) -> tp.Optional[CachedResponse]:
+        """Return the response ``get`` returned, unless its ETag isn't ``etag`` anymore."""
+        if response is None:
+            return None
+        with self._lock:
+            if response.etag != etag:
+                self.misses += 1
+                self.stale += 1
+                return None
+            if self.revalidate:
+                self.hits += 1
+        return response
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        self._call(self.backend.set, key, response.dumps(), self.ttl)
+
+    def invalidate(self, target_ids: tp.Iterable[int] = ()) -> None:
+        """Drop the cached ``target_ids`` and every cached list."""
+        self._call(self.backend.delete, *(self.target_key(target_id) for target_id in target_ids))
+        self._call(self.backend.set, self._generation_key, uuid.uuid4().hex.encode())
+        with self._lock:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop every entry, after writes that bypass the crud (bulk loads)."""
+        self._call(self.backend.clear, self.prefix)
+        with self._lock:
+            self.invalidations += 1
+
+    def _call(self, method: tp.Callable, *args: tp.Any) -> tp.Any:
+        try:
+            return method(*args)
+        except redis.RedisError:
+            with self._lock:
+                self.errors += 1
+            return None
+
+    async def _acall(self, method: tp.Callable, *args: tp.Any) -> tp.Any:
+        # blocking backends (network) run in the threadpool, not in the event loop
+        if self.backend.blocking:
+            return await run_in_threadpool(method, *args)
+        return method(*args)
+
+    async def alist_key(self, query: str) -> str:
+        return await self._acall(self.list_key, query)
+
+    async def aget(self, key: str) -> tp.Optional[CachedResponse]:
+        return await self._acall(self.get, key)
+
+    async def aput(self, key: str, response: CachedResponse) -> None:
+        await self._acall(self.put, key, response)
+
+    async def ainvalidate(self, target_ids: tp.Iterable[int] = ()) -> None:
+        await self._acall(self.invalidate, list(target_ids))
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        """Return the hit/miss counters and the backend occupancy and evictions."""
+        lookups = self.hits + self.misses
+        stats = {
+            "backend": type(self.backend).__name__,
+            "revalidate": self.revalidate,
+            "hits": self.hits,
+            "direct_hits": self.direct_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "stale": self.stale,
+            "errors": self.errors,
+        }
+        try:
+            stats.update(self.backend.stats())
+        except redis.RedisError:
+            stats["errors"] += 1
+        return stats
+
+
+target_cache = TargetCache(
+    backend_from_env(), TARGET_CACHE_TTL, TARGET_CACHE_PREFIX, revalidate_from_env()
+)
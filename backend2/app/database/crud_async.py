@@ -0,0 +1,156 @@
+"""Async CRUD operations on database, mirroring ``crud``."""
+import typing as tp
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.service.tracing import traced
+
+from . import models, schemas, versions
+from .cache import target_cache
+from .crud import (
+    TARGET_FIELDS,
+    TARGET_RELATIONSHIPS,
+    PageQuery,
+    add_pictures_statement,
+    in_order,
+    pictures_of,
+    target_load_options,
+    target_query,
+    target_row_query,
+    targets_by_ids_query,
+    with_pictures,
+)
+from .pagination import DEFAULT_PAGE_SIZE, Page
+from .search import TargetSearch
+
+# relationships can't be lazy loaded from the event loop, they are either
+# loaded upfront or not at all (see crud.target_load_options)
+
+
+async def _bump_targets(db: AsyncSession, target_ids: tp.Collection[int]) -> None:
+    await db.execute(versions.target_bump_statement(target_ids))
+
+
+async def _bump_tables(db: AsyncSession, tables: tp.Collection[str]) -> None:
+    # after the change is committed, see versions.bump_tables
+    await db.execute(versions.table_bump_statement(tables))
+    await db.commit()
+
+
+@traced()
+async def get_table_versions(db: AsyncSession, tables: tp.Collection[str]) -> tp.Dict[str, int]:
+    return dict((await db.execute(versions.table_versions_query(tables))).all())
+
+
+@traced()
+async def get_target_version(db: AsyncSession, target_id: int) -> tp.Optional[int]:
+    return (await db.execute(versions.target_version_query(target_id))).scalar()
+
+
+@traced()
+async def get_target(
+    db: AsyncSession,
+    target_id: int,
+    include: tp.Collection[str] = TARGET_RELATIONSHIPS.keys(),
+) -> schemas.Target:
+    result = await db.execute(target_query(target_id, include, selectinload))
+    target = result.scalars().first()
+    if not target:
+        raise HTTPException(status_code=404, detail="Target not found")
+    return target
+
+
+@traced()
+async def get_page(db: AsyncSession, paged: PageQuery) -> Page:
+    page = paged.page(await db.execute(paged.query))
+    pictures = pictures_of(page.items, paged.fields or (), db.bind.dialect.name)
+    if pictures is not None:
+        page = page._replace(items=with_pictures(page.items, await db.execute(pictures)))
+    return page
+
+
+@traced()
+async def get_target_row(db: AsyncSession, target_id: int, fields: tp.Collection[str]) -> tp.Any:
+    row = (await db.execute(target_row_query(target_id, fields))).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Target not found")
+    pictures = pictures_of([row], fields, db.bind.dialect.name)
+    if pictures is not None:
+        row = with_pictures([row], await db.execute(pictures))[0]
+    return row
+
+
+@traced()
+async def get_targets_by_ids(
+    db: AsyncSession, ids: tp.Sequence[int], fields: tp.Collection[str] = TARGET_FIELDS
+) -> tp.Tuple[tp.List[tp.Any], tp.List[int]]:
+    dialect = db.bind.dialect.name
+    rows = (await db.execute(targets_by_ids_query(ids, fields, dialect))).all()
+    pictures = pictures_of(rows, fields, dialect)
+    if pictures is not None:
+        rows = with_pictures(rows, await db.execute(pictures))
+    return in_order(rows, ids)
+
+
+@traced()
+async def search_targets(
+    db: AsyncSession, q: str, limit: int = DEFAULT_PAGE_SIZE, cursor: tp.Optional[str] = None
+) -> Page:
+    search = TargetSearch(q, db.bind.dialect.name)
+    rows = (await db.execute(search.query(limit, cursor).options(*target_load_options()))).all()
+    return search.page(rows, limit)
+
+
+@traced()
+async def create_target(db: AsyncSession, target: schemas.TargetIn) -> schemas.Target:
+    db_target = models.Target(**target.dict())
+    db.add(db_target)
+    await db.commit()
+    await _bump_tables(db, {versions.TARGETS})
+    await target_cache.ainvalidate()
+    return await get_target(db, db_target.id)
+
+
+@traced()
+async def edit_target(
+    db: AsyncSession, target_id: int, target: schemas.TargetIn
+) -> schemas.Target:
+    db_target = await get_target(db, target_id)
+
+    update_data = target.dict(exclude_unset=True)
+    for key, value in update_data.items():
+        setattr(db_target, key, value)
+
+    db.add(db_target)
+    await _bump_targets(db, {target_id})
+    await db.commit()
+    await _bump_tables(db, {versions.TARGETS})
+    await target_cache.ainvalidate([target_id])
+    return db_target
+
+
+@traced()
+async def delete_target(db: AsyncSession, target_id: int) -> schemas.Target:
+    target = await get_target(db, target_id)
+    await db.delete(target)
+    await db.commit()
+    await _bump_tables(db, {versions.TARGETS, versions.PICTURES})
+    await target_cache.ainvalidate([target_id])
+    return target
+
+
+@traced()
+async def create_target_picture(
+    db: AsyncSession, picture: schemas.PictureCreate, target_id: int
+) -> schemas.Picture:
+    db_picture = models.Picture(**picture.dict(), target_id=target_id)
+    db.add(db_picture)
+    await db.execute(add_pictures_statement(target_id, 1))
+    await _bump_targets(db, {target_id})
+    await db.commit()
+    await _bump_tables(db, {versions.PICTURES})
+    await target_cache.ainvalidate([target_id])
+    await db.refresh(db_picture)
+    return db_picture
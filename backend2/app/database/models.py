@@ -1,5 +1,5 @@
 """Model corresponding to DB state."""
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import DDL, BigInteger, Column, ForeignKey, Index, Integer, String, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.sqltypes import Date
 
@@ -8,20 +8,68 @@ from .session import Base
 
 class Target(Base):
     __tablename__ = "targets"
+    # sort keys and filters of the targets list (app.database.filters)
+    __table_args__ = (
+        Index("ix_targets_first_name_id", "first_name", "id"),
+        Index("ix_targets_last_name_id", "last_name", "id"),
+        Index("ix_targets_last_name_dob", "last_name", "dob", "id"),
+        Index(
+            "ix_targets_last_name_pattern",
+            "last_name",
+            postgresql_ops={"last_name": "varchar_pattern_ops"},
+        ),
+        Index("ix_targets_dob_id", "dob", "id"),
+        Index("ix_targets_picture_count_id", "picture_count", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    first_name = Column(String)
-    last_name = Column(String)
-    dob = Column(Date)
+    first_name = Column(String, nullable=False)
+    last_name = Column(String, nullable=False)
+    dob = Column(Date, nullable=False)
+    # bumped by every crud write to the target or its pictures (ETag)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # maintained by the crud writes of pictures (filters)
+    picture_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     pictures = relationship("Picture", back_populates="target")
 
 
 class Picture(Base):
     __tablename__ = "pictures"
+    __table_args__ = (Index("ix_pictures_target_id", "target_id", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     path = Column(String)
     target_id = Column(Integer, ForeignKey("targets.id"))
 
     target = relationship("Target", back_populates="pictures")
+
+
+class TableVersion(Base):
+    """Version of a whole table, bumped by every crud write to it (ETag)."""
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=1, server_default="1")
+
+
+# tables created without alembic (e.g. tests) get their counters too
+event.listen(
+    TableVersion.__table__,
+    "after_create",
+    DDL(
+        f"INSERT INTO {TableVersion.__tablename__} (name) "
+        f"VALUES ('{Target.__tablename__}'), ('{Picture.__tablename__}')"
+    ),
+)
+
+# trigram index of the name search (app.database.search), Postgres only
+for _statement in (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    "CREATE INDEX ix_targets_name_trgm ON targets USING gist ("
+    "(lower(coalesce(first_name, '') || ' ' || coalesce(last_name, ''))) gist_trgm_ops(siglen=128), "
+    "(id::float8))",
+):
+    event.listen(Target.__table__, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
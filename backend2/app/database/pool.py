@@ -0,0 +1,95 @@
+"""Connection pool configuration and instrumentation."""
+import os
+import threading
+import time
+import typing as tp
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+def pool_options(url: str, async_: bool = False) -> tp.Dict[str, tp.Any]:
+    """Return the ``create_engine`` pool arguments configured by env vars.
+
+    Args:
+        url: database URL, SQLite keeps the SQLAlchemy default pool
+        async_: options for ``create_async_engine``
+
+    Returns:
+        keyword arguments for ``create_engine``/``create_async_engine``
+    """
+    if url.startswith("sqlite"):
+        # FastAPI closes the sessions of get_db in another threadpool thread
+        return {} if async_ else {"connect_args": {"check_same_thread": False}}
+    return {
+        "poolclass": MeteredAsyncAdaptedQueuePool if async_ else MeteredQueuePool,
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+    }
+
+
+class _MeteredPoolMixin:
+    """Count checkouts, new connections, timeouts and checkout wait time."""
+
+    def __init__(self, *args: tp.Any, **kwargs: tp.Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _do_get(self) -> tp.Any:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+    def _create_connection(self) -> tp.Any:
+        with self._stats_lock:
+            self.connects += 1
+        return super()._create_connection()
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        """Return the live state and the counters of the pool."""
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "timeouts": self.timeouts,
+            "wait_time_avg": self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+            "wait_time_max": self.wait_time_max,
+        }
+
+
+class MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    pass
+
+
+class MeteredAsyncAdaptedQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_stats(engine: tp.Any) -> tp.Dict[str, tp.Any]:
+    """Return the pool statistics of a (sync or async) engine."""
+    pool = getattr(engine, "sync_engine", engine).pool
+    if isinstance(pool, _MeteredPoolMixin):
+        return pool.stats()
+    return {"status": pool.status()}
@@ -15,7 +15,8 @@ class PictureCreate(PictureBase):
 
 class Picture(PictureBase):
     id: int
-    target_id: int
+    # nullable, as the column
+    target_id: tp.Optional[int]
 
     class Config:
         orm_mode = True
@@ -37,3 +38,50 @@ class Target(TargetBase):
 
     class Config:
         orm_mode = True
+
+
+class TargetBatchGetIn(BaseModel):
+    ids: tp.List[int]
+
+
+class TargetBatchGetResult(BaseModel):
+    found: tp.List[Target]
+    missing: tp.List[int] = []
+
+
+class TargetBulkIn(TargetIn):
+    pictures: tp.List[PictureCreate] = []
+
+
+class BulkItemError(BaseModel):
+    index: int
+    errors: tp.List[tp.Dict[str, tp.Any]]
+
+
+class TargetBulkResult(BaseModel):
+    created: tp.List[Target]
+    errors: tp.List[BulkItemError] = []
+
+
+class PictureBulkResult(BaseModel):
+    created: tp.List[Picture]
+    errors: tp.List[BulkItemError] = []
+
+
+class TargetImportIn(TargetBulkIn):
+    id: tp.Optional[int] = None
+
+
+class ImportRowError(BaseModel):
+    row: int
+    errors: tp.List[tp.Dict[str, tp.Any]]
+
+
+class ImportReport(BaseModel):
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    pictures: int = 0
+    missing: tp.List[int] = []
+    invalid: int = 0
+    errors: tp.List[ImportRowError] = []
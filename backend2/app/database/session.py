@@ -2,13 +2,27 @@
 import os
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 
+from .pool import pool_options
+
 SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# "sync" serves the targets router from the threadpool over psycopg2,
+# "async" serves it from the event loop over asyncpg
+DATABASE_MODE = os.environ.get("DATABASE_MODE", "sync")
+ASYNC_DATABASE = DATABASE_MODE == "async"
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **pool_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -20,3 +34,24 @@ def get_db() -> Session:
         yield db
     finally:
         db.close()
+
+
+def async_database_url(url: str) -> str:
+    """Swap the sync DBAPI of ``url`` for its asyncio counterpart."""
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+if ASYNC_DATABASE:
+    async_engine = create_async_engine(
+        async_database_url(SQLALCHEMY_DATABASE_URL),
+        **pool_options(SQLALCHEMY_DATABASE_URL, async_=True),
+    )
+    AsyncSessionLocal = sessionmaker(
+        async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+
+
+async def get_async_db() -> AsyncSession:
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,53 @@
+"""Conditional GET helpers (ETag / If-None-Match)."""
+import hashlib
+import typing as tp
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+from app.database.cache import CachedResponse
+
+# responses depend on the caller's token: only private caches, always revalidated
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: tp.Any) -> str:
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+
+def query_digest(request: Request) -> str:
+    """Digest of the query string, independent of the parameter order."""
+    query = urlencode(sorted(request.query_params.multi_items()))
+    return hashlib.sha1(query.encode()).hexdigest()[:16]
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Weak comparison of ``etag`` with the If-None-Match header (RFC 7232)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip() for tag in header.split(",")}
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def json_body(content: tp.Any) -> bytes:
+    """Serialize ``content`` like ``JSONResponse`` does."""
+    return JSONResponse(content).body
+
+
+def cached_response(request: Request, cached: CachedResponse) -> Response:
+    """Answer with a cached response, or 304 if the client has it already."""
+    if is_not_modified(request, cached.etag):
+        return not_modified(cached.etag)
+    return Response(
+        cached.body,
+        media_type="application/json",
+        headers={"ETag": cached.etag, "Cache-Control": CACHE_CONTROL, **cached.headers},
+    )
@@ -0,0 +1,164 @@
+"""Request logic shared by the sync and async target routers.
+
+The routers only do the I/O (database, cache) in between: parameters,
+ETags, cache keys and response bodies are built here.
+"""
+import os
+import typing as tp
+
+from fastapi import HTTPException, Request, Response
+
+from app.database import crud, schemas, versions
+from app.database.cache import CachedResponse
+from app.database.filters import TargetFilters
+from app.database.pagination import NEXT_CURSOR_HEADER, Page
+from app.router import serialization
+from app.router.conditional import cached_response, make_etag, query_digest
+from app.service import tracing
+
+# fields returned by the targets list
+TARGET_LIST_FIELDS = {"id", "first_name", "last_name"}
+
+BATCH_GET_MAX_IDS = int(os.environ.get("BATCH_GET_MAX_IDS", 1000))
+
+
+def batch_ids(ids: tp.List[int]) -> tp.List[int]:
+    """Deduplicate the ids of a batch get, keeping their order."""
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > BATCH_GET_MAX_IDS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {BATCH_GET_MAX_IDS} ids per request"
+        )
+    return ids
+
+
+def list_tables(
+    relationships: tp.AbstractSet[str], filters: TargetFilters, sort: str
+) -> tp.Set[str]:
+    """Return the tables whose versions make the ETag of a targets list.
+
+    The pictures are read by the embedded relationships, and through
+    ``picture_count`` by the picture filters and sort order.
+    """
+    tables = {versions.TARGETS}
+    if relationships or filters.filters_pictures or sort.lstrip("-") == "picture_count":
+        tables.add(versions.PICTURES)
+    return tables
+
+
+class TargetList:
+    """A targets list request: the tables of its ETag, its cache key, query and body."""
+
+    def __init__(
+        self,
+        request: Request,
+        limit: int,
+        cursor: tp.Optional[str],
+        sort: str,
+        include: tp.Optional[str],
+        fields: tp.Optional[str],
+        filters: TargetFilters,
+    ) -> None:
+        relationships = crud.parse_include(include)
+        self.projection = crud.parse_fields(fields, schemas.Target)
+        if self.projection is not None:
+            relationships |= self.projection & crud.TARGET_RELATIONSHIPS.keys()
+        self.relationships = relationships
+        filters.check_indexed(sort)
+        self.tables = list_tables(relationships, filters, sort)
+        self.digest = query_digest(request)
+        self.page_query = crud.target_page_query(
+            limit,
+            cursor,
+            sort,
+            include=relationships,
+            filters=filters,
+            fields=None if self.projection is None else self.projection | relationships,
+        )
+
+    def etag(self, table_versions: tp.Mapping[str, int]) -> str:
+        return make_etag(
+            *(f"{table}.{table_versions.get(table, 0)}" for table in sorted(self.tables)),
+            self.digest,
+        )
+
+    def response(self, etag: str, page: Page) -> CachedResponse:
+        with tracing.span("serialize", items=len(page.items)):
+            if self.projection is None:
+                include = TARGET_LIST_FIELDS | self.relationships
+                body = serialization.targets_body(page.items, include)
+            else:
+                serializer = serialization.target_serializer(self.projection | self.relationships)
+                body = serialization.rows_body(page.items, serializer)
+        headers = {NEXT_CURSOR_HEADER: page.next_cursor} if page.next_cursor else {}
+        return CachedResponse(etag, headers, body)
+
+
+def target_etag(target_id: int, version: tp.Optional[int]) -> str:
+    """ETag of a target at ``version``, 404 if it has none (no such target)."""
+    if version is None:
+        raise HTTPException(status_code=404, detail="Target not found")
+    return make_etag("target", target_id, version)
+
+
+def target_response(target: tp.Any) -> CachedResponse:
+    with tracing.span("serialize"):
+        body = serialization.target_body(target)
+    return CachedResponse(target_etag(target.id, target.version), {}, body)
+
+
+def target_row_response(
+    request: Request, row: tp.Any, projection: tp.FrozenSet[str]
+) -> Response:
+    """Response of the ``?fields=`` of a target, not cached, its ETag varies with the query."""
+    etag = make_etag("target", row.id, row.version, query_digest(request))
+    with tracing.span("serialize"):
+        body = serialization.row_body(row, serialization.target_serializer(projection))
+    return cached_response(request, CachedResponse(etag, {}, body))
+
+
+def batch_fields(fields: tp.Optional[str]) -> tp.FrozenSet[str]:
+    """Fields of a batch get, every field of a target by default."""
+    return crud.parse_fields(fields, schemas.Target) or crud.TARGET_FIELDS
+
+
+def batch_response(
+    found: tp.List[tp.Any], missing: tp.List[int], projection: tp.FrozenSet[str]
+) -> Response:
+    with tracing.span("serialize", items=len(found)):
+        body = serialization.batch_body(found, missing, serialization.target_serializer(projection))
+    return Response(body, media_type="application/json")
+
+
+def picture_fields(fields: tp.Optional[str]) -> tp.Optional[tp.FrozenSet[str]]:
+    return crud.parse_fields(fields, schemas.Picture)
+
+
+def page_response(
+    response: Response, page: Page, body: tp.Callable[[tp.List[tp.Any]], bytes]
+) -> tp.Any:
+    """Return a page, rendered by ``body`` with FAST_SERIALIZATION or by the response model.
+
+    The next page cursor is sent in X-Next-Cursor.
+    """
+    if serialization.FAST_SERIALIZATION:
+        return serialization.page_response(body(page.items), page.next_cursor)
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page.items
+
+
+def search_response(response: Response, page: Page) -> tp.Any:
+    return page_response(
+        response, page, lambda targets: serialization.targets_body(targets, TARGET_LIST_FIELDS)
+    )
+
+
+def pictures_response(
+    response: Response, page: Page, projection: tp.Optional[tp.FrozenSet[str]]
+) -> tp.Any:
+    """Return a page of pictures, or of only their ``projection`` (always rendered here)."""
+    if projection is not None:
+        body = serialization.rows_body(page.items, serialization.picture_serializer(projection))
+        return serialization.page_response(body, page.next_cursor)
+    return page_response(response, page, serialization.pictures_body)
@@ -1,14 +1,63 @@
 """Target router."""
+import os
 import typing as tp
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 from sqlalchemy.orm import Session
 
 from app.database import crud, schemas
-from app.database.session import get_db
+from app.database.cache import target_cache
+from app.database.filters import TargetFilters
+from app.database.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.database.search import SEARCH_MAX_LENGTH
+from app.database.session import SessionLocal, get_db
+from app.router.conditional import cached_response, is_not_modified, not_modified
+from app.router.target_requests import (
+    TARGET_LIST_FIELDS,
+    TargetList,
+    batch_fields,
+    batch_ids,
+    batch_response,
+    picture_fields,
+    pictures_response,
+    search_response,
+    target_etag,
+    target_response,
+    target_row_response,
+)
+from app.service import target_import
 
 router = APIRouter()
 
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", 10000))
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+IMPORT_CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", 5000))
+# invalid rows detailed in the import report, the others are only counted
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", 100))
+
+
+def _validate_items(
+    model: tp.Type[BaseModel], items: tp.List[tp.Any], all_or_nothing: bool
+) -> tp.Tuple[tp.List[tp.Any], tp.List[schemas.BulkItemError]]:
+    """Validate bulk items one by one, collecting per-item errors."""
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {BULK_MAX_ITEMS} items per request"
+        )
+    valid, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append(model.parse_obj(item))
+        except ValidationError as e:
+            errors.append(schemas.BulkItemError(index=index, errors=e.errors()))
+    if errors and all_or_nothing:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(errors))
+    return valid, errors
+
 
 @router.post("", response_model=schemas.Target)
 def create_target(
@@ -18,20 +67,203 @@ def create_target(
     return crud.create_target(db, target)
 
 
+@router.post("/bulk", response_model=schemas.TargetBulkResult)
+def create_targets_bulk(
+    targets: tp.List[tp.Any] = Body(...),
+    all_or_nothing: bool = False,
+    db: Session = Depends(get_db),
+) -> schemas.TargetBulkResult:
+    """Create targets, with optional nested pictures, in one transaction.
+
+    Invalid items are reported in ``errors`` and skipped, unless
+    ``all_or_nothing`` is set, in which case nothing is created.
+    """
+    valid, errors = _validate_items(schemas.TargetBulkIn, targets, all_or_nothing)
+    return schemas.TargetBulkResult(created=crud.create_targets_bulk(db, valid), errors=errors)
+
+
 @router.get(
     "",
     response_model=tp.List[schemas.Target],
-    response_model_include={"id", "first_name", "last_name"},
+    response_model_include=TARGET_LIST_FIELDS,
+)
+def read_targets(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: tp.Optional[str] = None,
+    sort: str = "id",
+    include: tp.Optional[str] = Query(None, description="Relationships to embed, e.g. pictures"),
+    fields: tp.Optional[str] = Query(None, description="Fields to return, e.g. id,last_name"),
+    filters: TargetFilters = Depends(),
+    db: Session = Depends(get_db),
+) -> tp.List[schemas.Target]:
+    """Get a page of targets, the next page cursor is sent in X-Next-Cursor.
+
+    The filters are combined with AND, combinations no index supports are
+    rejected (400). ``fields`` replaces the default id and names, only its
+    columns are selected.
+    """
+    targets = TargetList(request, limit, cursor, sort, include, fields, filters)
+    key = target_cache.list_key(targets.digest)
+    cached = target_cache.get(key)
+    if cached is None or target_cache.revalidate:
+        etag = targets.etag(crud.get_table_versions(db, targets.tables))
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        cached = target_cache.validate(cached, etag)
+        if cached is None:
+            cached = targets.response(etag, crud.get_page(db, targets.page_query))
+            target_cache.put(key, cached)
+    return cached_response(request, cached)
+
+
+@router.get("/export", response_class=StreamingResponse)
+def export_targets(
+    format: str = Query("ndjson", regex="^ndjson$"),
+    include: tp.Optional[str] = Query(None, description="Relationships to embed, e.g. pictures"),
+) -> StreamingResponse:
+    """Stream every target as newline-delimited JSON."""
+    relationships = crud.parse_include(include)
+    exclude = set(crud.TARGET_RELATIONSHIPS) - relationships
+
+    def lines() -> tp.Iterator[str]:
+        # the stream outlives the request dependencies, use a dedicated session
+        db = SessionLocal()
+        try:
+            batch = []
+            for target in crud.stream_targets(db, relationships, EXPORT_BATCH_SIZE):
+                batch.append(schemas.Target.from_orm(target).json(exclude=exclude))
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    yield "\n".join(batch) + "\n"
+                    batch = []
+            if batch:
+                yield "\n".join(batch) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/import", response_model=schemas.ImportReport)
+async def import_targets(
+    request: Request,
+    format: str = Query("csv", regex="^(csv|ndjson)$"),
+    db: Session = Depends(get_db),
+) -> schemas.ImportReport:
+    """Import targets and their pictures from a CSV or NDJSON request body.
+
+    The body is read and validated incrementally, staged chunk by chunk and
+    merged at the end in one transaction (see ``crud.TargetImport``). Rows
+    carrying an ``id`` update that target, the others create one. Lines
+    longer than ``IMPORT_MAX_LINE_LENGTH`` are rejected (413).
+    """
+    report = schemas.ImportReport()
+    chunk: tp.List[tp.Tuple[int, schemas.TargetImportIn]] = []
+    updated_ids: tp.Set[int] = set()
+
+    staging = await run_in_threadpool(crud.TargetImport, db)
+    try:
+        async for parsed in target_import.PARSERS[format](request.stream()):
+            report.rows += 1
+            if parsed.target is None:
+                report.invalid += 1
+                if len(report.errors) < IMPORT_MAX_ERRORS:
+                    report.errors.append(
+                        schemas.ImportRowError(row=parsed.row, errors=parsed.errors)
+                    )
+                continue
+            chunk.append((parsed.row, parsed.target))
+            if parsed.target.id is not None:
+                updated_ids.add(parsed.target.id)
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                await run_in_threadpool(staging.stage, chunk)
+                chunk.clear()
+        if chunk:
+            await run_in_threadpool(staging.stage, chunk)
+        counts = await run_in_threadpool(staging.merge)
+    finally:
+        await run_in_threadpool(staging.close)
+    await target_cache.ainvalidate(updated_ids)
+    return report.copy(update=counts._asdict())
+
+
+@router.post("/batch-get", response_model=schemas.TargetBatchGetResult)
+def batch_get_targets(
+    batch: schemas.TargetBatchGetIn,
+    fields: tp.Optional[str] = Query(None, description="Fields to return, e.g. id,last_name"),
+    db: Session = Depends(get_db),
+) -> Response:
+    """Get targets by id in one query, in the order of ``ids``.
+
+    The ids with no target are listed in ``missing`` rather than failing the
+    whole call.
+    """
+    ids = batch_ids(batch.ids)
+    projection = batch_fields(fields)
+    found, missing = crud.get_targets_by_ids(db, ids, projection)
+    return batch_response(found, missing, projection)
+
+
+@router.get(
+    "/search",
+    response_model=tp.List[schemas.Target],
+    response_model_include=TARGET_LIST_FIELDS,
 )
-def read_targets(db: Session = Depends(get_db)) -> tp.List[schemas.Target]:
-    """Get all targets."""
-    return crud.get_targets(db)
+def search_targets(
+    response: Response,
+    q: str = Query(..., max_length=SEARCH_MAX_LENGTH),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: tp.Optional[str] = None,
+    db: Session = Depends(get_db),
+) -> tp.List[schemas.Target]:
+    """Search targets by first or last name, best matches first.
+
+    Names starting with ``q`` come first, then the names closest to it. The
+    next page cursor is sent in X-Next-Cursor.
+    """
+    page = crud.search_targets(db, q, limit=limit, cursor=cursor)
+    return search_response(response, page)
+
+
+@router.get("/pictures", response_model=tp.List[schemas.Picture])
+def read_pictures(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: tp.Optional[str] = None,
+    sort: str = "id",
+    fields: tp.Optional[str] = Query(None, description="Fields to return, e.g. id,path"),
+    db: Session = Depends(get_db),
+) -> tp.List[schemas.Picture]:
+    """Get a page of pictures, the next page cursor is sent in X-Next-Cursor."""
+    projection = picture_fields(fields)
+    page = crud.get_page(db, crud.picture_page_query(limit, cursor, sort, projection))
+    return pictures_response(response, page, projection)
 
 
 @router.get("/{target_id}", response_model=schemas.Target)
-def read_target(target_id: int, db: Session = Depends(get_db)) -> schemas.Target:
-    """Get a specific target."""
-    return crud.get_target(db, target_id)
+def read_target(
+    target_id: int,
+    request: Request,
+    fields: tp.Optional[str] = Query(None, description="Fields to return, e.g. id,last_name"),
+    db: Session = Depends(get_db),
+) -> schemas.Target:
+    """Get a specific target, or only its ``fields``."""
+    projection = crud.parse_fields(fields, schemas.Target)
+    if projection is not None:
+        row = crud.get_target_row(db, target_id, projection)
+        return target_row_response(request, row, projection)
+
+    key = target_cache.target_key(target_id)
+    cached = target_cache.get(key)
+    if cached is None or target_cache.revalidate:
+        etag = target_etag(target_id, crud.get_target_version(db, target_id))
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        cached = target_cache.validate(cached, etag)
+        if cached is None:
+            cached = target_response(crud.get_target(db, target_id))
+            target_cache.put(key, cached)
+    return cached_response(request, cached)
 
 
 @router.delete("/{target_id}", response_model=schemas.Target)
@@ -48,10 +280,22 @@ def edit_target(
     return crud.edit_target(db, target_id, target)
 
 
-@router.get("/pictures", response_model=tp.List[schemas.Picture])
-def read_pictures(db: Session = Depends(get_db)) -> tp.List[schemas.Picture]:
-    """Get all pictures."""
-    return crud.get_pictures(db)
+@router.post("/{target_id}/pictures/bulk", response_model=schemas.PictureBulkResult)
+def create_pictures_for_target_bulk(
+    target_id: int,
+    pictures: tp.List[tp.Any] = Body(...),
+    all_or_nothing: bool = False,
+    db: Session = Depends(get_db),
+) -> schemas.PictureBulkResult:
+    """Create pictures belonging to a target in one transaction.
+
+    Invalid items are reported in ``errors`` and skipped, unless
+    ``all_or_nothing`` is set, in which case nothing is created.
+    """
+    valid, errors = _validate_items(schemas.PictureCreate, pictures, all_or_nothing)
+    return schemas.PictureBulkResult(
+        created=crud.create_target_pictures_bulk(db, valid, target_id), errors=errors
+    )
 
 
 @router.post("/{target_id}/pictures", response_model=schemas.Picture)
@@ -0,0 +1,180 @@
+"""Target router served from the event loop (``DATABASE_MODE=async``).
+
+Registered ahead of ``targets.router`` so these handlers take precedence for
+the routes they define, any other target route falls through to the sync
+router. ``target_id`` only matches integers so that the sync only routes
+(e.g. ``/export``) aren't shadowed.
+"""
+import typing as tp
+
+from fastapi import APIRouter, Depends, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import crud, crud_async, schemas
+from app.database.cache import target_cache
+from app.database.filters import TargetFilters
+from app.database.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.database.search import SEARCH_MAX_LENGTH
+from app.database.session import get_async_db
+from app.router.conditional import cached_response, is_not_modified, not_modified
+from app.router.target_requests import (
+    TARGET_LIST_FIELDS,
+    TargetList,
+    batch_fields,
+    batch_ids,
+    batch_response,
+    picture_fields,
+    pictures_response,
+    search_response,
+    target_etag,
+    target_response,
+    target_row_response,
+)
+
+router = APIRouter()
+
+
+@router.post("", response_model=schemas.Target)
+async def create_target(
+    target: schemas.TargetIn, db: AsyncSession = Depends(get_async_db)
+) -> schemas.Target:
+    """Create a target."""
+    return await crud_async.create_target(db, target)
+
+
+@router.get(
+    "",
+    response_model=tp.List[schemas.Target],
+    response_model_include=TARGET_LIST_FIELDS,
+)
+async def read_targets(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: tp.Optional[str] = None,
+    sort: str = "id",
+    include: tp.Optional[str] = Query(None, description="Relationships to embed, e.g. pictures"),
+    fields: tp.Optional[str] = Query(None, description="Fields to return, e.g. id,last_name"),
+    filters: TargetFilters = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+) -> tp.List[schemas.Target]:
+    """Get a page of targets, the next page cursor is sent in X-Next-Cursor.
+
+    The filters are combined with AND, combinations no index supports are
+    rejected (400). ``fields`` replaces the default id and names, only its
+    columns are selected.
+    """
+    targets = TargetList(request, limit, cursor, sort, include, fields, filters)
+    key = await target_cache.alist_key(targets.digest)
+    cached = await target_cache.aget(key)
+    if cached is None or target_cache.revalidate:
+        etag = targets.etag(await crud_async.get_table_versions(db, targets.tables))
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        cached = target_cache.validate(cached, etag)
+        if cached is None:
+            cached = targets.response(etag, await crud_async.get_page(db, targets.page_query))
+            await target_cache.aput(key, cached)
+    return cached_response(request, cached)
+
+
+@router.post("/batch-get", response_model=schemas.TargetBatchGetResult)
+async def batch_get_targets(
+    batch: schemas.TargetBatchGetIn,
+    fields: tp.Optional[str] = Query(None, description="Fields to return, e.g. id,last_name"),
+    db: AsyncSession = Depends(get_async_db),
+) -> Response:
+    """Get targets by id in one query, in the order of ``ids``.
+
+    The ids with no target are listed in ``missing`` rather than failing the
+    whole call.
+    """
+    ids = batch_ids(batch.ids)
+    projection = batch_fields(fields)
+    found, missing = await crud_async.get_targets_by_ids(db, ids, projection)
+    return batch_response(found, missing, projection)
+
+
+@router.get(
+    "/search",
+    response_model=tp.List[schemas.Target],
+    response_model_include=TARGET_LIST_FIELDS,
+)
+async def search_targets(
+    response: Response,
+    q: str = Query(..., max_length=SEARCH_MAX_LENGTH),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: tp.Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+) -> tp.List[schemas.Target]:
+    """Search targets by first or last name, best matches first.
+
+    Names starting with ``q`` come first, then the names closest to it. The
+    next page cursor is sent in X-Next-Cursor.
+    """
+    page = await crud_async.search_targets(db, q, limit=limit, cursor=cursor)
+    return search_response(response, page)
+
+
+@router.get("/pictures", response_model=tp.List[schemas.Picture])
+async def read_pictures(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: tp.Optional[str] = None,
+    sort: str = "id",
+    fields: tp.Optional[str] = Query(None, description="Fields to return, e.g. id,path"),
+    db: AsyncSession = Depends(get_async_db),
+) -> tp.List[schemas.Picture]:
+    """Get a page of pictures, the next page cursor is sent in X-Next-Cursor."""
+    projection = picture_fields(fields)
+    page = await crud_async.get_page(db, crud.picture_page_query(limit, cursor, sort, projection))
+    return pictures_response(response, page, projection)
+
+
+@router.get("/{target_id:int}", response_model=schemas.Target)
+async def read_target(
+    target_id: int,
+    request: Request,
+    fields: tp.Optional[str] = Query(None, description="Fields to return, e.g. id,last_name"),
+    db: AsyncSession = Depends(get_async_db),
+) -> schemas.Target:
+    """Get a specific target, or only its ``fields``."""
+    projection = crud.parse_fields(fields, schemas.Target)
+    if projection is not None:
+        row = await crud_async.get_target_row(db, target_id, projection)
+        return target_row_response(request, row, projection)
+
+    key = target_cache.target_key(target_id)
+    cached = await target_cache.aget(key)
+    if cached is None or target_cache.revalidate:
+        etag = target_etag(target_id, await crud_async.get_target_version(db, target_id))
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        cached = target_cache.validate(cached, etag)
+        if cached is None:
+            cached = target_response(await crud_async.get_target(db, target_id))
+            await target_cache.aput(key, cached)
+    return cached_response(request, cached)
+
+
+@router.delete("/{target_id:int}", response_model=schemas.Target)
+async def delete_target(
+    target_id: int, db: AsyncSession = Depends(get_async_db)
+) -> schemas.Target:
+    """Delete a target."""
+    return await crud_async.delete_target(db, target_id)
+
+
+@router.put("/{target_id:int}", response_model=schemas.Target)
+async def edit_target(
+    target_id: int, target: schemas.TargetIn, db: AsyncSession = Depends(get_async_db)
+) -> schemas.Target:
+    """Edit a target."""
+    return await crud_async.edit_target(db, target_id, target)
+
+
+@router.post("/{target_id:int}/pictures", response_model=schemas.Picture)
+async def create_picture_for_target(
+    target_id: int, picture: schemas.PictureCreate, db: AsyncSession = Depends(get_async_db)
+) -> schemas.Picture:
+    """Create a picture belonging to a target."""
+    return await crud_async.create_target_picture(db, picture, target_id)
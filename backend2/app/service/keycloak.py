@@ -1,56 +1,174 @@
 """Keycloak service module."""
 import os
+import threading
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from simber import Logger
 import jwt
 import requests
 
-LOG_FORMAT = "{levelname} [{filename}:{lineno}]:"
-logger = Logger(__name__, log_path="/logs/api.log")
-logger.update_format(LOG_FORMAT)
+from app.service.jwks import JWKSCache, JWKSUnavailableError
+from app.service.logs import get_logger
+from app.service.metrics import keycloak_timer
+from app.service.tracing import set_attribute, traced
+from app.service.token_cache import TokenCache
+
+logger = get_logger(__name__)
 
 security = HTTPBearer()
 
+# 进程内共享的KeycloakOpenID客户端，每个realm一个，复用连接池
+_keycloak_clients: dict = {}
+_keycloak_clients_lock = threading.Lock()
+
 def get_keycloak_openid():
+    server_url = os.environ.get("KEYCLOAK_SERVER_URL", "http://keycloak:8080")
+    realm_name = os.environ.get("KEYCLOAK_REALM_NAME", "master")
+    client_id = os.environ.get("KEYCLOAK_CLIENT_ID", "fastapi-client")
+    client_key = (server_url, realm_name, client_id)
+
+    keycloak_openid = _keycloak_clients.get(client_key)
+    if keycloak_openid is not None:
+        return keycloak_openid
+
     try:
         from keycloak import KeycloakOpenID
-        return KeycloakOpenID(
-            server_url=os.environ.get("KEYCLOAK_SERVER_URL", "http://keycloak:8080"),
-            realm_name=os.environ.get("KEYCLOAK_REALM_NAME", "master"),
-            client_id=os.environ.get("KEYCLOAK_CLIENT_ID", "fastapi-client"),
+        from app.service.keycloak_pool import PooledConnectionManager
+
+        with _keycloak_clients_lock:
+            keycloak_openid = _keycloak_clients.get(client_key)
+            if keycloak_openid is None:
+                keycloak_openid = KeycloakOpenID(
+                    server_url=server_url,
+                    realm_name=realm_name,
+                    client_id=client_id,
+                    client_secret_key=os.environ.get("KEYCLOAK_CLIENT_SECRET_KEY", "your-client-secret"),
+                    verify=True
+                )
+                keycloak_openid.connection = PooledConnectionManager(
+                    base_url=server_url,
+                    timeout=(
+                        float(os.environ.get("KEYCLOAK_CONNECT_TIMEOUT", 5)),
+                        float(os.environ.get("KEYCLOAK_READ_TIMEOUT", 30)),
+                    ),
+                    verify=True,
+                    pool_connections=int(os.environ.get("KEYCLOAK_POOL_CONNECTIONS", 10)),
+                    pool_maxsize=int(os.environ.get("KEYCLOAK_POOL_MAXSIZE", 20)),
+                )
+                _keycloak_clients[client_key] = keycloak_openid
+        return keycloak_openid
+    except Exception as e:
+        logger.warning(f"Keycloak initialization failed: {e}. Keycloak features will be disabled.")
+        raise HTTPException(status_code=503, detail="Keycloak is not configured")
+
+# 异步客户端，供async路由使用，避免阻塞事件循环
+_keycloak_async_clients: dict = {}
+
+def get_keycloak_async():
+    server_url = os.environ.get("KEYCLOAK_SERVER_URL", "http://keycloak:8080")
+    realm_name = os.environ.get("KEYCLOAK_REALM_NAME", "master")
+    client_id = os.environ.get("KEYCLOAK_CLIENT_ID", "fastapi-client")
+    client_key = (server_url, realm_name, client_id)
+
+    keycloak_openid = _keycloak_async_clients.get(client_key)
+    if keycloak_openid is not None:
+        return keycloak_openid
+
+    try:
+        import httpx
+        from app.service.keycloak_async import AsyncKeycloakOpenID
+
+        keycloak_openid = AsyncKeycloakOpenID(
+            server_url=server_url,
+            realm_name=realm_name,
+            client_id=client_id,
             client_secret_key=os.environ.get("KEYCLOAK_CLIENT_SECRET_KEY", "your-client-secret"),
-            verify=True
+            timeout=httpx.Timeout(
+                float(os.environ.get("KEYCLOAK_READ_TIMEOUT", 30)),
+                connect=float(os.environ.get("KEYCLOAK_CONNECT_TIMEOUT", 5)),
+            ),
+            max_connections=int(os.environ.get("KEYCLOAK_POOL_MAXSIZE", 20)),
+            max_retries=int(os.environ.get("KEYCLOAK_MAX_RETRIES", 1)),
         )
+        _keycloak_async_clients[client_key] = keycloak_openid
+        return keycloak_openid
     except Exception as e:
         logger.warning(f"Keycloak initialization failed: {e}. Keycloak features will be disabled.")
         raise HTTPException(status_code=503, detail="Keycloak is not configured")
 
-def get_pem_public_key():
-    keycloak_openid = get_keycloak_openid()
-    key = keycloak_openid.public_key()
-    if not key.startswith('-----BEGIN PUBLIC KEY-----'):
-        key = "-----BEGIN PUBLIC KEY-----\n" + key + "\n-----END PUBLIC KEY-----"
-    return key
+async def close_keycloak_async_clients() -> None:
+    """关闭异步客户端（应用关闭时调用）"""
+    clients = list(_keycloak_async_clients.values())
+    _keycloak_async_clients.clear()
+    for keycloak_openid in clients:
+        await keycloak_openid.aclose()
+
+def get_keycloak_pool_stats() -> dict:
+    """返回每个realm客户端的连接池统计（同步requests客户端和异步httpx客户端）"""
+    return {
+        "sync": {
+            f"{server_url}:{realm_name}:{client_id}": keycloak_openid.connection.pool_stats()
+            for (server_url, realm_name, client_id), keycloak_openid in list(_keycloak_clients.items())
+        },
+        "async": {
+            f"{server_url}:{realm_name}:{client_id}": keycloak_openid.pool_stats()
+            for (server_url, realm_name, client_id), keycloak_openid in list(_keycloak_async_clients.items())
+        },
+    }
+
+def close_keycloak_clients() -> None:
+    """关闭共享客户端的连接池（应用关闭时调用）"""
+    with _keycloak_clients_lock:
+        for keycloak_openid in _keycloak_clients.values():
+            keycloak_openid.connection.close()
+        _keycloak_clients.clear()
+
+@traced("keycloak.fetch_jwks")
+def _fetch_jwks() -> dict:
+    with keycloak_timer("certs"):
+        return get_keycloak_openid().certs()
+
+# Realm签名公钥缓存，按kid查找，后台定时刷新
+jwks_cache = JWKSCache(
+    _fetch_jwks,
+    refresh_interval=float(os.environ.get("KEYCLOAK_JWKS_REFRESH_INTERVAL", 300)),
+    min_refetch_interval=float(os.environ.get("KEYCLOAK_JWKS_MIN_REFETCH_INTERVAL", 10)),
+)
 
+# 已验证token的claims缓存，按exp过期，LRU淘汰
+token_cache = TokenCache(
+    max_entries=int(os.environ.get("KEYCLOAK_TOKEN_CACHE_SIZE", 10000)),
+    max_bytes=int(os.environ.get("KEYCLOAK_TOKEN_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+)
+
+@traced()
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     """验证JWT token并返回用户信息"""
-    keycloak_openid = get_keycloak_openid()
-    
+    token = credentials.credentials
+    token_info = token_cache.get(token)
+    set_attribute("token_cache.hit", token_info is not None)
+    if token_info is not None:
+        return token_info
+
     try:
-        # 使用python-keycloak验证token
-        token_info = keycloak_openid.decode_token(
-            credentials.credentials,
-            key=get_pem_public_key(),
+        # 使用缓存的JWKS在本地验证token，不再每次请求Keycloak
+        signing_key = jwks_cache.get_signing_key(jwt.get_unverified_header(token).get("kid"))
+        token_info = jwt.decode(
+            token,
+            signing_key.key,
+            algorithms=[signing_key.algorithm],
             options={
                 "verify_signature": True,
                 "verify_aud": False,
                 "verify_exp": True
             }
         )
-        
+        token_cache.put(token, token_info)
+
         return token_info
+    except JWKSUnavailableError as e:
+        logger.error(f"Token verification failed: {e}")
+        raise HTTPException(status_code=503, detail="Keycloak is not available")
     except Exception as e:
         logger.error(f"Token verification failed: {e}")
         raise HTTPException(
@@ -61,6 +179,7 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security))
 
 def verify_permission(required_roles: list = None, required_permissions: list = None):
     """验证用户权限"""
+    @traced("keycloak.verify_permission")
     def _verify_permission(token_info: dict = Depends(verify_token)) -> dict:
         if not token_info:
             raise HTTPException(
@@ -86,42 +205,70 @@ def verify_permission(required_roles: list = None, required_permissions: list =
     
     return _verify_permission
 
-def get_user_info(token: str) -> dict:
+@traced()
+async def get_user_info(token: str) -> dict:
     """获取用户信息"""
-    keycloak_openid = get_keycloak_openid()
-    
+    keycloak_openid = get_keycloak_async()
+
     try:
-        return keycloak_openid.userinfo(token)
+        return await keycloak_openid.userinfo(token)
     except Exception as e:
         logger.error(f"Failed to get user info: {e}")
         raise HTTPException(status_code=400, detail="Failed to get user info")
 
-def refresh_token(refresh_token: str) -> dict:
+@traced()
+async def exchange_code(code: str, redirect_uri: str) -> dict:
+    """用授权码换取token"""
+    keycloak_openid = get_keycloak_async()
+
+    try:
+        return await keycloak_openid.token(
+            grant_type='authorization_code',
+            code=code,
+            redirect_uri=redirect_uri
+        )
+    except Exception as e:
+        logger.error(f"Failed to exchange authorization code: {e}")
+        raise HTTPException(status_code=400, detail="Failed to exchange authorization code")
+
+@traced()
+async def refresh_token(refresh_token: str) -> dict:
     """刷新token"""
-    keycloak_openid = get_keycloak_openid()
-    
+    keycloak_openid = get_keycloak_async()
+
     try:
-        return keycloak_openid.refresh_token(refresh_token)
+        return await keycloak_openid.refresh_token(refresh_token)
     except Exception as e:
         logger.error(f"Failed to refresh token: {e}")
         raise HTTPException(status_code=400, detail="Failed to refresh token")
 
-def logout(refresh_token: str) -> bool:
+@traced()
+async def logout(refresh_token: str) -> bool:
     """登出用户"""
-    keycloak_openid = get_keycloak_openid()
-    
+    keycloak_openid = get_keycloak_async()
+
     try:
-        keycloak_openid.logout(refresh_token)
-        return True
+        await keycloak_openid.logout(refresh_token)
     except Exception as e:
         logger.error(f"Failed to logout: {e}")
         raise HTTPException(status_code=400, detail="Failed to logout")
 
+    # 会话已注销，不再使用该会话的缓存token
+    try:
+        claims = jwt.decode(refresh_token, options={"verify_signature": False})
+        session_id = claims.get("sid") or claims.get("session_state")
+        if session_id:
+            token_cache.revoke_session(session_id, until=claims.get("exp"))
+    except jwt.PyJWTError as e:
+        logger.warning(f"Failed to read session of logged out token: {e}")
+    return True
+
+@traced()
 async def authenticate_user(username: str, password: str) -> dict:
     """Authenticate user with Keycloak using password grant."""
-    keycloak_openid = get_keycloak_openid()
+    keycloak_openid = get_keycloak_async()
     try:
-        token = keycloak_openid.token(
+        token = await keycloak_openid.token(
             username=username,
             password=password,
             grant_type='password'
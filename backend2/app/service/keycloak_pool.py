@@ -0,0 +1,85 @@
+"""Pooled, thread-safe HTTP connection for the shared Keycloak client."""
+import threading
+import typing as tp
+
+from keycloak.connection import ConnectionManager
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PooledConnectionManager(ConnectionManager):
+    """``ConnectionManager`` meant to be shared by every request of the process.
+
+    The underlying ``requests`` session keeps up to ``pool_maxsize`` keep-alive
+    connections per host. Request headers are kept per thread because
+    python-keycloak sets the ``Authorization`` header on the connection
+    itself (e.g. for ``userinfo``), which would otherwise leak between
+    concurrent requests.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        headers: tp.Optional[dict] = None,
+        timeout: tp.Union[float, tp.Tuple[float, float]] = 60,
+        verify: bool = True,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        max_retries: int = 1,
+    ) -> None:
+        self._local = threading.local()
+        super().__init__(base_url, headers=dict(headers or {}), timeout=timeout, verify=verify)
+        # retry idempotent requests and POST (token endpoint) once, like the
+        # default python-keycloak adapter, to recover from stale keep-alive
+        # connections closed by Keycloak
+        retries = Retry(
+            total=max_retries,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST"},
+            raise_on_status=False,
+        )
+        for protocol in ("https://", "http://"):
+            self._s.mount(
+                protocol,
+                HTTPAdapter(
+                    pool_connections=pool_connections,
+                    pool_maxsize=pool_maxsize,
+                    max_retries=retries,
+                ),
+            )
+
+    @property
+    def headers(self) -> dict:
+        headers = getattr(self._local, "headers", None)
+        if headers is None:
+            headers = self._local.headers = dict(self._headers)
+        return headers
+
+    @headers.setter
+    def headers(self, value: dict) -> None:
+        self._local.headers = value
+
+    def pool_stats(self) -> tp.Dict[str, int]:
+        """Return request and connection counters of the pool.
+
+        Returns:
+            ``requests`` sent, ``new_connections`` opened and
+            ``reused_connections`` (requests served by a kept-alive connection)
+        """
+        requests = new_connections = 0
+        for adapter in set(self._s.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests += pool.num_requests
+                new_connections += pool.num_connections
+        return {
+            "requests": requests,
+            "new_connections": new_connections,
+            "reused_connections": max(requests - new_connections, 0),
+        }
+
+    def close(self) -> None:
+        """Close every pooled connection."""
+        self._s.close()
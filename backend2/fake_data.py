@@ -1,30 +1,254 @@
+"""Generate fake targets and pictures.
+
+Rows are generated in parallel processes and streamed into Postgres with
+``COPY FROM STDIN``, e.g. to build a benchmark dataset::
+
+    python fake_data.py --targets 1000000 --pictures-distribution poisson \
+        --pictures-per-target 10 --workers 8 --seed 42 --drop-indexes
+
+Other databases (e.g. SQLite) fall back to bulk INSERTs in one process.
+"""
+import argparse
+import csv
+import io
+import math
+from multiprocessing import Pool
+import random
+import time
+import typing as tp
+
 from faker import Faker
+from sqlalchemy import create_engine, func, text, update
+from sqlalchemy.pool import NullPool
+
+from app.database import crud, models, versions
+from app.database.cache import target_cache
+from app.database.schemas import PictureCreate, TargetBulkIn
+from app.database.session import SQLALCHEMY_DATABASE_URL, SessionLocal, engine
+
+TABLES = ("targets", "pictures")
+
+
+class Chunk(tp.NamedTuple):
+    index: int
+    first_id: int
+    count: int
+
+
+def pictures_count(rng: random.Random, args: argparse.Namespace) -> int:
+    """Draw the number of pictures of a target from the configured distribution."""
+    mean = args.pictures_per_target
+    if args.pictures_distribution == "uniform":
+        return rng.randint(0, 2 * mean)
+    if args.pictures_distribution == "poisson":
+        # Knuth's algorithm, fine for the small means used here
+        limit, count, product = math.exp(-mean), 0, rng.random()
+        while product > limit:
+            count += 1
+            product *= rng.random()
+        return count
+    return mean
+
+
+def generate(
+    chunk: Chunk, args: argparse.Namespace
+) -> tp.Iterator[tp.Tuple[tp.List[tuple], tp.List[tuple]]]:
+    """Yield batches of (targets, pictures) rows of a chunk, deterministically."""
+    faker = Faker()
+    faker.seed_instance(args.seed + chunk.index)
+    rng = random.Random(args.seed + chunk.index)
+
+    targets: tp.List[tuple] = []
+    pictures: tp.List[tuple] = []
+    for target_id in range(chunk.first_id, chunk.first_id + chunk.count):
+        first_name = faker.first_name()
+        last_name = faker.last_name()
+        dob = faker.date_of_birth(minimum_age=16, maximum_age=55).isoformat()
+        count = pictures_count(rng, args)
+        targets.append((target_id, first_name, last_name, dob, count))
+        for _ in range(count):
+            pictures.append((faker.file_path(), target_id))
+        if len(targets) >= args.batch_size:
+            yield targets, pictures
+            targets, pictures = [], []
+    if targets:
+        yield targets, pictures
+
+
+def _csv(rows: tp.List[tuple]) -> io.StringIO:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_chunk(job: tp.Tuple[Chunk, argparse.Namespace]) -> int:
+    """Load one chunk with COPY over a dedicated connection, in one transaction."""
+    chunk, args = job
+    worker_engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+    connection = worker_engine.raw_connection()
+    rows = 0
+    try:
+        cursor = connection.cursor()
+        for targets, pictures in generate(chunk, args):
+            cursor.copy_expert(
+                "COPY targets (id, first_name, last_name, dob, picture_count) "
+                "FROM STDIN WITH (FORMAT csv)",
+                _csv(targets),
+            )
+            cursor.copy_expert(
+                "COPY pictures (path, target_id) FROM STDIN WITH (FORMAT csv)",
+                _csv(pictures),
+            )
+            rows += len(targets) + len(pictures)
+        connection.commit()
+    finally:
+        connection.close()
+        worker_engine.dispose()
+    return rows
+
+
+def drop_indexes(connection: tp.Any) -> tp.List[str]:
+    """Drop the secondary indexes of the loaded tables, return their definitions."""
+    indexes = connection.execute(
+        text(
+            "SELECT i.indexname, i.indexdef FROM pg_indexes i "
+            "WHERE i.schemaname = current_schema() AND i.tablename = ANY(:tables) "
+            "AND NOT EXISTS (SELECT 1 FROM pg_constraint c "
+            "WHERE c.conname = i.indexname AND c.contype IN ('p', 'u'))"
+        ),
+        {"tables": list(TABLES)},
+    ).fetchall()
+    for name, _ in indexes:
+        connection.execute(text(f'DROP INDEX "{name}"'))
+    return [definition for _, definition in indexes]
+
+
+def load_postgres(args: argparse.Namespace) -> int:
+    with engine.begin() as connection:
+        # ids are never reused, even after a truncate: clients may hold the
+        # ETags ("target-<id>-<version>") of the deleted targets
+        first_id = connection.execute(
+            text(
+                "SELECT GREATEST(nextval(pg_get_serial_sequence('targets', 'id')), "
+                "(SELECT COALESCE(MAX(id), 0) + 1 FROM targets))"
+            )
+        ).scalar()
+        if not args.append:
+            connection.execute(text("TRUNCATE pictures, targets"))
+        index_definitions = drop_indexes(connection) if args.drop_indexes else []
+
+    rows = 0
+    try:
+        if args.targets:
+            chunk_size = -(-args.targets // args.workers)
+            chunks = [
+                Chunk(index, first_id + start, min(chunk_size, args.targets - start))
+                for index, start in enumerate(range(0, args.targets, chunk_size))
+            ]
+            engine.dispose()  # don't share pooled connections with the forked workers
+            with Pool(args.workers) as pool:
+                rows = sum(pool.imap_unordered(copy_chunk, [(chunk, args) for chunk in chunks]))
+    finally:
+        # also after a failed or interrupted load: the workers may have
+        # committed chunks, and the dropped indexes must come back
+        with engine.begin() as connection:
+            connection.execute(
+                text("SELECT setval(pg_get_serial_sequence('targets', 'id'), :next_id, false)"),
+                {"next_id": first_id + args.targets},
+            )
+            for definition in index_definitions:
+                connection.execute(text(definition))
+            versions.bump(connection, TABLES)
+
+    with engine.begin() as connection:
+        for table in TABLES:
+            connection.execute(text(f"ANALYZE {table}"))
+    return rows
+
+
+def load_generic(args: argparse.Namespace) -> int:
+    db = SessionLocal()
+    try:
+        # SQLite reuses the ids of deleted rows: the new targets start above
+        # the previous versions, so that the ETags of the old ones don't match
+        previous_version = 0
+        if not args.append:
+            previous_version = db.query(func.max(models.Target.version)).scalar() or 0
+            db.query(models.Picture).delete()
+            db.query(models.Target).delete()
+            versions.bump(db, TABLES)
+            db.commit()
+        rows = 0
+        for targets, pictures in generate(Chunk(0, 0, args.targets), args):
+            pictures_by_target: tp.Dict[int, tp.List[PictureCreate]] = {}
+            for path, target_id in pictures:
+                pictures_by_target.setdefault(target_id, []).append(PictureCreate(path=path))
+            crud.create_targets_bulk(
+                db,
+                [
+                    TargetBulkIn(
+                        first_name=first_name,
+                        last_name=last_name,
+                        dob=dob,
+                        pictures=pictures_by_target.get(target_id, []),
+                    )
+                    for target_id, first_name, last_name, dob, _ in targets
+                ],
+            )
+            rows += len(targets) + len(pictures)
+        if previous_version:
+            db.execute(
+                update(models.Target).values(version=models.Target.version + previous_version)
+            )
+            db.commit()
+        return rows
+    finally:
+        db.close()
 
-from app.database import models
-from app.database.crud import create_target, create_target_picture
-from app.database.schemas import PictureCreate, TargetIn
-from app.database.session import get_db
 
-faker = Faker()
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", type=int, default=100, help="number of targets")
+    parser.add_argument(
+        "--pictures-per-target", type=int, default=10, help="(mean) pictures per target"
+    )
+    parser.add_argument(
+        "--pictures-distribution",
+        choices=("fixed", "uniform", "poisson"),
+        default="fixed",
+        help="distribution of the number of pictures per target",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--workers", type=int, default=1, help="generator processes")
+    parser.add_argument("--batch-size", type=int, default=10000, help="targets per COPY")
+    parser.add_argument(
+        "--drop-indexes",
+        action="store_true",
+        help="drop secondary indexes before the load and recreate them after",
+    )
+    parser.add_argument(
+        "--append", action="store_true", help="keep the existing rows instead of deleting them"
+    )
+    args = parser.parse_args()
+    args.workers = max(1, min(args.workers, args.targets or 1))
+    return args
 
 
 def main():
-    db = next(get_db())
-
-    db.query(models.Target).delete()
-    db.query(models.Picture).delete()
-    db.commit()
-
-    for _ in range(0, 100):
-        target = TargetIn(
-            first_name=faker.first_name(),
-            last_name=faker.last_name(),
-            dob=faker.date_of_birth(minimum_age=16, maximum_age=55),
-        )
-        db_target = create_target(db, target)
-        for _ in range(0, 10):
-            picture = PictureCreate(path=faker.file_path())
-            create_target_picture(db, picture, db_target.id)
+    args = parse_args()
+    start = time.perf_counter()
+    try:
+        if engine.dialect.name == "postgresql":
+            rows = load_postgres(args)
+        else:
+            rows = load_generic(args)
+    finally:
+        # the deleted and loaded rows bypass the cache invalidation of the
+        # crud, a shared cache (redis) would serve them until they expire
+        target_cache.clear()
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
 
 
 if __name__ == "__main__":
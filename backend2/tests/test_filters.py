@@ -0,0 +1,138 @@
+from datetime import date
+import inspect
+import typing as tp
+
+from fastapi import HTTPException
+import pytest
+
+from app.database.filters import TargetFilters
+
+PARAMETERS = list(inspect.signature(TargetFilters).parameters)
+
+
+def make_filters(**values: tp.Any) -> TargetFilters:
+    """Filters out of query parameters, the others being absent."""
+    return TargetFilters(**{name: values.get(name) for name in PARAMETERS})
+
+
+@pytest.mark.parametrize(
+    "values, sort",
+    [
+        ({}, "id"),
+        ({}, "-first_name"),
+        ({"last_name": "Doe"}, "id"),
+        ({"last_name": "Doe"}, "-dob"),
+        ({"last_name": "Doe", "dob_from": date(1990, 1, 1)}, "dob"),
+        ({"last_name": "Doe", "dob_from": date(1990, 1, 1), "dob_to": date(1999, 12, 31)}, "-dob"),
+        ({"last_name": "Doe", "dob_from": date(1990, 1, 1), "dob_to": date(1990, 1, 1)}, "id"),
+        ({"last_name_prefix": "Do"}, "last_name"),
+        ({"dob_to": date(1999, 12, 31)}, "dob"),
+        ({"dob_from": date(1990, 1, 1), "dob_to": date(1990, 1, 1)}, "-id"),
+        ({"has_pictures": True}, "picture_count"),
+        ({"has_pictures": False}, "id"),
+        ({"min_pictures": 2, "max_pictures": 5}, "-picture_count"),
+    ],
+)
+def test_indexed_combinations_accepted(values: tp.Dict[str, tp.Any], sort: str) -> None:
+    make_filters(**values).check_indexed(sort)
+
+
+@pytest.mark.parametrize(
+    "values, sort",
+    [
+        # no index has these columns together
+        ({"last_name": "Doe", "last_name_prefix": "Do"}, "last_name"),
+        (
+            {"last_name_prefix": "Do", "dob_from": date(1990, 1, 1), "dob_to": date(1990, 1, 1)},
+            "id",
+        ),
+        ({"last_name": "Doe", "has_pictures": True}, "picture_count"),
+        ({"dob_from": date(1990, 1, 1), "min_pictures": 1}, "dob"),
+        ({"last_name_prefix": "Do", "dob_to": date(1999, 12, 31)}, "dob"),
+        ({"last_name": "Doe", "dob_from": date(1990, 1, 1), "max_pictures": 3}, "dob"),
+        # indexed filters, in another order than the one of their index
+        ({"last_name": "Doe"}, "first_name"),
+        ({"last_name": "Doe"}, "picture_count"),
+        ({"last_name": "Doe", "dob_from": date(1990, 1, 1)}, "id"),
+        ({"last_name": "Doe", "dob_from": date(1990, 1, 1), "dob_to": date(1990, 1, 1)}, "dob"),
+        ({"last_name_prefix": "Do"}, "id"),
+        ({"dob_to": date(1999, 12, 31)}, "-id"),
+        ({"dob_from": date(1990, 1, 1), "dob_to": date(1990, 1, 1)}, "first_name"),
+        ({"has_pictures": True}, "id"),
+        ({"min_pictures": 2}, "dob"),
+    ],
+)
+def test_unindexed_combinations_rejected(values: tp.Dict[str, tp.Any], sort: str) -> None:
+    with pytest.raises(HTTPException) as error:
+        make_filters(**values).check_indexed(sort)
+    assert error.value.status_code == 400
+
+
+TARGETS = [
+    {"first_name": "Ann", "last_name": "Doe", "dob": "1985-03-01"},
+    {"first_name": "Bea", "last_name": "Doe", "dob": "1992-07-15"},
+    {"first_name": "Cid", "last_name": "Dorn", "dob": "1992-07-15"},
+    {"first_name": "Dan", "last_name": "Smith", "dob": "2001-11-30"},
+]
+
+
+@pytest.fixture
+def target_ids(client: tp.Any, api: str) -> tp.List[int]:
+    ids = [client.post(f"{api}/targets", json=target).json()["id"] for target in TARGETS]
+    for _ in range(2):
+        client.post(f"{api}/targets/{ids[1]}/pictures", json={"path": "/b.png"})
+    client.post(f"{api}/targets/{ids[3]}/pictures", json={"path": "/d.png"})
+    return ids
+
+
+@pytest.mark.parametrize(
+    "params, expected",
+    [
+        ({"last_name": "Doe"}, ["Ann", "Bea"]),
+        ({"last_name": "Doe", "sort": "-dob"}, ["Bea", "Ann"]),
+        ({"last_name": "Doe", "dob_from": "1990-01-01", "sort": "dob"}, ["Bea"]),
+        ({"last_name_prefix": "Do", "sort": "-last_name"}, ["Cid", "Bea", "Ann"]),
+        ({"dob_from": "1992-07-15", "dob_to": "1992-07-15"}, ["Bea", "Cid"]),
+        ({"has_pictures": "false"}, ["Ann", "Cid"]),
+        ({"min_pictures": 1, "sort": "-picture_count"}, ["Bea", "Dan"]),
+        ({"min_pictures": 1, "max_pictures": 1}, ["Dan"]),
+    ],
+)
+def test_filtered_list(
+    client: tp.Any, api: str, target_ids: tp.List[int], params: dict, expected: tp.List[str]
+) -> None:
+    response = client.get(f"{api}/targets", params=params)
+    assert response.status_code == 200
+    assert [target["first_name"] for target in response.json()] == expected
+
+
+def test_unindexed_filters_are_a_bad_request(
+    client: tp.Any, api: str, target_ids: tp.List[int]
+) -> None:
+    response = client.get(f"{api}/targets", params={"last_name": "Doe", "has_pictures": "true"})
+    assert response.status_code == 400
+
+
+def test_unindexed_sort_order_is_a_bad_request(
+    client: tp.Any, api: str, target_ids: tp.List[int]
+) -> None:
+    response = client.get(f"{api}/targets", params={"dob_from": "1990-01-01", "sort": "first_name"})
+    assert response.status_code == 400
+    assert "sorted by first_name" in response.json()["detail"]
+
+
+def test_picture_count_order_etag_follows_pictures(
+    client: tp.Any, api: str, target_ids: tp.List[int]
+) -> None:
+    response = client.get(f"{api}/targets", params={"sort": "-picture_count"})
+    assert [target["first_name"] for target in response.json()][:2] == ["Bea", "Dan"]
+    for _ in range(2):
+        client.post(f"{api}/targets/{target_ids[3]}/pictures", json={"path": "/d.png"})
+
+    response = client.get(
+        f"{api}/targets",
+        params={"sort": "-picture_count"},
+        headers={"If-None-Match": response.headers["etag"]},
+    )
+    assert response.status_code == 200
+    assert [target["first_name"] for target in response.json()][:2] == ["Dan", "Bea"]
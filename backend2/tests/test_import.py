@@ -0,0 +1,113 @@
+import asyncio
+import json
+import typing as tp
+
+from fastapi import HTTPException
+import pytest
+
+from app.service import target_import
+from app.service.target_import import IMPORT_MAX_LINE_LENGTH
+
+CSV = (
+    "first_name,last_name,dob,pictures,id\n"
+    '"Multi\nLine",x,2001-02-03,/1.png|/2.png,\n'
+    "bad,,notadate,,\n"
+    'Upd,"q""uote",1999-01-01,/3.png,1\n'
+    "Miss,m,1999-01-01,/4.png,999\n"
+)
+
+
+def chunked(body: str, size: int = 7) -> tp.Iterator[bytes]:
+    for start in range(0, len(body), size):
+        yield body[start : start + size].encode()
+
+
+async def stream(body: str, size: int = 7) -> tp.AsyncIterator[bytes]:
+    for chunk in chunked(body, size):
+        yield chunk
+
+
+async def collect(rows: tp.AsyncIterator[tp.Any]) -> tp.List[tp.Any]:
+    return [row async for row in rows]
+
+
+def run(coroutine: tp.Awaitable[tp.Any]) -> tp.Any:
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def test_csv_import(client: tp.Any, api: str) -> None:
+    target = {"first_name": "Ann", "last_name": "Doe", "dob": "2000-01-01"}
+    client.post(f"{api}/targets", json=target)
+    response = client.post(f"{api}/targets/import", params={"format": "csv"}, data=chunked(CSV))
+    assert response.status_code == 200
+    report = response.json()
+    assert {key: report[key] for key in ("rows", "created", "updated", "pictures")} == {
+        "rows": 4,
+        "created": 1,
+        "updated": 1,
+        "pictures": 3,
+    }
+    assert (report["missing"], report["invalid"]) == ([4], 1)
+    assert [error["row"] for error in report["errors"]] == [2]
+
+    targets = client.get(f"{api}/targets").json()
+    assert [(t["first_name"], t["last_name"]) for t in targets] == [
+        ("Upd", 'q"uote'),
+        ("Multi\nLine", "x"),
+    ]
+    assert [p["path"] for p in client.get(f"{api}/targets/1").json()["pictures"]] == ["/3.png"]
+
+
+def test_ndjson_import(client: tp.Any, api: str) -> None:
+    body = "\n".join(
+        [
+            json.dumps(
+                {
+                    "first_name": "N",
+                    "last_name": "D",
+                    "dob": "2002-01-01",
+                    "pictures": [{"path": "/z"}],
+                }
+            ),
+            json.dumps({"x": 1}),
+            "not json",
+        ]
+    )
+    response = client.post(
+        f"{api}/targets/import", params={"format": "ndjson"}, data=chunked(body, 5)
+    )
+    report = response.json()
+    assert (report["rows"], report["created"], report["pictures"]) == (3, 1, 1)
+    assert report["invalid"] == 2
+    assert [error["row"] for error in report["errors"]] == [2, 3]
+
+
+def test_overlong_line_is_too_large(client: tp.Any, api: str) -> None:
+    body = "first_name,last_name,dob\n" + "x" * (IMPORT_MAX_LINE_LENGTH + 1) + ",y,2000-01-01\n"
+    response = client.post(
+        f"{api}/targets/import", params={"format": "csv"}, data=chunked(body, 64 * 1024)
+    )
+    assert response.status_code == 413
+    # nothing was imported
+    assert client.get(f"{api}/targets").json() == []
+
+
+@pytest.mark.parametrize("body", ["x" * 11, "short\n" + "x" * 11 + "\n", "x" * 11 + "\n"])
+def test_iter_lines_caps_the_line_length(body: str) -> None:
+    with pytest.raises(HTTPException) as error:
+        run(collect(target_import.iter_lines(stream(body, 3), max_length=10)))
+    assert error.value.status_code == 413
+
+
+def test_iter_lines_accepts_lines_at_the_limit() -> None:
+    body = "x" * 10 + "\n" + "y" * 10
+    lines = run(collect(target_import.iter_lines(stream(body, 3), max_length=10)))
+    assert lines == ["x" * 10 + "\n", "y" * 10]
+
+
+def test_csv_record_spanning_lines_is_capped() -> None:
+    # every line fits, the quoted record spanning them does not
+    body = 'first_name,last_name,dob\n"aaaa\nbbbb\ncccc\ndddd",x,2000-01-01\n'
+    with pytest.raises(HTTPException) as error:
+        run(collect(target_import.parse_csv(stream(body), max_length=25)))
+    assert error.value.status_code == 413
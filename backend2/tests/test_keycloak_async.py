@@ -0,0 +1,54 @@
+import asyncio
+import typing as tp
+
+import httpx
+import pytest
+
+from app.service.keycloak_async import AsyncKeycloakOpenID, KeycloakRequestError
+
+
+def make_client(responses: tp.List[tp.Any]) -> tp.Tuple[AsyncKeycloakOpenID, tp.List[str]]:
+    """Client answering each request with the next of ``responses``, an
+    exception to raise or a status code."""
+    sent: tp.List[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(request.method)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return httpx.Response(response, json={})
+
+    client = AsyncKeycloakOpenID("http://keycloak", "master", "api", max_retries=1, retry_backoff=0)
+    client._client = httpx.AsyncClient(
+        base_url="http://keycloak", transport=httpx.MockTransport(handler)
+    )
+    return client, sent
+
+
+@pytest.mark.parametrize(
+    "first", [httpx.ReadTimeout("read"), httpx.RemoteProtocolError("closed"), 502]
+)
+def test_get_retried(first: tp.Any) -> None:
+    client, sent = make_client([first, 200])
+    assert asyncio.run(client.userinfo("token")) == {}
+    assert sent == ["GET", "GET"]
+
+
+@pytest.mark.parametrize("first", [httpx.ConnectError("refused"), httpx.ConnectTimeout("connect")])
+def test_post_retried_when_not_sent(first: tp.Any) -> None:
+    client, sent = make_client([first, 200])
+    assert asyncio.run(client.refresh_token("refresh")) == {}
+    assert sent == ["POST", "POST"]
+
+
+@pytest.mark.parametrize(
+    "first, status_code",
+    [(httpx.ReadTimeout("read"), None), (httpx.RemoteProtocolError("closed"), None), (503, 503)],
+)
+def test_post_not_retried_once_sent(first: tp.Any, status_code: tp.Optional[int]) -> None:
+    client, sent = make_client([first, 200])
+    with pytest.raises(KeycloakRequestError) as error:
+        asyncio.run(client.logout("refresh"))
+    assert error.value.status_code == status_code
+    assert sent == ["POST"]
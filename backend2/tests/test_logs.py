@@ -0,0 +1,30 @@
+import json
+import threading
+import time
+import typing as tp
+
+from app.service.logs import LogWriter
+
+
+def test_entries_written_by_batches(tmp_path: tp.Any) -> None:
+    path = tmp_path / "api.log"
+    writer = LogWriter(str(path), console=False, batch_size=2, flush_interval=0.05)
+    for index in range(5):
+        writer.put({"message": str(index)})
+    writer.stop()
+    lines = path.read_text().splitlines()
+    assert [json.loads(line)["message"] for line in lines] == ["0", "1", "2", "3", "4"]
+
+
+def test_stop_with_a_full_queue_returns(tmp_path: tp.Any) -> None:
+    writer = LogWriter(str(tmp_path / "api.log"), console=False, queue_size=2)
+    blocked = threading.Event()
+    # the writer thread blocks on its first write, the queue then fills up
+    writer._write = lambda text: blocked.wait()  # type: ignore
+    for index in range(10):
+        writer.put({"message": str(index)})
+    time.sleep(0.1)
+    start = time.monotonic()
+    writer.stop(timeout=0.2)
+    assert time.monotonic() - start < 2
+    blocked.set()
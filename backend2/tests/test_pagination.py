@@ -0,0 +1,134 @@
+import base64
+from datetime import date
+import json
+import typing as tp
+
+from fastapi import HTTPException
+import pytest
+from sqlalchemy import select
+
+from app.database import models
+from app.database.crud import PICTURE_SORT_KEYS, TARGET_SORT_KEYS
+from app.database.pagination import Keyset
+from app.database.session import SessionLocal
+
+NAMES = ["Carol", "alice", "Bob", "Alice", "Bob", "Dave", "Bob"]
+
+
+@pytest.fixture
+def session(db: None) -> tp.Iterator[tp.Any]:
+    with SessionLocal() as session:
+        session.add_all(
+            models.Target(first_name=name, last_name="Doe", dob=date(1990, 1, 1 + index))
+            for index, name in enumerate(NAMES)
+        )
+        session.flush()
+        # target_id is nullable: every third picture has none
+        session.add_all(
+            models.Picture(path=f"/{index}.png", target_id=None if index % 3 == 0 else 1 + index % 4)
+            for index in range(10)
+        )
+        session.commit()
+        yield session
+
+
+def paginate(session: tp.Any, keyset: Keyset, model: tp.Any, limit: int) -> tp.List[tp.Any]:
+    """Read every page of ``limit`` rows, return the rows in page order."""
+    rows: tp.List[tp.Any] = []
+    cursor = None
+    while True:
+        query = select(model).order_by(*keyset.order_by()).limit(limit + 1)
+        if cursor:
+            query = query.where(keyset.after(cursor))
+        page = keyset.page(session.execute(query).scalars().all(), limit)
+        assert len(page.items) <= limit
+        rows.extend(page.items)
+        if page.next_cursor is None:
+            return rows
+        cursor = page.next_cursor
+
+
+def encode(payload: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("sort", ["id", "-id", "first_name", "-first_name", "dob", "-dob"])
+@pytest.mark.parametrize("limit", [1, 2, 3, 100])
+def test_pages_follow_sort_order(session: tp.Any, sort: str, limit: int) -> None:
+    keyset = Keyset(models.Target, sort, TARGET_SORT_KEYS)
+    name = sort.lstrip("-")
+    descending = sort.startswith("-")
+    targets = paginate(session, keyset, models.Target, limit)
+    expected = sorted(
+        session.execute(select(models.Target)).scalars().all(),
+        key=lambda target: (getattr(target, name), target.id),
+        reverse=descending,
+    )
+    # ties on the sort key are ordered by id in the same direction
+    assert [target.id for target in targets] == [target.id for target in expected]
+
+
+@pytest.mark.parametrize("sort", ["target_id", "-target_id"])
+@pytest.mark.parametrize("limit", [1, 2, 4])
+def test_nullable_sort_key_nulls_last(session: tp.Any, sort: str, limit: int) -> None:
+    keyset = Keyset(models.Picture, sort, PICTURE_SORT_KEYS)
+    assert keyset.nullable
+    descending = sort.startswith("-")
+    pictures = paginate(session, keyset, models.Picture, limit)
+    everything = session.execute(select(models.Picture)).scalars().all()
+    with_target = sorted(
+        (picture for picture in everything if picture.target_id is not None),
+        key=lambda picture: (picture.target_id, picture.id),
+        reverse=descending,
+    )
+    without_target = sorted(
+        (picture for picture in everything if picture.target_id is None),
+        key=lambda picture: picture.id,
+        reverse=descending,
+    )
+    assert [p.id for p in pictures] == [p.id for p in with_target + without_target]
+
+
+def test_cursor_round_trip(session: tp.Any) -> None:
+    keyset = Keyset(models.Target, "-dob", TARGET_SORT_KEYS)
+    target = session.get(models.Target, 3)
+    assert keyset._decode(keyset.cursor(target)) == (target.dob, 3)
+
+
+@pytest.mark.parametrize(
+    "sort, cursor",
+    [
+        ("first_name", "not base64!"),
+        ("first_name", base64.urlsafe_b64encode(b"not json").decode()),
+        ("first_name", encode({"s": "first_name", "v": "Bob"})),
+        ("first_name", encode({"s": "-first_name", "v": "Bob", "id": 1})),
+        ("first_name", encode({"s": "first_name", "v": "Bob", "id": "one"})),
+        ("first_name", encode({"s": "first_name", "v": {"a": 1}, "id": 1})),
+        ("first_name", encode({"s": "first_name", "v": ["Bob"], "id": 1})),
+        ("first_name", encode({"s": "first_name", "v": 1, "id": 1})),
+        ("first_name", encode({"s": "first_name", "v": None, "id": 1})),
+        ("dob", encode({"s": "dob", "v": "yesterday", "id": 1})),
+        ("dob", encode({"s": "dob", "v": 19900101, "id": 1})),
+        ("picture_count", encode({"s": "picture_count", "v": True, "id": 1})),
+        ("picture_count", encode({"s": "picture_count", "v": 1.5, "id": 1})),
+        ("id", encode({"s": "id", "v": "Bob", "id": 1})),
+    ],
+)
+def test_tampered_cursor_rejected(sort: str, cursor: str) -> None:
+    keyset = Keyset(models.Target, sort, TARGET_SORT_KEYS)
+    with pytest.raises(HTTPException) as error:
+        keyset.after(cursor)
+    assert error.value.status_code == 400
+
+
+def test_tampered_cursor_is_a_bad_request(client: tp.Any, api: str) -> None:
+    cursor = encode({"s": "first_name", "v": {"a": 1}, "id": 1})
+    response = client.get(f"{api}/targets", params={"sort": "first_name", "cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Invalid cursor")
+
+
+def test_unknown_sort_key_rejected() -> None:
+    with pytest.raises(HTTPException) as error:
+        Keyset(models.Target, "-version", TARGET_SORT_KEYS)
+    assert error.value.status_code == 400
@@ -0,0 +1,355 @@
+"""Local stand-in for the Keycloak OpenID Connect endpoints used by the backends.
+
+It serves the realm public key, JWKS, discovery, authorization, token
+(password, authorization_code and refresh_token grants), userinfo and logout
+endpoints of one realm, and mints RS256 tokens shaped like Keycloak's. The
+signing key is generated at startup, the sessions live in memory.
+
+Run it on its own, e.g. next to docker-compose::
+
+    python -m benchmarks.fake_oidc --port 8180
+
+and point ``KEYCLOAK_SERVER_URL`` / ``KEYCLOAK_SERVER_URL_CLIENT`` at
+``http://<host>:8180/``. ``benchmarks.load`` starts one by itself.
+
+Settings (environment):
+
+- ``FAKE_OIDC_REALM``, ``FAKE_OIDC_CLIENT_ID``, ``FAKE_OIDC_CLIENT_SECRET``:
+  realm and confidential client (an empty secret accepts any client secret)
+- ``FAKE_OIDC_USERS``: ``username:password:role1+role2`` entries separated by
+  commas
+- ``FAKE_OIDC_TOKEN_TTL`` / ``FAKE_OIDC_REFRESH_TTL``: lifetimes in seconds
+- ``FAKE_OIDC_LATENCY``: seconds added to every response, to emulate a remote
+  identity provider
+"""
+import argparse
+import asyncio
+import base64
+import os
+import secrets
+import threading
+import time
+import typing as tp
+import uuid
+from urllib.parse import urlencode
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Form, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response
+import jwt
+import uvicorn
+
+REALM = os.environ.get("FAKE_OIDC_REALM", "bench")
+CLIENT_ID = os.environ.get("FAKE_OIDC_CLIENT_ID", "fastapi-client")
+CLIENT_SECRET = os.environ.get("FAKE_OIDC_CLIENT_SECRET", "bench-secret")
+USERS = os.environ.get("FAKE_OIDC_USERS", "admin:admin:admin,user:user:user")
+TOKEN_TTL = int(os.environ.get("FAKE_OIDC_TOKEN_TTL", 300))
+REFRESH_TTL = int(os.environ.get("FAKE_OIDC_REFRESH_TTL", 1800))
+LATENCY = float(os.environ.get("FAKE_OIDC_LATENCY", 0))
+
+OIDC_PATH = "/realms/{realm}/protocol/openid-connect"
+
+
+class User(tp.NamedTuple):
+    username: str
+    password: str
+    roles: tp.List[str]
+    sub: str
+
+
+def parse_users(spec: str) -> tp.Dict[str, User]:
+    users = {}
+    for entry in filter(None, (entry.strip() for entry in spec.split(","))):
+        username, password, roles = (entry.split(":", 2) + ["", ""])[:3]
+        users[username] = User(
+            username,
+            password,
+            [role for role in roles.split("+") if role],
+            str(uuid.uuid5(uuid.NAMESPACE_URL, f"fake-oidc:{username}")),
+        )
+    return users
+
+
+class Provider:
+    """Signing key, users, pending authorization codes and live sessions."""
+
+    def __init__(self, users: tp.Dict[str, User]) -> None:
+        self.users = users
+        self.kid = secrets.token_hex(8)
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.jwk = jwt.algorithms.RSAAlgorithm.to_jwk(
+            self.private_key.public_key(), as_dict=True
+        )
+        self.jwk.update(kid=self.kid, use="sig", alg="RS256")
+        self._codes: tp.Dict[str, tp.Tuple[str, str, str]] = {}
+        self._sessions: tp.Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def public_key(self) -> str:
+        """Base64 DER public key, as in Keycloak's realm endpoint."""
+        der = self.private_key.public_key().public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        return base64.b64encode(der).decode()
+
+    def authenticate(self, username: tp.Optional[str], password: tp.Optional[str]) -> User:
+        user = self.users.get(username or "")
+        if user is None or not secrets.compare_digest(user.password, password or ""):
+            raise OIDCError("invalid_grant", "Invalid user credentials", status_code=401)
+        return user
+
+    def issue_code(self, username: str, redirect_uri: str) -> str:
+        code = secrets.token_urlsafe(24)
+        with self._lock:
+            self._codes[code] = (username, redirect_uri, self._open_session(username))
+        return code
+
+    def redeem_code(self, code: str, redirect_uri: tp.Optional[str]) -> tp.Tuple[User, str]:
+        with self._lock:
+            username, expected_uri, session_id = self._codes.pop(code, (None, None, None))
+        if username is None or (redirect_uri and redirect_uri != expected_uri):
+            raise OIDCError("invalid_grant", "Code not valid")
+        return self.users[username], session_id
+
+    def _open_session(self, username: str) -> str:
+        session_id = str(uuid.uuid4())
+        self._sessions[session_id] = username
+        return session_id
+
+    def login(self, user: User) -> str:
+        with self._lock:
+            return self._open_session(user.username)
+
+    def logout(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def session_user(self, session_id: tp.Optional[str]) -> tp.Optional[User]:
+        username = self._sessions.get(session_id or "")
+        return self.users.get(username) if username else None
+
+    def claims(self, token: str, token_type: str) -> dict:
+        try:
+            claims = jwt.decode(
+                token,
+                self.private_key.public_key(),
+                algorithms=["RS256"],
+                options={"verify_aud": False},
+            )
+        except jwt.PyJWTError as e:
+            raise OIDCError("invalid_token", str(e), status_code=401)
+        if claims.get("typ") != token_type or self.session_user(claims.get("sid")) is None:
+            raise OIDCError("invalid_token", "Session not active", status_code=401)
+        return claims
+
+    def _sign(self, claims: dict) -> str:
+        return jwt.encode(claims, self.private_key, "RS256", {"kid": self.kid})
+
+    def tokens(self, issuer: str, user: User, session_id: str) -> dict:
+        now = int(time.time())
+        common = {
+            "iss": issuer,
+            "sub": user.sub,
+            "azp": CLIENT_ID,
+            "iat": now,
+            "sid": session_id,
+            "session_state": session_id,
+        }
+        access = dict(
+            common,
+            jti=str(uuid.uuid4()),
+            exp=now + TOKEN_TTL,
+            typ="Bearer",
+            aud="account",
+            scope="openid email profile",
+            realm_access={"roles": user.roles},
+            preferred_username=user.username,
+            email=f"{user.username}@example.com",
+            name=user.username.title(),
+        )
+        refresh = dict(
+            common, jti=str(uuid.uuid4()), exp=now + REFRESH_TTL, typ="Refresh", aud=issuer
+        )
+        id_token = dict(access, typ="ID", aud=CLIENT_ID)
+        return {
+            "access_token": self._sign(access),
+            "expires_in": TOKEN_TTL,
+            "refresh_expires_in": REFRESH_TTL,
+            "refresh_token": self._sign(refresh),
+            "token_type": "Bearer",
+            "id_token": self._sign(id_token),
+            "not-before-policy": 0,
+            "session_state": session_id,
+            "scope": "openid email profile",
+        }
+
+
+class OIDCError(Exception):
+    def __init__(self, error: str, description: str, status_code: int = 400) -> None:
+        super().__init__(description)
+        self.error = error
+        self.description = description
+        self.status_code = status_code
+
+
+provider = Provider(parse_users(USERS))
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+
+@app.middleware("http")
+async def add_latency(request: Request, call_next: tp.Callable) -> Response:
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+    return await call_next(request)
+
+
+@app.exception_handler(OIDCError)
+async def oidc_error_handler(_: Request, exc: OIDCError) -> JSONResponse:
+    return JSONResponse(
+        {"error": exc.error, "error_description": exc.description}, status_code=exc.status_code
+    )
+
+
+def _check_realm(realm: str) -> None:
+    if realm != REALM:
+        raise HTTPException(status_code=404, detail="Realm not found")
+
+
+def _check_client(client_id: tp.Optional[str], client_secret: tp.Optional[str]) -> None:
+    if client_id != CLIENT_ID or (
+        CLIENT_SECRET and not secrets.compare_digest(CLIENT_SECRET, client_secret or "")
+    ):
+        raise OIDCError("unauthorized_client", "Invalid client credentials", status_code=401)
+
+
+def _issuer(request: Request, realm: str) -> str:
+    return f"{str(request.base_url).rstrip('/')}/realms/{realm}"
+
+
+@app.get("/realms/{realm}")
+def realm_info(realm: str, request: Request) -> dict:
+    _check_realm(realm)
+    oidc = _issuer(request, realm) + "/protocol/openid-connect"
+    return {
+        "realm": realm,
+        "public_key": provider.public_key,
+        "token-service": oidc,
+        "account-service": _issuer(request, realm) + "/account",
+        "tokens-not-before": 0,
+    }
+
+
+@app.get("/realms/{realm}/.well-known/openid-configuration")
+def discovery(realm: str, request: Request) -> dict:
+    _check_realm(realm)
+    issuer = _issuer(request, realm)
+    oidc = issuer + "/protocol/openid-connect"
+    return {
+        "issuer": issuer,
+        "authorization_endpoint": f"{oidc}/auth",
+        "token_endpoint": f"{oidc}/token",
+        "userinfo_endpoint": f"{oidc}/userinfo",
+        "end_session_endpoint": f"{oidc}/logout",
+        "jwks_uri": f"{oidc}/certs",
+        "grant_types_supported": ["authorization_code", "password", "refresh_token"],
+        "response_types_supported": ["code"],
+        "id_token_signing_alg_values_supported": ["RS256"],
+    }
+
+
+@app.get(OIDC_PATH + "/certs")
+def certs(realm: str) -> dict:
+    _check_realm(realm)
+    return {"keys": [provider.jwk]}
+
+
+@app.get(OIDC_PATH + "/auth")
+def authorize(
+    realm: str,
+    client_id: str,
+    redirect_uri: str,
+    state: tp.Optional[str] = None,
+    login_hint: tp.Optional[str] = None,
+) -> RedirectResponse:
+    """Log ``login_hint`` (default: the first user) in without a login form."""
+    _check_realm(realm)
+    if client_id != CLIENT_ID:
+        raise OIDCError("unauthorized_client", "Unknown client")
+    username = login_hint or next(iter(provider.users))
+    if username not in provider.users:
+        raise OIDCError("invalid_request", "Unknown user")
+    params = {"code": provider.issue_code(username, redirect_uri)}
+    if state is not None:
+        params["state"] = state
+    separator = "&" if "?" in redirect_uri else "?"
+    return RedirectResponse(f"{redirect_uri}{separator}{urlencode(params)}", status_code=302)
+
+
+@app.post(OIDC_PATH + "/token")
+def token(
+    realm: str,
+    request: Request,
+    grant_type: str = Form(...),
+    client_id: tp.Optional[str] = Form(None),
+    client_secret: tp.Optional[str] = Form(None),
+    username: tp.Optional[str] = Form(None),
+    password: tp.Optional[str] = Form(None),
+    code: tp.Optional[str] = Form(None),
+    redirect_uri: tp.Optional[str] = Form(None),
+    refresh_token: tp.Optional[str] = Form(None),
+) -> dict:
+    _check_realm(realm)
+    _check_client(client_id, client_secret)
+    if grant_type == "password":
+        user = provider.authenticate(username, password)
+        session_id = provider.login(user)
+    elif grant_type == "authorization_code":
+        user, session_id = provider.redeem_code(code or "", redirect_uri)
+    elif grant_type == "refresh_token":
+        claims = provider.claims(refresh_token or "", "Refresh")
+        session_id = claims["sid"]
+        user = provider.session_user(session_id)
+    else:
+        raise OIDCError("unsupported_grant_type", f"Unsupported grant_type {grant_type}")
+    return provider.tokens(_issuer(request, realm), user, session_id)
+
+
+@app.get(OIDC_PATH + "/userinfo")
+def userinfo(realm: str, authorization: str = Header("")) -> dict:
+    _check_realm(realm)
+    scheme, _, access_token = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        raise OIDCError("invalid_token", "Missing bearer token", status_code=401)
+    claims = provider.claims(access_token, "Bearer")
+    return {
+        key: claims[key]
+        for key in ("sub", "preferred_username", "email", "name")
+        if key in claims
+    }
+
+
+@app.post(OIDC_PATH + "/logout")
+def logout(
+    realm: str,
+    client_id: tp.Optional[str] = Form(None),
+    client_secret: tp.Optional[str] = Form(None),
+    refresh_token: str = Form(...),
+) -> Response:
+    _check_realm(realm)
+    _check_client(client_id, client_secret)
+    provider.logout(provider.claims(refresh_token, "Refresh")["sid"])
+    return Response(status_code=204)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8180)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
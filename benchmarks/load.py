@@ -0,0 +1,647 @@
+"""End-to-end load test of a backend against a local fake identity provider.
+
+Boots ``benchmarks.fake_oidc`` and ``app.main:app`` of ``backend`` or
+``backend2`` with uvicorn, migrates and seeds the database, then drives a
+mix of targets CRUD and OIDC traffic from ``--concurrency`` virtual users
+for ``--duration`` seconds (after ``--warmup`` seconds not recorded).
+Throughput and p50/p95/p99 latencies per route are printed and written to a
+JSON file, to be compared with ``benchmarks.report``::
+
+    python -m benchmarks.load --backend backend --mix mixed --concurrency 32
+    python -m benchmarks.load --backend backend2 --mix mixed --concurrency 32
+    python -m benchmarks.report benchmarks/results/<first>.json benchmarks/results/<second>.json
+
+The database is a fresh SQLite file unless ``--database-url`` is given, a
+Postgres database given there is truncated and reseeded by ``fake_data.py``.
+The routes are reported without their ``/api`` or ``/api2`` prefix so that
+the runs of both backends line up.
+"""
+import argparse
+import asyncio
+import datetime
+import os
+from pathlib import Path
+import platform
+import random
+import socket
+import string
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+import typing as tp
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+from benchmarks import report
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# API prefix of each backend (see backend2/app/main.py)
+BACKENDS = {"backend": "/api", "backend2": "/api2"}
+
+# relative weights of the operations
+MIXES = {
+    "read": {
+        "list": 30,
+        "list_pictures": 5,
+        "filter": 10,
+        "search": 10,
+        "read": 30,
+        "read_cached": 15,
+    },
+    "mixed": {
+        "list": 20,
+        "list_pictures": 5,
+        "filter": 5,
+        "search": 5,
+        "read": 25,
+        "read_cached": 10,
+        "create": 5,
+        "update": 5,
+        "add_picture": 3,
+        "delete": 2,
+        "oidc_login": 2,
+        "oidc_callback": 3,
+        "oidc_user": 5,
+        "oidc_refresh": 3,
+        "oidc_logout": 2,
+    },
+    "write": {"create": 30, "update": 30, "add_picture": 20, "delete": 10, "read": 10},
+    "auth": {
+        "oidc_login": 15,
+        "oidc_callback": 20,
+        "oidc_user": 30,
+        "oidc_refresh": 15,
+        "oidc_logout": 10,
+        "token": 10,
+    },
+}
+
+REALM = "bench"
+CLIENT_ID = "fastapi-client"
+CLIENT_SECRET = "bench-secret"
+USERNAME = PASSWORD = "admin"
+
+
+class Recorder:
+    """Latencies and errors per route, recorded once the warmup is over."""
+
+    def __init__(self) -> None:
+        self.latencies: tp.Dict[str, tp.List[float]] = {}
+        self.errors: tp.Dict[str, int] = {}
+        self.recording = False
+
+    def add(self, route: str, seconds: float, ok: bool) -> None:
+        if not self.recording:
+            return
+        self.latencies.setdefault(route, []).append(seconds)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self, duration: float) -> tp.Dict[str, tp.Dict[str, float]]:
+        return {
+            route: report.summarize(latencies, self.errors.get(route, 0), duration)
+            for route, latencies in self.latencies.items()
+        }
+
+
+class VirtualUser:
+    def __init__(self, tokens: dict) -> None:
+        self.access_token = tokens["access_token"]
+        self.refresh_token = tokens["refresh_token"]
+        self.etags: tp.Dict[int, str] = {}
+
+    @property
+    def headers(self) -> tp.Dict[str, str]:
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+
+class Context:
+    """State shared by the virtual users of a run."""
+
+    def __init__(
+        self, app: httpx.AsyncClient, oidc: httpx.AsyncClient, prefix: str, seed: int
+    ) -> None:
+        self.app = app
+        self.oidc = oidc
+        self.prefix = prefix
+        self.rng = random.Random(seed)
+        self.recorder = Recorder()
+        self.target_ids: tp.List[int] = []
+        self.last_names: tp.List[str] = []
+        self.first_names: tp.List[str] = []
+        # targets created by the run without pictures, which the run may delete
+        self.created: tp.List[int] = []
+        # refresh tokens of OIDC sessions opened by the run, which it may end
+        self.sessions: tp.List[str] = []
+
+    async def request(
+        self,
+        route: str,
+        method: str,
+        path: str,
+        user: tp.Optional[VirtualUser] = None,
+        expected: tp.Collection[int] = (200,),
+        **kwargs: tp.Any,
+    ) -> tp.Optional[httpx.Response]:
+        """Send a request to the app, record its latency under ``route``."""
+        if user is not None:
+            kwargs["headers"] = {**user.headers, **kwargs.get("headers", {})}
+        start = time.perf_counter()
+        try:
+            response = await self.app.request(method, self.prefix + path, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.add(route, time.perf_counter() - start, ok=False)
+            return None
+        self.recorder.add(route, time.perf_counter() - start, ok=response.status_code in expected)
+        return response if response.status_code in expected else None
+
+    def target_id(self) -> int:
+        return self.rng.choice(self.target_ids)
+
+    def person(self) -> dict:
+        return {
+            "first_name": self.rng.choice(self.first_names),
+            "last_name": self.rng.choice(self.last_names),
+            "dob": datetime.date(1970, 1, 1) + datetime.timedelta(days=self.rng.randrange(15000)),
+        }
+
+
+async def op_list(ctx: Context, user: VirtualUser) -> None:
+    sort = ctx.rng.choice(["id", "last_name", "-dob"])
+    await ctx.request("GET /targets", "GET", "/targets", user, params={"limit": 50, "sort": sort})
+
+
+async def op_list_pictures(ctx: Context, user: VirtualUser) -> None:
+    await ctx.request(
+        "GET /targets [include=pictures]",
+        "GET",
+        "/targets",
+        user,
+        params={"limit": 20, "include": "pictures"},
+    )
+
+
+async def op_filter(ctx: Context, user: VirtualUser) -> None:
+    await ctx.request(
+        "GET /targets [last_name]",
+        "GET",
+        "/targets",
+        user,
+        params={"limit": 50, "last_name": ctx.rng.choice(ctx.last_names)},
+    )
+
+
+async def op_search(ctx: Context, user: VirtualUser) -> None:
+    q = ctx.rng.choice(ctx.first_names + ctx.last_names)[:4].lower()
+    await ctx.request(
+        "GET /targets/search", "GET", "/targets/search", user, params={"q": q, "limit": 20}
+    )
+
+
+async def op_read(ctx: Context, user: VirtualUser) -> None:
+    target_id = ctx.target_id()
+    response = await ctx.request("GET /targets/{id}", "GET", f"/targets/{target_id}", user)
+    if response is not None and "etag" in response.headers:
+        user.etags[target_id] = response.headers["etag"]
+
+
+async def op_read_cached(ctx: Context, user: VirtualUser) -> None:
+    if not user.etags:
+        await op_read(ctx, user)
+        return
+    target_id, etag = ctx.rng.choice(list(user.etags.items()))
+    response = await ctx.request(
+        "GET /targets/{id} [If-None-Match]",
+        "GET",
+        f"/targets/{target_id}",
+        user,
+        expected=(200, 304),
+        headers={"If-None-Match": etag},
+    )
+    if response is not None and "etag" in response.headers:
+        user.etags[target_id] = response.headers["etag"]
+
+
+async def op_create(ctx: Context, user: VirtualUser) -> None:
+    response = await ctx.request(
+        "POST /targets", "POST", "/targets", user, json=_jsonable(ctx.person())
+    )
+    if response is not None:
+        ctx.created.append(response.json()["id"])
+
+
+async def op_update(ctx: Context, user: VirtualUser) -> None:
+    await ctx.request(
+        "PUT /targets/{id}",
+        "PUT",
+        f"/targets/{ctx.target_id()}",
+        user,
+        json=_jsonable(ctx.person()),
+    )
+
+
+async def op_add_picture(ctx: Context, user: VirtualUser) -> None:
+    path = "/bench/" + "".join(ctx.rng.choices(string.ascii_lowercase, k=12)) + ".jpg"
+    await ctx.request(
+        "POST /targets/{id}/pictures",
+        "POST",
+        f"/targets/{ctx.target_id()}/pictures",
+        user,
+        json={"path": path},
+    )
+
+
+async def op_delete(ctx: Context, user: VirtualUser) -> None:
+    if not ctx.created:
+        await op_create(ctx, user)
+        return
+    target_id = ctx.created.pop(ctx.rng.randrange(len(ctx.created)))
+    await ctx.request("DELETE /targets/{id}", "DELETE", f"/targets/{target_id}", user)
+
+
+async def op_oidc_login(ctx: Context, user: VirtualUser) -> None:
+    await ctx.request("GET /auth/oidc/login", "GET", "/auth/oidc/login")
+
+
+async def op_oidc_callback(ctx: Context, user: VirtualUser) -> None:
+    """Full authorization code flow, the identity provider leg isn't recorded."""
+    login = await ctx.request("GET /auth/oidc/login", "GET", "/auth/oidc/login")
+    if login is None:
+        return
+    redirect = await ctx.oidc.get(login.json()["auth_url"])
+    query = parse_qs(urlparse(redirect.headers.get("location", "")).query)
+    if "code" not in query:
+        ctx.recorder.add("GET /auth/oidc/callback", 0.0, ok=False)
+        return
+    response = await ctx.request(
+        "GET /auth/oidc/callback",
+        "GET",
+        "/auth/oidc/callback",
+        params={"code": query["code"][0], "state": query.get("state", [""])[0]},
+    )
+    if response is not None:
+        ctx.sessions.append(response.json()["refresh_token"])
+
+
+async def op_oidc_user(ctx: Context, user: VirtualUser) -> None:
+    await ctx.request("GET /auth/oidc/user", "GET", "/auth/oidc/user", user)
+
+
+async def op_oidc_refresh(ctx: Context, user: VirtualUser) -> None:
+    response = await ctx.request(
+        "POST /auth/oidc/refresh",
+        "POST",
+        "/auth/oidc/refresh",
+        params={"refresh_token": user.refresh_token},
+    )
+    if response is not None:
+        tokens = response.json()
+        user.access_token, user.refresh_token = tokens["access_token"], tokens["refresh_token"]
+
+
+async def op_oidc_logout(ctx: Context, user: VirtualUser) -> None:
+    if not ctx.sessions:
+        await op_oidc_callback(ctx, user)
+        return
+    refresh_token = ctx.sessions.pop()
+    await ctx.request(
+        "POST /auth/oidc/logout",
+        "POST",
+        "/auth/oidc/logout",
+        params={"refresh_token": refresh_token},
+    )
+
+
+async def op_token(ctx: Context, user: VirtualUser) -> None:
+    await ctx.request(
+        "POST /auth/token",
+        "POST",
+        "/auth/token",
+        data={"username": USERNAME, "password": PASSWORD},
+    )
+
+
+OPERATIONS: tp.Dict[str, tp.Callable[[Context, VirtualUser], tp.Awaitable[None]]] = {
+    "list": op_list,
+    "list_pictures": op_list_pictures,
+    "filter": op_filter,
+    "search": op_search,
+    "read": op_read,
+    "read_cached": op_read_cached,
+    "create": op_create,
+    "update": op_update,
+    "add_picture": op_add_picture,
+    "delete": op_delete,
+    "oidc_login": op_oidc_login,
+    "oidc_callback": op_oidc_callback,
+    "oidc_user": op_oidc_user,
+    "oidc_refresh": op_oidc_refresh,
+    "oidc_logout": op_oidc_logout,
+    "token": op_token,
+}
+
+
+def _jsonable(person: dict) -> dict:
+    return dict(person, dob=person["dob"].isoformat())
+
+
+def parse_mix(spec: str) -> tp.Dict[str, float]:
+    """Parse a mix name, or ``operation=weight`` pairs separated by commas."""
+    if spec in MIXES:
+        return MIXES[spec]
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                f"Unknown operation {name.strip()!r}, expected one of {sorted(OPERATIONS)}"
+            )
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+async def virtual_user(
+    ctx: Context, user: VirtualUser, mix: tp.Dict[str, float], deadline: float
+) -> None:
+    operations = [OPERATIONS[name] for name in mix]
+    weights = list(mix.values())
+    while time.perf_counter() < deadline:
+        await ctx.rng.choices(operations, weights)[0](ctx, user)
+
+
+async def sample_targets(ctx: Context, user: VirtualUser, count: int) -> None:
+    """Collect the ids and names the operations pick from."""
+    cursor = None
+    while len(ctx.target_ids) < count:
+        params = {"limit": min(count - len(ctx.target_ids), 1000)}
+        if cursor:
+            params["cursor"] = cursor
+        response = await ctx.app.get(ctx.prefix + "/targets", params=params, headers=user.headers)
+        response.raise_for_status()
+        for target in response.json():
+            ctx.target_ids.append(target["id"])
+            ctx.first_names.append(target["first_name"])
+            ctx.last_names.append(target["last_name"])
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    if not ctx.target_ids:
+        raise SystemExit("No targets to load test, seed the database (--targets)")
+
+
+async def login(oidc: httpx.AsyncClient) -> dict:
+    response = await oidc.post(
+        f"/realms/{REALM}/protocol/openid-connect/token",
+        data={
+            "grant_type": "password",
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "username": USERNAME,
+            "password": PASSWORD,
+        },
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def run(args: argparse.Namespace, app_url: str, oidc_url: str) -> dict:
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(
+        max_connections=args.concurrency, max_keepalive_connections=args.concurrency
+    )
+    async with httpx.AsyncClient(
+        base_url=app_url, limits=limits, timeout=args.timeout
+    ) as app, httpx.AsyncClient(base_url=oidc_url, timeout=args.timeout) as oidc:
+        ctx = Context(app, oidc, BACKENDS[args.backend], args.seed)
+        users = [VirtualUser(await login(oidc)) for _ in range(args.concurrency)]
+        await sample_targets(ctx, users[0], args.sample)
+
+        start = time.perf_counter()
+        deadline = start + args.warmup + args.duration
+        loop = asyncio.get_running_loop()
+        loop.call_later(args.warmup, setattr, ctx.recorder, "recording", True)
+        await asyncio.gather(*(virtual_user(ctx, user, mix, deadline) for user in users))
+        duration = time.perf_counter() - start - args.warmup
+
+    routes = ctx.recorder.summary(duration)
+    latencies = [seconds for values in ctx.recorder.latencies.values() for seconds in values]
+    return {
+        "meta": {
+            "backend": args.backend,
+            "commit": _commit(),
+            "database": _database(args),
+            "database_mode": os.environ.get("DATABASE_MODE", "sync"),
+            "mix": mix if args.mix not in MIXES else args.mix,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "duration": round(duration, 3),
+            "warmup": args.warmup,
+            "targets": args.targets,
+            "oidc_latency": args.oidc_latency,
+            "python": platform.python_version(),
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "total": report.summarize(latencies, sum(ctx.recorder.errors.values()), duration),
+        "routes": routes,
+    }
+
+
+def _database(args: argparse.Namespace) -> str:
+    if args.app_url:
+        return "unknown"
+    return args.database_url.split(":", 1)[0] if args.database_url else "sqlite"
+
+
+def _commit() -> str:
+    try:
+        commit = subprocess.run(  # nosec
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(  # nosec
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{' '.join(map(str, process.args))} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} not ready after {timeout}s")
+
+
+def _start(command: tp.List[str], cwd: Path, env: dict, log: Path) -> subprocess.Popen:
+    with open(log, "ab") as output:
+        return subprocess.Popen(  # nosec
+            command, cwd=cwd, env=env, stdout=output, stderr=subprocess.STDOUT
+        )
+
+
+def _stop(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def prepare_database(args: argparse.Namespace, backend_dir: Path, env: dict, workdir: Path) -> None:
+    log = workdir / "setup.log"
+    steps = [[sys.executable, "-m", "alembic", "upgrade", "head"]]
+    if args.targets:
+        steps.append(
+            [
+                sys.executable,
+                "fake_data.py",
+                "--targets",
+                str(args.targets),
+                "--pictures-per-target",
+                str(args.pictures_per_target),
+                "--pictures-distribution",
+                "poisson",
+                "--seed",
+                str(args.seed),
+            ]
+        )
+    for command in steps:
+        with open(log, "ab") as output:
+            result = subprocess.run(  # nosec
+                command, cwd=backend_dir, env=env, stdout=output, stderr=subprocess.STDOUT
+            )
+        if result.returncode:
+            raise SystemExit(f"{' '.join(command)} failed, see {log}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="backend")
+    parser.add_argument(
+        "--mix",
+        default="mixed",
+        help=f"one of {sorted(MIXES)}, or operation=weight pairs, operations: {sorted(OPERATIONS)}",
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="recorded seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before recording")
+    parser.add_argument("--timeout", type=float, default=30, help="request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--database-url", help="database of the app (default: a fresh SQLite file)"
+    )
+    parser.add_argument(
+        "--targets", type=int, default=1000, help="targets seeded, 0 to keep the data"
+    )
+    parser.add_argument("--pictures-per-target", type=int, default=3)
+    parser.add_argument(
+        "--sample", type=int, default=1000, help="target ids the operations pick from"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the app")
+    parser.add_argument(
+        "--oidc-latency", type=float, default=0, help="seconds added by the identity provider"
+    )
+    parser.add_argument(
+        "--app-url",
+        help="load test an already running app instead (its Keycloak must be --oidc-url)",
+    )
+    parser.add_argument("--oidc-url", help="already running benchmarks.fake_oidc")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/...)")
+    parser.add_argument("--workdir", help="directory of the database and logs (default: temporary)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    backend_dir = ROOT / args.backend
+    processes = []
+    try:
+        oidc_url = args.oidc_url
+        if not oidc_url:
+            port = _free_port()
+            oidc_url = f"http://127.0.0.1:{port}"
+            oidc_env = dict(
+                os.environ,
+                FAKE_OIDC_REALM=REALM,
+                FAKE_OIDC_CLIENT_ID=CLIENT_ID,
+                FAKE_OIDC_CLIENT_SECRET=CLIENT_SECRET,
+                FAKE_OIDC_USERS=f"{USERNAME}:{PASSWORD}:admin",
+                # no token expires during the run
+                FAKE_OIDC_TOKEN_TTL=str(int(args.warmup + args.duration + 300)),
+                FAKE_OIDC_LATENCY=str(args.oidc_latency),
+            )
+            command = [sys.executable, "-m", "uvicorn", "benchmarks.fake_oidc:app"]
+            command += ["--port", str(port), "--log-level", "warning"]
+            processes.append(_start(command, ROOT, oidc_env, workdir / "fake_oidc.log"))
+            _wait_ready(f"{oidc_url}/realms/{REALM}", processes[-1])
+
+        app_url = args.app_url
+        if not app_url:
+            env = dict(
+                os.environ,
+                PYTHONPATH=".",
+                DATABASE_URL=args.database_url or f"sqlite:///{workdir / 'bench.db'}",
+                KEYCLOAK_SERVER_URL=f"{oidc_url}/",
+                KEYCLOAK_SERVER_URL_CLIENT=f"{oidc_url}/",
+                KEYCLOAK_REALM_NAME=REALM,
+                KEYCLOAK_CLIENT_ID=CLIENT_ID,
+                KEYCLOAK_CLIENT_SECRET_KEY=CLIENT_SECRET,
+            )
+            prepare_database(args, backend_dir, env, workdir)
+            port = _free_port()
+            app_url = f"http://127.0.0.1:{port}"
+            command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)]
+            command += ["--workers", str(args.workers), "--log-level", "warning"]
+            processes.append(_start(command, backend_dir, env, workdir / "app.log"))
+            _wait_ready(app_url + BACKENDS[args.backend], processes[-1])
+
+        results = asyncio.run(run(args, app_url, oidc_url))
+    finally:
+        for process in reversed(processes):
+            _stop(process)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{args.backend}-{results['meta']['commit']}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report.save(str(output), results)
+    print(report.format_table(results["routes"]))
+    total = results["total"]
+    print(
+        f"\ntotal: {total['requests']} requests, {total['errors']} errors, "
+        f"{total['throughput']:.1f} req/s, p50 {total['p50_ms']:.1f} ms, "
+        f"p95 {total['p95_ms']:.1f} ms, p99 {total['p99_ms']:.1f} ms"
+    )
+    print(f"results: {output}\nlogs: {workdir}")
+
+
+if __name__ == "__main__":
+    main()
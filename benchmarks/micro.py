@@ -0,0 +1,259 @@
+"""Micro-benchmarks of the per-request hot paths of a backend.
+
+Times, in process and without HTTP:
+
+- ``verify_token``: RS256 decode and verification (token cache miss), and
+  the token cache hit
+- ``verify_permission``: role check, granted and denied
+- ``schemas.Target.from_orm`` of a target with 0, 10 and 100 pictures, its
+  ``jsonable_encoder`` rendering, and the ``FAST_SERIALIZATION`` rendering
+- ``crud.get_targets`` with limits 10, 100 and 1000, and with the pictures
+
+Each benchmark is timed ``--repeat`` times over a number of calls
+calibrated to last about 0.2 s, the median per-call time is kept::
+
+    python -m benchmarks.micro --save-baseline      # on the reference commit
+    python -m benchmarks.micro --compare            # on the commit to check
+
+``--compare`` flags the benchmarks slower than the baseline by more than
+``--threshold`` and exits with status 1 if any is. Baselines are only
+comparable on the same machine, they are kept out of git in
+``benchmarks/results/``.
+"""
+import argparse
+import datetime
+import os
+from pathlib import Path
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+import typing as tp
+
+from benchmarks import report
+from benchmarks.load import BACKENDS, ROOT, RESULTS_DIR, _commit
+
+DEFAULT_BASELINE = RESULTS_DIR / "micro-baseline.json"
+
+PICTURE_COUNTS = (0, 10, 100)
+LIMITS = (10, 100, 1000)
+
+
+class Benchmark(tp.NamedTuple):
+    name: str
+    function: tp.Callable[[], tp.Any]
+
+
+def measure(function: tp.Callable[[], tp.Any], repeat: int) -> tp.Dict[str, float]:
+    """Return the median and min per-call time of ``function`` in microseconds."""
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    # autorange stops at 0.2 s, call counts are powers of 10 times 1, 2 or 5
+    number = max(int(number * 0.2 / elapsed), 1) if elapsed else number
+    timings = [seconds / number * 1e6 for seconds in timer.repeat(repeat, number)]
+    return {
+        "median_us": statistics.median(timings),
+        "min_us": min(timings),
+        "calls": number,
+        "repeat": repeat,
+    }
+
+
+def auth_benchmarks() -> tp.List[Benchmark]:
+    from fastapi import HTTPException
+    from fastapi.security import HTTPAuthorizationCredentials
+
+    from app.service import keycloak
+    from app.service.jwks import JWKSCache
+    from app.service.token_cache import TokenCache
+    from benchmarks.fake_oidc import Provider, parse_users
+
+    provider = Provider(parse_users("admin:admin:admin"))
+    user = provider.users["admin"]
+    tokens = provider.tokens("http://localhost/realms/bench", user, provider.login(user))
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=tokens["access_token"])
+    # the signing keys are loaded once, as by the background refresh
+    keycloak.jwks_cache = JWKSCache(lambda: {"keys": [provider.jwk]}, refresh_interval=0)
+    uncached, cached = TokenCache(max_entries=0), TokenCache()
+    keycloak.token_cache = cached
+    claims = keycloak.verify_token(credentials)
+
+    def verify_uncached() -> None:
+        keycloak.token_cache = uncached
+        keycloak.verify_token(credentials)
+
+    def verify_cached() -> None:
+        keycloak.token_cache = cached
+        keycloak.verify_token(credentials)
+
+    allow = keycloak.verify_permission(required_roles=["admin"])
+    deny = keycloak.verify_permission(required_roles=["auditor"])
+
+    def denied() -> None:
+        try:
+            deny(claims)
+        except HTTPException:
+            pass
+
+    return [
+        Benchmark("verify_token [RS256]", verify_uncached),
+        Benchmark("verify_token [cached]", verify_cached),
+        Benchmark("verify_permission [granted]", lambda: allow(claims)),
+        Benchmark("verify_permission [denied]", denied),
+    ]
+
+
+def serialization_benchmarks() -> tp.List[Benchmark]:
+    from fastapi.encoders import jsonable_encoder
+    import orjson
+
+    from app.database import models, schemas
+    from app.router.serialization import target_serializer
+
+    benchmarks = []
+    for count in PICTURE_COUNTS:
+        target = models.Target(
+            id=1, first_name="Jane", last_name="Doe", dob=datetime.date(1990, 1, 1)
+        )
+        target.pictures = [
+            models.Picture(id=index, path=f"/pictures/{index}.jpg", target_id=1)
+            for index in range(count)
+        ]
+        benchmarks += [
+            Benchmark(
+                f"Target.from_orm [{count} pictures]",
+                lambda target=target: schemas.Target.from_orm(target),
+            ),
+            Benchmark(
+                f"jsonable_encoder(Target) [{count} pictures]",
+                lambda target=target: jsonable_encoder(schemas.Target.from_orm(target)),
+            ),
+            Benchmark(
+                f"orjson(target_serializer) [{count} pictures]",
+                lambda target=target: orjson.dumps(target_serializer()(target)),
+            ),
+        ]
+    return benchmarks
+
+
+def crud_benchmarks(seed_targets: int) -> tp.List[Benchmark]:
+    from app.database import crud, schemas
+    from app.database.session import Base, SessionLocal, engine
+
+    if seed_targets:
+        Base.metadata.create_all(engine)
+        with SessionLocal() as db:
+            crud.create_targets_bulk(
+                db,
+                [
+                    schemas.TargetBulkIn(
+                        first_name=f"First{index}",
+                        last_name=f"Last{index % 100}",
+                        dob=datetime.date(1970, 1, 1) + datetime.timedelta(days=index),
+                        pictures=[{"path": f"/pictures/{index}-{n}.jpg"} for n in range(3)],
+                    )
+                    for index in range(seed_targets)
+                ],
+            )
+
+    def get_targets(**kwargs: tp.Any) -> None:
+        # one session per call, as per request
+        with SessionLocal() as db:
+            crud.get_targets(db, **kwargs)
+
+    benchmarks = [
+        Benchmark(f"crud.get_targets [limit={limit}]", lambda limit=limit: get_targets(limit=limit))
+        for limit in LIMITS
+    ]
+    benchmarks.append(
+        Benchmark(
+            "crud.get_targets [limit=100, pictures]",
+            lambda: get_targets(limit=100, include={"pictures"}),
+        )
+    )
+    return benchmarks
+
+
+def run(args: argparse.Namespace) -> dict:
+    benchmarks = auth_benchmarks() + serialization_benchmarks()
+    benchmarks += crud_benchmarks(0 if args.database_url else max(LIMITS))
+    selected = [
+        benchmark
+        for benchmark in benchmarks
+        if not args.filter or any(text in benchmark.name for text in args.filter)
+    ]
+    results = {}
+    for benchmark in selected:
+        results[benchmark.name] = measure(benchmark.function, args.repeat)
+        print(f"{benchmark.name:45} {results[benchmark.name]['median_us']:12.2f} us", flush=True)
+    return {
+        "meta": {
+            "backend": args.backend,
+            "commit": _commit(),
+            "database": args.database_url.split(":", 1)[0] if args.database_url else "sqlite",
+            "python": platform.python_version(),
+            "machine": platform.node(),
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "benchmarks": results,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="backend")
+    parser.add_argument("--repeat", type=int, default=5, help="timings per benchmark")
+    parser.add_argument(
+        "--filter", action="append", help="only run the benchmarks whose name contains this"
+    )
+    parser.add_argument(
+        "--database-url",
+        help="seeded database of the crud benchmarks (default: a fresh SQLite file)",
+    )
+    parser.add_argument("--output", help="result file (default: benchmarks/results/...)")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="baseline file")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--save-baseline", action="store_true", help="write the results as the baseline"
+    )
+    mode.add_argument(
+        "--compare", action="store_true", help="compare the results to the baseline"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="relative slowdown flagged as a regression"
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="micro-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/micro.db"
+    sys.path.insert(0, str(ROOT / args.backend))
+
+    results = run(args)
+    started = datetime.datetime.now()
+    name = f"micro-{started:%Y%m%d-%H%M%S}-{args.backend}-{results['meta']['commit']}"
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{name}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report.save(str(output), results)
+    print(f"results: {output}")
+
+    if args.save_baseline:
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        report.save(args.baseline, results)
+        print(f"baseline: {args.baseline}")
+    if args.compare:
+        baseline = report.load(args.baseline)
+        rows = report.compare(
+            baseline["benchmarks"], results["benchmarks"], "median_us", args.threshold
+        )
+        print(f"\nbaseline: commit={baseline['meta']['commit']}\n")
+        print(report.format_comparison(rows, "median_us", label="benchmark"))
+        return 1 if any(row[-1] for row in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,135 @@
+"""Latency summaries of benchmark runs, and comparison of two result files.
+
+Compare two runs (e.g. two commits, or ``backend`` and ``backend2``)::
+
+    python -m benchmarks.report base.json new.json
+"""
+import argparse
+import json
+import math
+import typing as tp
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(ordered: tp.Sequence[float], q: float) -> float:
+    """Return the ``q``-th percentile of sorted values (nearest rank)."""
+    if not ordered:
+        return math.nan
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(latencies: tp.Iterable[float], errors: int, duration: float) -> tp.Dict[str, float]:
+    """Summarize the latencies (seconds) of the requests to a route, in milliseconds."""
+    ordered = sorted(latencies)
+    summary = {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput": len(ordered) / duration if duration else 0.0,
+        "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else math.nan,
+        "max_ms": ordered[-1] * 1000 if ordered else math.nan,
+    }
+    for q in PERCENTILES:
+        summary[f"p{q}_ms"] = percentile(ordered, q) * 1000
+    return summary
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(path: str, results: dict) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def format_table(routes: tp.Dict[str, tp.Dict[str, float]]) -> str:
+    """Return a fixed-width table of the route summaries."""
+    header = ("route", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms")
+    rows = [
+        (
+            route,
+            str(summary["requests"]),
+            str(summary["errors"]),
+            f"{summary['throughput']:.1f}",
+            *(f"{summary[f'p{q}_ms']:.1f}" for q in PERCENTILES),
+        )
+        for route, summary in sorted(routes.items())
+    ]
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+    lines = []
+    for row in [header, *rows]:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        lines.append("  ".join(cells))
+    return "\n".join(lines)
+
+
+def compare(
+    base: tp.Dict[str, tp.Dict[str, float]],
+    new: tp.Dict[str, tp.Dict[str, float]],
+    metric: str = "p95_ms",
+    threshold: float = 0.10,
+) -> tp.List[tp.Tuple[str, float, float, float, bool]]:
+    """Compare ``metric`` of the routes found in both runs.
+
+    Returns (route, base, new, relative change, regressed) tuples, a route
+    regresses when ``metric`` grew by more than ``threshold`` (lower is
+    better, except for ``throughput``).
+    """
+    higher_is_better = metric == "throughput"
+    rows = []
+    for route in sorted(base.keys() & new.keys()):
+        before, after = base[route][metric], new[route][metric]
+        if not before or math.isnan(before) or math.isnan(after):
+            continue
+        change = (after - before) / before
+        regressed = -change > threshold if higher_is_better else change > threshold
+        rows.append((route, before, after, change, regressed))
+    return rows
+
+
+def format_comparison(
+    rows: tp.List[tp.Tuple[str, float, float, float, bool]], metric: str, label: str = "route"
+) -> str:
+    width = max([len(label)] + [len(row[0]) for row in rows])
+    lines = [f"{label.ljust(width)}  {'base':>10}  {'new':>10}  {'change':>8}  ({metric})"]
+    for route, before, after, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        lines.append(f"{route.ljust(width)}  {before:10.2f}  {after:10.2f}  {change:+8.1%}{flag}")
+    return "\n".join(lines)
+
+
+def _describe(results: dict) -> str:
+    meta = results.get("meta", {})
+    return " ".join(
+        f"{key}={meta[key]}" for key in ("backend", "commit", "database", "mix") if key in meta
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base", help="result file of the reference run")
+    parser.add_argument("new", help="result file of the run to compare")
+    parser.add_argument(
+        "--metric",
+        default="p95_ms",
+        choices=("throughput", "mean_ms", "p50_ms", "p95_ms", "p99_ms"),
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="relative change flagged as a regression"
+    )
+    args = parser.parse_args()
+
+    base, new = load(args.base), load(args.new)
+    print(f"base: {_describe(base)}\nnew:  {_describe(new)}\n")
+    rows = compare(base["routes"], new["routes"], args.metric, args.threshold)
+    print(format_comparison(rows, args.metric))
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())